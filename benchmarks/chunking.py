@@ -0,0 +1,72 @@
+"""Compares the legal chunker with the recursive character splitter on the bundled PDFs.
+
+Usage:
+    poetry run python -m benchmarks.chunking
+
+No model is needed: the PDFs are parsed once and split by both chunkers. The
+number of characters is the text sent to the embedding model, and the
+cross-article chunks are those holding the end of one article and the start
+of another (or a piece of one in the middle of the other).
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+def percentile(ordered: list[int], value: float) -> int:
+    return ordered[min(len(ordered) - 1, max(0, round(value / 100 * len(ordered)) - 1))] if ordered else 0
+
+def chunk_stats(chunks: list, seconds: float) -> dict:
+    from legal_assistant.legal_chunker import ARTICLE_PATTERN
+
+    sizes = sorted(len(chunk.page_content) for chunk in chunks)
+    cross_article = 0
+    for chunk in chunks:
+        text = chunk.page_content
+        # An article starting after the beginning of the chunk means the chunk spans two of them,
+        # unless the chunker grouped whole short articles on purpose
+        starts = [position for position in range(len(text)) if text.startswith("Art. ", position)
+                  and ARTICLE_PATTERN.match(text[position:position + 20])]
+        if starts and (starts[0] > 0 or len(starts) > 1) and "last_article" not in chunk.metadata:
+            cross_article += 1
+    return {
+        "chunks": len(chunks),
+        "characters": sum(sizes),
+        "mean_chars": sum(sizes) / len(sizes) if sizes else 0.0,
+        "p95_chars": percentile(sizes, 95),
+        "cross_article_chunks": cross_article,
+        "with_article_metadata": sum(1 for chunk in chunks if "article" in chunk.metadata),
+        "seconds": seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Legal chunker vs. recursive splitter on the bundled documents.")
+    parser.add_argument("--documents", nargs="+", help="PDF file names (default: all in the documents directory).")
+    parser.add_argument("--json", type=Path, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    from legal_assistant.database import load_documents, split_documents
+
+    started_at = time.perf_counter()
+    pages = list(load_documents(args.documents))
+    report = {"pages": len(pages), "load_seconds": time.perf_counter() - started_at}
+
+    for chunker in ("recursive", "legal"):
+        # Both splitters may modify the page documents, so each one gets its own copies
+        copies = [page.model_copy(deep=True) for page in pages]
+        started_at = time.perf_counter()
+        chunks = list(split_documents(copies, chunker))
+        report[chunker] = chunk_stats(chunks, time.perf_counter() - started_at)
+
+    recursive, legal = report["recursive"], report["legal"]
+    report["chunk_reduction"] = 1 - legal["chunks"] / recursive["chunks"] if recursive["chunks"] else 0.0
+    report["embedding_chars_reduction"] = 1 - legal["characters"] / recursive["characters"] if recursive["characters"] else 0.0
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
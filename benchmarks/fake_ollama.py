@@ -0,0 +1,189 @@
+"""Deterministic stand-in for the Ollama HTTP API used by the benchmarks.
+
+It implements the endpoints called by langchain_ollama (generate, embed) with
+configurable latencies, so the whole pipeline can be measured without models.
+Anonymization requests are answered with the data found by the PII rules plus
+capitalized name pairs, optionally truncated and, when no JSON schema is
+requested, wrapped in chatty text, to exercise the salvage and retry paths.
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from legal_assistant.pii_rules import extract_with_rules
+
+NAME_PATTERN = re.compile(r"\b[A-ZÀ-Ý][a-zà-ÿ]+(?:\s+(?:de|da|do|dos|das)?\s*[A-ZÀ-Ý][a-zà-ÿ]+)+")
+PLACEHOLDER_PATTERN = re.compile(r"\[[A-Z0-9_]+\]")
+
+class FakeOllamaSettings:
+    def __init__(self, prefill_seconds_per_1k_chars=0.05, token_seconds=0.01, embed_seconds_per_text=0.002,
+                 embedding_dim=768, malformed_rate=0.0, chatty_rate=0.5, seed=0):
+        self.prefill_seconds_per_1k_chars = prefill_seconds_per_1k_chars
+        self.token_seconds = token_seconds
+        self.embed_seconds_per_text = embed_seconds_per_text
+        self.embedding_dim = embedding_dim
+        self.malformed_rate = malformed_rate
+        self.chatty_rate = chatty_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"generate": 0, "anonymize": 0, "malformed": 0, "embed_texts": 0, "cached_prompt_chars": 0}
+        # Last prompt of each model, to simulate the reuse of the KV cache for a common prefix
+        self.last_prompts = {}
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def cached_prefix(self, model: str, prompt: str) -> int:
+        with self.lock:
+            previous = self.last_prompts.get(model, "")
+            self.last_prompts[model] = prompt
+        cached = len(os.path.commonprefix([previous, prompt]))
+        self.stats["cached_prompt_chars"] += cached
+        return cached
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    # Bag of hashed words, so texts that share words get similar vectors
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+def anonymization_output(user_text: str, settings: FakeOllamaSettings, constrained: bool = False) -> str:
+    dados = extract_with_rules(user_text)["dados"]
+    known_values = {item["valor"] for item in dados}
+    for match in NAME_PATTERN.finditer(user_text):
+        if match.group(0) not in known_values:
+            dados.append({"categoria": "nome", "valor": match.group(0)})
+    output = json.dumps({"dados": dados}, ensure_ascii=False)
+    if settings.roll(settings.malformed_rate):
+        # Constrained output can still be cut short; free text may also lose a closing bracket
+        settings.stats["malformed"] += 1
+        output = output[:-2]
+    if not constrained and settings.roll(settings.chatty_rate):
+        output = f"Aqui estão os dados encontrados:\n{output}\nEspero ter ajudado."
+    return output
+
+def generation_output(prompt: str) -> str:
+    question = prompt.rsplit("Pergunta:", 1)[-1]
+    placeholders = " ".join(dict.fromkeys(PLACEHOLDER_PATTERN.findall(question)))
+    return (
+        f"Olá {placeholders}. Para esse procedimento, compareça ao cartório de registro civil com um documento "
+        "de identificação com foto e a documentação indicada na legislação. O prazo e os valores dependem "
+        "do estado, conforme as normas aplicáveis informadas no contexto."
+    ).replace("  ", " ")
+
+def make_handler(settings: FakeOllamaSettings):
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": []})
+            elif self.path == "/api/version":
+                self._send_json({"version": "0.0.0-fake"})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/api/generate":
+                self._generate(request)
+            elif self.path == "/api/embed":
+                self._embed(request)
+            elif self.path == "/api/embeddings":
+                self._send_json({"embedding": fake_embedding(request.get("prompt", ""), settings.embedding_dim)})
+            else:
+                self.send_error(404)
+
+        def _embed(self, request: dict):
+            texts = request.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            settings.stats["embed_texts"] += len(texts)
+            time.sleep(settings.embed_seconds_per_text * len(texts))
+            self._send_json({
+                "model": request.get("model"),
+                "embeddings": [fake_embedding(text, settings.embedding_dim) for text in texts],
+            })
+
+        def _generate(self, request: dict):
+            prompt = request.get("system", "") + request.get("prompt", "")
+            is_anonymization = "[INST]" in prompt
+            settings.stats["anonymize" if is_anonymization else "generate"] += 1
+            constrained = isinstance(request.get("format"), dict)
+            user_text = request.get("prompt", "").rsplit("Human:", 1)[-1]
+            output = anonymization_output(user_text, settings, constrained) if is_anonymization else generation_output(prompt)
+            tokens = re.findall(r"\S+\s*|\s+", output)
+            if request.get("options", {}).get("num_predict") == 1:
+                tokens = tokens[:1]
+
+            evaluated_chars = len(prompt) - settings.cached_prefix(request.get("model"), prompt)
+            prefill_seconds = settings.prefill_seconds_per_1k_chars * evaluated_chars / 1000
+            time.sleep(prefill_seconds)
+            final = {
+                "model": request.get("model"), "created_at": "", "response": "", "done": True, "done_reason": "stop",
+                "prompt_eval_count": max(evaluated_chars // 3, 1), "prompt_eval_duration": int(prefill_seconds * 1e9),
+                "eval_count": len(tokens), "eval_duration": int(len(tokens) * settings.token_seconds * 1e9),
+            }
+            if not request.get("stream", True):
+                time.sleep(settings.token_seconds * len(tokens))
+                self._send_json({**final, "response": output})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(settings.token_seconds)
+                self.wfile.write(json.dumps({"model": request.get("model"), "created_at": "", "response": token, "done": False}).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            self.wfile.write(json.dumps(final).encode("utf-8") + b"\n")
+
+    return FakeOllamaHandler
+
+def start_server(settings: FakeOllamaSettings, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks.")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--prefill-seconds-per-1k-chars", type=float, default=0.05)
+    parser.add_argument("--token-seconds", type=float, default=0.01)
+    parser.add_argument("--embed-seconds-per-text", type=float, default=0.002)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    settings = FakeOllamaSettings(
+        prefill_seconds_per_1k_chars=args.prefill_seconds_per_1k_chars, token_seconds=args.token_seconds,
+        embed_seconds_per_text=args.embed_seconds_per_text, malformed_rate=args.malformed_rate, seed=args.seed
+    )
+    server = start_server(settings, port=args.port)
+    print(f"Fake Ollama listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
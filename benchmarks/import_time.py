@@ -0,0 +1,70 @@
+"""Checks that the entry points import within a time budget.
+
+Usage:
+    poetry run python -m benchmarks.import_time --budget-ms 300
+
+Each module is imported in a fresh interpreter with `-X importtime`. The check
+fails (exit code 1) when the cumulative import time of a module exceeds the
+budget, and lists the imports that took the most time.
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+DEFAULT_MODULES = ["legal_assistant.__main__", "legal_assistant.app"]
+
+def measure_import(module: str) -> dict[str, int]:
+    """Returns the cumulative import time, in microseconds, of every module imported by `module`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        error = "\n".join(line for line in completed.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"Failed to import {module}:\n{error}")
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if cumulative_us.strip().isdigit():
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget of the legal assistant entry points.")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=300.0)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports listed per module.")
+    args = parser.parse_args()
+
+    report = {"budget_ms": args.budget_ms, "modules": {}}
+    over_budget = []
+    for module in args.modules:
+        cumulative = measure_import(module)
+        total_ms = cumulative.get(module, 0) / 1000
+        # Only the top-level packages, so a package and its own submodules are not listed twice
+        top_level = {}
+        for name, microseconds in cumulative.items():
+            if module == name or module.startswith(name + "."):
+                continue
+            root = name.split(".")[0]
+            top_level[root] = max(top_level.get(root, 0), microseconds)
+        slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        report["modules"][module] = {
+            "total_ms": round(total_ms, 1),
+            "slowest_ms": {name: round(microseconds / 1000, 1) for name, microseconds in slowest},
+        }
+        if total_ms > args.budget_ms:
+            over_budget.append(module)
+
+    print(json.dumps(report, indent=2))
+    if over_budget:
+        print(f"Import time over the budget of {args.budget_ms:.0f}ms: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
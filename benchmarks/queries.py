@@ -0,0 +1,60 @@
+"""Synthetic citizen questions, with and without personal data, for the benchmarks."""
+import random
+
+FIRST_NAMES = ["Pedro", "Carolina", "Lucas", "Joana", "Ricardo", "Mariana", "Antônio", "Beatriz", "Gustavo", "Fernanda"]
+LAST_NAMES = ["Almeida", "Oliveira", "Souza", "Pereira", "Fagundes", "Medeiros", "Santos", "Lima", "Costa", "Ribeiro"]
+CITIES = ["Florianópolis", "São Paulo", "Belo Horizonte", "Joinville", "Blumenau"]
+MONTHS = ["janeiro", "fevereiro", "março", "abril", "maio", "junho", "julho", "agosto", "setembro", "outubro", "novembro", "dezembro"]
+
+GENERIC_QUESTIONS = [
+    "Quais documentos são necessários para registrar o nascimento de uma criança?",
+    "Como faço para pedir a segunda via da certidão de casamento?",
+    "Qual o prazo para registrar um óbito no cartório?",
+    "É possível alterar o sobrenome após o casamento?",
+    "Como funciona o reconhecimento de paternidade em cartório?",
+    "O que diz o art. 1.604 do Código Civil sobre o registro de nascimento?",
+    "Quais são os requisitos da Lei 6.015 para a averbação de divórcio?",
+    "Preciso de advogado para fazer um divórcio no cartório?",
+]
+
+PERSONAL_TEMPLATES = [
+    "Olá, meu nome é {name} e meu CPF é {cpf}. Quais documentos preciso para registrar meu filho {child}, nascido em {date}?",
+    "Sou {name}, moro em {city}, CEP {cep}. Como pedir a segunda via da certidão de casamento com {partner}? Meu telefone é {phone}.",
+    "Meu pai, {name}, faleceu em {written_date}. Eu, {child}, RG {rg}, quero saber como emitir a certidão de óbito.",
+    "Bom dia, meu e-mail é {email} e tenho {age} anos. Posso mudar meu nome {name} no cartório?",
+]
+
+def _cpf(rng: random.Random) -> str:
+    digits = [rng.randint(0, 9) for _ in range(9)]
+    for weights in (range(10, 1, -1), range(11, 1, -1)):
+        remainder = sum(d * w for d, w in zip(digits, weights)) % 11
+        digits.append(0 if remainder < 2 else 11 - remainder)
+    text = "".join(map(str, digits))
+    return f"{text[:3]}.{text[3:6]}.{text[6:9]}-{text[9:]}"
+
+def _full_name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def generate_queries(count: int, personal_ratio: float = 0.6, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        if rng.random() >= personal_ratio:
+            queries.append(rng.choice(GENERIC_QUESTIONS))
+            continue
+        name = _full_name(rng)
+        queries.append(rng.choice(PERSONAL_TEMPLATES).format(
+            name=name,
+            child=_full_name(rng),
+            partner=_full_name(rng),
+            cpf=_cpf(rng),
+            date=f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1950, 2024)}",
+            written_date=f"{rng.randint(1, 28)} de {rng.choice(MONTHS)} de {rng.randint(1990, 2025)}",
+            city=rng.choice(CITIES),
+            cep=f"{rng.randint(10000, 99999)}-{rng.randint(0, 999):03d}",
+            phone=f"({rng.randint(11, 99)}) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+            rg=f"{rng.randint(1, 99)}.{rng.randint(100, 999)}.{rng.randint(100, 999)}-{rng.randint(0, 9)}",
+            email=f"{name.split()[0].lower()}.{rng.randint(1, 999)}@exemplo.com",
+            age=rng.randint(18, 90),
+        ))
+    return queries
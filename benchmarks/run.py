@@ -0,0 +1,240 @@
+"""Offline benchmark of the assistant pipeline against the fake Ollama server.
+
+Usage:
+    poetry run python -m benchmarks.run --queries 50 --concurrency 1 4 16
+
+The database, lexical index and embedding cache are built in a temporary
+directory, so the real ones are never touched.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from pathlib import Path
+
+from benchmarks.fake_ollama import FakeOllamaSettings, start_server
+from benchmarks.queries import generate_queries
+
+def configure_isolated_paths(work_dir: Path, documents: list[str] | None):
+    # Must run before the pipeline modules are imported, since they copy these values at import time
+    import legal_assistant.config as config
+
+    documents_dir = work_dir / "documents"
+    documents_dir.mkdir()
+    for filename in documents or sorted(os.listdir(config.DOCUMENTS_PATH)):
+        if filename.lower().endswith(".pdf"):
+            (documents_dir / filename).symlink_to(config.DOCUMENTS_PATH / filename)
+
+    config.DOCUMENTS_PATH = documents_dir
+    config.CHROMA_PATH = work_dir / "chroma_db"
+    config.INDEX_MANIFEST_PATH = config.CHROMA_PATH / "index_manifest.json"
+    config.LEXICAL_INDEX_PATH = config.CHROMA_PATH / "lexical_index.json"
+    config.VECTOR_INDEX_PATH = config.CHROMA_PATH / "vector_index"
+    config.EMBEDDING_CACHE_PATH = work_dir / "embedding_cache.sqlite3"
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def nearest_rank(percentile: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": 1000 * sum(ordered) / len(ordered),
+        "p50_ms": 1000 * nearest_rank(50),
+        "p95_ms": 1000 * nearest_rank(95),
+        "p99_ms": 1000 * nearest_rank(99),
+    }
+
+def timed(fn, *args) -> float:
+    started_at = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started_at
+
+def peak_memory_mb() -> dict:
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        "self_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+def bench_ingestion() -> dict:
+    from legal_assistant import config
+    from legal_assistant.database import populate_database, load_manifest
+
+    elapsed = timed(populate_database)
+    chunks = sum(len(entry["chunks"]) for entry in load_manifest()["files"].values())
+    return {
+        "documents": len(os.listdir(config.DOCUMENTS_PATH)),
+        "chunks": chunks,
+        "seconds": elapsed,
+        "chunks_per_second": chunks / elapsed if elapsed else 0.0,
+        "peak_memory": peak_memory_mb(),
+    }
+
+def bench_extraction(assistant, queries: list[str]) -> dict:
+    from legal_assistant.sensitive_data_handler import JsonExtractionError, EXTRACTION_PATHS, CASCADE_OUTCOMES
+
+    counts_before = dict(EXTRACTION_PATHS.values)
+    tiers_before = dict(CASCADE_OUTCOMES.values)
+    samples, failures = [], 0
+    for query in queries:
+        started_at = time.perf_counter()
+        try:
+            assistant.sensitive_data_handler.extract(query)
+        except JsonExtractionError:
+            failures += 1
+        samples.append(time.perf_counter() - started_at)
+    paths = {}
+    for labels, count in EXTRACTION_PATHS.values.items():
+        path = dict(labels)["path"]
+        paths[path] = paths.get(path, 0) + int(count - counts_before.get(labels, 0))
+    # Outcome of each tier of the anonymization cascade ("small:accepted", "small:residual_name", "large:accepted"...)
+    tiers = {
+        f"{dict(labels)['tier']}:{dict(labels)['outcome']}": int(count - tiers_before.get(labels, 0))
+        for labels, count in CASCADE_OUTCOMES.values.items()
+    }
+    return {**percentiles(samples), "failures": failures, "paths": paths, "tiers": tiers}
+
+def bench_retrieval(assistant, queries: list[str]) -> dict:
+    embeddings = [assistant.embedding_function.embed_query(query) for query in queries]
+    samples = [timed(assistant.search, query, embedding) for query, embedding in zip(queries, embeddings)]
+    return percentiles(samples)
+
+def bench_process_query(assistant, queries: list[str]) -> dict:
+    samples, context_chunks = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        result = assistant.process_query(query, [], True)
+        samples.append(time.perf_counter() - started_at)
+        context_chunks.append(len(result.get("source_ids", [])))
+    return {**percentiles(samples), "mean_context_chunks": sum(context_chunks) / len(context_chunks) if context_chunks else 0.0}
+
+async def bench_concurrency(assistant, queries: list[str], sessions: int) -> dict:
+    semaphore = asyncio.Semaphore(sessions)
+    results = []
+
+    async def run(session_index: int, query: str):
+        async with semaphore:
+            with assistant.scheduler.session(f"bench-{session_index % sessions}"):
+                results.append(await assistant.aprocess_query(query))
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run(index, query) for index, query in enumerate(queries)))
+    elapsed = time.perf_counter() - started_at
+
+    stages = {}
+    for result in results:
+        for stage, seconds in result.get("timings", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "sessions": sessions,
+        "queries_per_second": len(queries) / elapsed if elapsed else 0.0,
+        "errors": sum(1 for result in results if "timings" not in result),
+        "stages": {stage: percentiles(samples) for stage, samples in stages.items()},
+    }
+
+async def bench_all_concurrency(assistant, queries: list[str], levels: list[int]) -> list[dict]:
+    # A single event loop, since the async Ollama clients are bound to the loop that first used them
+    return [await bench_concurrency(assistant, queries, sessions) for sessions in levels]
+
+def prefill_saved_seconds() -> dict:
+    from legal_assistant.metrics import PREFILL_SAVED_SECONDS
+
+    return {dict(labels)["model"]: seconds for labels, seconds in PREFILL_SAVED_SECONDS.values.items()}
+
+def print_report(report: dict):
+    def line(name: str, stats: dict):
+        if not stats.get("count"):
+            print(f"  {name:<22} (no samples)")
+            return
+        print(f"  {name:<22} n={stats['count']:<5} p50={stats['p50_ms']:9.2f}ms  p95={stats['p95_ms']:9.2f}ms  p99={stats['p99_ms']:9.2f}ms")
+
+    ingestion = report["ingestion"]
+    print("\nIngestion")
+    print(f"  {ingestion['documents']} documents, {ingestion['chunks']} chunks in {ingestion['seconds']:.1f}s "
+          f"({ingestion['chunks_per_second']:.1f} chunks/s), peak RSS {ingestion['peak_memory']['self_mb']:.0f} MB "
+          f"(workers {ingestion['peak_memory']['children_mb']:.0f} MB)")
+
+    print("\nSequential stages")
+    line("extract", report["extract"])
+    print(f"  {'':<22} JSON extraction failures: {report['extract']['failures']}, paths: {report['extract']['paths']}")
+    print(f"  {'':<22} anonymization cascade: {report['extract']['tiers']}")
+    line("retrieval", report["retrieval"])
+    print(f"  {'':<22} vector backend: {report['vector_backend']}")
+    line("process_query", report["process_query"])
+    print(f"  {'':<22} reranker: {report['reranker']}, mean chunks in the prompt: {report['process_query'].get('mean_context_chunks', 0.0):.2f}")
+
+    for concurrency in report["concurrency"]:
+        print(f"\nConcurrent sessions: {concurrency['sessions']} -> {concurrency['queries_per_second']:.2f} queries/s "
+              f"({concurrency['errors']} errors)")
+        for stage, stats in concurrency["stages"].items():
+            line(stage, stats)
+    print(f"\nFake Ollama calls: {report['fake_ollama']}")
+    print(f"Estimated prefill time saved by the prompt prefix reuse: "
+          + ", ".join(f"{model} {seconds:.2f}s" for model, seconds in report["prefill_saved_seconds"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the legal assistant pipeline.")
+    parser.add_argument("--queries", type=int, default=50, help="Number of synthetic queries per stage.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent sessions to measure.")
+    parser.add_argument("--documents", nargs="+", help="PDF file names to ingest (default: all bundled documents).")
+    parser.add_argument("--prefill-seconds-per-1k-chars", type=float, default=0.05)
+    parser.add_argument("--token-seconds", type=float, default=0.01)
+    parser.add_argument("--embed-seconds-per-text", type=float, default=0.002)
+    parser.add_argument("--malformed-rate", type=float, default=0.1, help="Share of malformed anonymization answers.")
+    parser.add_argument("--response-cache", action="store_true", help="Keep the response cache enabled.")
+    parser.add_argument("--reranker", choices=["lexical", "cross-encoder", "none"], help="Override the RERANKER setting.")
+    parser.add_argument("--vector-backend", choices=["chroma", "mmap"], help="Override the VECTOR_BACKEND setting.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    settings = FakeOllamaSettings(
+        prefill_seconds_per_1k_chars=args.prefill_seconds_per_1k_chars, token_seconds=args.token_seconds,
+        embed_seconds_per_text=args.embed_seconds_per_text, malformed_rate=args.malformed_rate, seed=args.seed
+    )
+    server = start_server(settings)
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory(prefix="legal-assistant-bench-") as work_dir:
+        configure_isolated_paths(Path(work_dir), args.documents)
+        if args.reranker:
+            import legal_assistant.config as config
+            config.RERANKER = None if args.reranker == "none" else args.reranker
+        if args.vector_backend:
+            import legal_assistant.config as config
+            config.VECTOR_BACKEND = args.vector_backend
+
+        from legal_assistant.assistant import LegalAssistant
+
+        report = {"ingestion": bench_ingestion()}
+        assistant = LegalAssistant()
+        report["reranker"] = assistant.reranker.name if assistant.reranker else "none"
+        report["vector_backend"] = type(assistant.db).__name__
+        assistant.warm_up()
+        if not args.response_cache:
+            assistant.response_cache = None
+
+        queries = generate_queries(args.queries, seed=args.seed)
+        report["extract"] = bench_extraction(assistant, queries)
+        report["retrieval"] = bench_retrieval(assistant, queries)
+        report["process_query"] = bench_process_query(assistant, queries)
+        report["concurrency"] = asyncio.run(bench_all_concurrency(assistant, queries, args.concurrency))
+        report["fake_ollama"] = dict(settings.stats)
+        report["prefill_saved_seconds"] = prefill_saved_seconds()
+
+    server.shutdown()
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Memory and rerun cost of the web conversations: messages in st.session_state vs. the session store.
+
+Usage:
+    poetry run python -m benchmarks.sessions --sessions 50 --turns 100
+
+No model is needed: conversations of synthetic results (with the size of real ones,
+trace included) are kept both as LangChain messages carrying the whole result, as the
+app used to, and in the SessionStore. The rerun cost is the work each Streamlit rerun
+does to draw the conversation: serializing every message and its processing details
+before, only the messages in memory with the details collapsed now. The history cost
+is building the messages sent with the next question, spilled ones included.
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from benchmarks.queries import generate_queries
+
+def synthetic_result(query: str, turn: int) -> dict:
+    source_ids = [f"Lei_6015.pdf:{turn}:{index}" for index in range(5)]
+    response = ("Para esse procedimento, compareça ao cartório de registro civil com um documento de identificação "
+                "com foto e a documentação indicada na legislação. ") * 6
+    return {
+        "final_response": response,
+        "anonymized_query": query,
+        "raw_response": response,
+        "replacements": {"[NOME_1]": "Pedro de Almeida", "[CPF_1]": "111.222.333-44"},
+        "source_ids": source_ids,
+        "cached": False,
+        "timings": {"anonymization": 0.8, "retrieval": 0.05, "prompt_build": 0.001, "generation": 3.2, "total": 4.1},
+        "trace": [
+            {"name": name, "parent": parent, "start": 0.1 * index, "duration": 0.05, "attributes": {"model": "gemma3:1b", "tokens": 120}}
+            for index, (name, parent) in enumerate([
+                ("history", None), ("anonymization", None), ("anonymization_rules", "anonymization"),
+                ("anonymization_tier", "anonymization"), ("anonymization_attempt", "anonymization_tier"), ("retrieval", None),
+                ("embedding", "retrieval"), ("vector_search", "retrieval"), ("lexical_search", "retrieval"), ("rerank", "retrieval"),
+                ("context_selection", None), ("prompt_build", None), ("generation", None), ("deanonymization", None),
+            ])
+        ],
+    }
+
+def measure(build) -> tuple[object, int]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return value, used
+
+def timed(function, repeat: int = 5) -> float:
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started_at) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Session state vs. session store: memory per session and rerun cost.")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=100, help="Questions per session (each one adds two messages).")
+    parser.add_argument("--max-turns-in-memory", type=int, default=20)
+    parser.add_argument("--json", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    from langchain_core.messages import AIMessage, HumanMessage
+    from legal_assistant.session_store import SessionStore, Turn
+
+    queries = generate_queries(args.turns, seed=7)
+    conversations = [[(query, synthetic_result(query, turn)) for turn, query in enumerate(queries)] for _ in range(args.sessions)]
+
+    def build_session_state():
+        histories = []
+        for conversation in conversations:
+            history = []
+            for query, result in conversation:
+                history.append(HumanMessage(content=query))
+                history.append(AIMessage(content=result["final_response"], metadata={"processing_details": json.loads(json.dumps(result))}))
+            histories.append(history)
+        return histories
+
+    with tempfile.TemporaryDirectory() as spill_path:
+        def build_store():
+            store = SessionStore(spill_path, max_sessions=args.sessions, max_turns_in_memory=args.max_turns_in_memory)
+            for session, conversation in enumerate(conversations):
+                for query, result in conversation:
+                    store.append(str(session), Turn("user", query))
+                    store.append(str(session), Turn.from_result(result["final_response"], result))
+            return store
+
+        histories, state_bytes = measure(build_session_state)
+        store, store_bytes = measure(build_store)
+
+        def rerun_session_state():
+            for message in histories[0]:
+                payload = message.content
+                if isinstance(message, AIMessage):
+                    payload += json.dumps(message.metadata["processing_details"], ensure_ascii=False)
+
+        def rerun_store():
+            for turn in store.recent_turns("0"):
+                payload = turn.content
+
+        report = {
+            "sessions": args.sessions,
+            "messages_per_session": 2 * args.turns,
+                "session_state": {
+                "bytes_per_session": state_bytes // args.sessions,
+                "rerun_seconds": timed(rerun_session_state),
+                "history_seconds": timed(lambda: [m for m in histories[0] if isinstance(m, (HumanMessage, AIMessage))]),
+            },
+            "session_store": {
+                "bytes_per_session": store_bytes // args.sessions,
+                "reported_bytes_per_session": store.memory_usage("0"),
+                "messages_in_memory": store.counts("0"),
+                "rerun_seconds": timed(rerun_store),
+                "history_seconds": timed(lambda: store.messages("0")),
+            },
+        }
+    report["memory_reduction"] = 1 - report["session_store"]["bytes_per_session"] / report["session_state"]["bytes_per_session"]
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,25 @@
 import sys
-from legal_assistant.database import update_database, check_database_exists, populate_database
-from legal_assistant.assistant import LegalAssistant
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from legal_assistant.config import WARM_UP_ON_STARTUP, SERVER_HOST, SERVER_PORT, SERVER_WORKERS, BATCH_IN_FLIGHT
 from legal_assistant.logging_formatter import config_logger
 import logging
 
-def main_menu():    
-    print("\n----- Assistente Jurídico Virtual -----\nDigite '0' para encerrar o programa.")
+def create_assistant():
+    # LangChain, Chroma and the Ollama clients are imported here, in the background,
+    # so the prompt appears right away
+    from legal_assistant.assistant import LegalAssistant
+
     assistant = LegalAssistant()
+    if WARM_UP_ON_STARTUP:
+        assistant.start_warm_up()
+    return assistant
+
+def main_menu():
+    print("\n----- Assistente Jurídico Virtual -----\nDigite '0' para encerrar o programa.")
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="assistant-loader")
+    assistant_future = executor.submit(create_assistant)
+    executor.shutdown(wait=False)
     while True:
         user_input = input("Usuário: ").strip()
         if user_input == "0":
@@ -15,11 +28,15 @@ def main_menu():
         if not user_input:
             print("O texto informado não pode ser vazio.")
             continue
-        assistant.process_query(user_input)
+        # Only the first question waits, if the assistant is still loading
+        for text in assistant_future.result().stream_query(user_input):
+            print(text, end="", flush=True)
+        print()
 
-def main():
-    config_logger(logger_level=logging.CRITICAL)
-    if "--update-db" in sys.argv:
+def prepare_database(update: bool):
+    from legal_assistant.database import update_database, check_database_exists, populate_database
+
+    if update:
         print("Atualizando a base de dados antes de inicializar o agente...")
         update_database()
         print("Base de dados atualizado com sucesso.")
@@ -27,4 +44,54 @@ def main():
         print("Inicializando pela primeira vez a base de dados antes de inicializar o agente...")
         populate_database()
 
-    main_menu()
\ No newline at end of file
+def run_chat(args):
+    config_logger(logger_level=logging.CRITICAL)
+    prepare_database(args.update_db)
+    main_menu()
+
+def run_serve(args):
+    config_logger(logger_level=logging.INFO)
+    # The database is prepared once, before the workers are started, since they only read it
+    prepare_database(args.update_db)
+    from legal_assistant.server import serve
+
+    serve(args.host, args.port, args.workers)
+
+def run_batch(args):
+    import json
+
+    config_logger(logger_level=logging.INFO)
+    prepare_database(args.update_db)
+    from legal_assistant.batch import run_batch
+
+    report = run_batch(args.input, args.output, args.in_flight)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="legal-assistant", description="Assistente Jurídico Virtual")
+    parser.add_argument("--update-db", action="store_true", help="Atualiza a base de dados antes de iniciar.")
+    parser.set_defaults(handler=run_chat)
+    subparsers = parser.add_subparsers(title="comandos")
+
+    chat_parser = subparsers.add_parser("chat", help="Conversa no terminal (padrão).")
+    chat_parser.add_argument("--update-db", action="store_true", default=argparse.SUPPRESS, help="Atualiza a base de dados antes de iniciar.")
+    chat_parser.set_defaults(handler=run_chat)
+
+    serve_parser = subparsers.add_parser("serve", help="Servidor HTTP/JSON.")
+    serve_parser.add_argument("--host", default=SERVER_HOST)
+    serve_parser.add_argument("--port", type=int, default=SERVER_PORT)
+    serve_parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Processos servindo requisições (0: um por CPU).")
+    serve_parser.add_argument("--update-db", action="store_true", default=argparse.SUPPRESS, help="Atualiza a base de dados antes de iniciar.")
+    serve_parser.set_defaults(handler=run_serve)
+
+    batch_parser = subparsers.add_parser("batch", help="Responde as perguntas de um arquivo JSONL.")
+    batch_parser.add_argument("input", help="Arquivo JSONL com uma pergunta por linha ({\"query\": ..., \"id\": ...}).")
+    batch_parser.add_argument("output", help="Arquivo JSONL das respostas; uma execução interrompida continua de onde parou.")
+    batch_parser.add_argument("--in-flight", type=int, default=BATCH_IN_FLIGHT, help="Perguntas processadas ao mesmo tempo.")
+    batch_parser.add_argument("--update-db", action="store_true", default=argparse.SUPPRESS, help="Atualiza a base de dados antes de iniciar.")
+    batch_parser.set_defaults(handler=run_batch)
+    return parser
+
+def main():
+    args = build_parser().parse_args(sys.argv[1:])
+    args.handler(args)
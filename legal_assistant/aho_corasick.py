@@ -0,0 +1,93 @@
+import unicodedata
+from collections import deque
+
+def _fold_char(char: str) -> str:
+    base = unicodedata.normalize("NFD", char)[0].lower()
+    return base[0] if base else char
+
+# Latin-1 and Latin Extended-A cover the Portuguese text; other characters are compared as they are
+_FOLD_TABLE = {code: _fold_char(chr(code)) for code in range(0x250)}
+
+def fold(text: str) -> str:
+    """Lowercases and strips accents keeping one character per input character,
+    so positions in the folded text are positions in the original."""
+    return text.translate(_FOLD_TABLE)
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+class AhoCorasick:
+    """Multi-pattern matcher over folded text (case and accent insensitive).
+
+    All patterns are found in a single pass over the text, so the cost grows
+    with the text length and not with the number of patterns.
+    """
+
+    def __init__(self, patterns: dict[str, object]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.values = []
+        for pattern, value in patterns.items():
+            folded_pattern = fold(pattern)
+            if folded_pattern:
+                self._add(folded_pattern, value)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, value):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(len(self.values))
+        self.values.append((pattern, value))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def find_all(self, folded_text: str):
+        """Yields (start, end, value) for every occurrence, overlapping ones included."""
+        goto, fail, outputs, values = self.goto, self.fail, self.outputs, self.values
+        state = 0
+        for position, char in enumerate(folded_text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in outputs[state]:
+                pattern, value = values[index]
+                yield position + 1 - len(pattern), position + 1, value
+
+    def find_longest(self, text: str) -> list[tuple[int, int, object]]:
+        """Non-overlapping leftmost-longest matches that start and end on word boundaries."""
+        folded_text = fold(text)
+        candidates = []
+        for start, end, value in self.find_all(folded_text):
+            if _is_word_char(folded_text[start]) and start > 0 and _is_word_char(folded_text[start - 1]):
+                continue
+            if _is_word_char(folded_text[end - 1]) and end < len(folded_text) and _is_word_char(folded_text[end]):
+                continue
+            candidates.append((start, end, value))
+
+        candidates.sort(key=lambda match: (match[0], match[0] - match[1]))
+        matches = []
+        covered_until = 0
+        for start, end, value in candidates:
+            if start >= covered_until:
+                matches.append((start, end, value))
+                covered_until = end
+        return matches
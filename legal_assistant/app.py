@@ -1,6 +1,8 @@
+import uuid
+
 import streamlit as st
-from langchain_core.messages import AIMessage, HumanMessage
-from legal_assistant.assistant import LegalAssistant
+from legal_assistant.config import WARM_UP_ON_STARTUP, METRICS_HOST, METRICS_PORT
+from legal_assistant.session_store import SessionStore, Turn
 
 from legal_assistant.logging_formatter import config_logger
 from legal_assistant.database import check_database_exists, populate_database
@@ -22,48 +24,98 @@ def setup_page_config():
 
 @st.cache_resource
 def load_assistant():
-    return LegalAssistant()
+    # Imported here, so the page is drawn before LangChain and the clients are loaded
+    from legal_assistant.assistant import LegalAssistant
+    from legal_assistant.metrics import start_metrics_server
+
+    assistant = LegalAssistant()
+    # Cached with the assistant, so it is started once per Streamlit process
+    if METRICS_PORT is not None:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    if WARM_UP_ON_STARTUP:
+        assistant.start_warm_up()
+    return assistant
 
-def display_processing_details(details):
-    with st.expander("🔍 Ver detalhes do processamento"):
+@st.cache_resource
+def load_session_store():
+    # Shared by all the sessions of the process, so it can bound them and drop the idle ones
+    return SessionStore()
+
+def display_processing_details(load_details, key: str):
+    # The details are only decoded and drawn while the toggle is on, so the reruns don't redraw them all
+    if not st.toggle("🔍 Ver detalhes do processamento", key=key):
+        return
+    details = load_details()
+    with st.container(border=True):
         st.write("**Pergunta Anonimizada:**")
         st.code(details.get("anonymized_query"), language="text")
         st.write("**Dados Sensíveis Identificados:**")
         st.json(details.get("replacements"))
         st.write("**Resposta Bruta da IA (antes de reidentificar):**")
         st.code(details.get("raw_response"), language="text")
+        if details.get("trace"):
+            st.write("**Etapas do Processamento:**")
+            st.dataframe(details["trace"], hide_index=True, use_container_width=True)
+
+def initialize_chat_history(store: SessionStore):
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    store.touch(st.session_state.session_id)
 
-def initialize_chat_history():
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+def display_chat_history(store: SessionStore):
+    session_id = st.session_state.session_id
+    counts = store.counts(session_id)
+    turns = store.recent_turns(session_id)
+    first_index = counts["spilled"]
+    if counts["spilled"]:
+        # Older messages are read from disk only on request
+        if st.session_state.get("show_older_messages"):
+            turns = store.spilled_turns(session_id) + turns
+            first_index = 0
+        elif st.button(f"Mostrar {counts['spilled']} mensagens anteriores"):
+            st.session_state.show_older_messages = True
+            st.rerun()
 
-def display_chat_history():
-    for message in st.session_state.chat_history:
-        role = "user" if isinstance(message, HumanMessage) else "assistant"
-        with st.chat_message(role):
-            st.markdown(message.content)
-            if role == 'assistant' and "processing_details" in message.metadata:
-                display_processing_details(message.metadata["processing_details"])
+    for index, turn in enumerate(turns, start=first_index):
+        with st.chat_message(turn.role):
+            st.markdown(turn.content)
+            if turn.role == "assistant" and turn.packed_details:
+                display_processing_details(lambda turn=turn: turn.details, f"details_{index}")
 
-def handle_user_input(prompt, assistant):
+def handle_user_input(prompt, assistant, store: SessionStore):
+    session_id = st.session_state.session_id
     st.chat_message("user").markdown(prompt)
-    st.session_state.chat_history.append(HumanMessage(content=prompt))
+    store.append(session_id, Turn("user", prompt))
 
     with st.chat_message("assistant"):
-        with st.spinner("Pensando..."):
-            history_for_query = [m for m in st.session_state.chat_history if isinstance(m, (HumanMessage, AIMessage))][:-1]
-            
-            processing_result = assistant.process_query(prompt, history_for_query, web_interface = True)
-            final_response = processing_result.get("final_response")
-            
-            if processing_result.get("error") == "json_extraction_failed":
-                st.error(final_response)
-            else:
-                st.markdown(final_response)
-                display_processing_details(processing_result)
-                st.session_state.chat_history.append(
-                    AIMessage(content=final_response, metadata={"processing_details": processing_result})
-                )
+        history_for_query = store.messages(session_id)[:-1]
+        queue_status = st.empty()
+
+        def show_queue_position(model_name, position, eta):
+            eta_text = f" Tempo estimado: {eta:.0f}s." if eta else ""
+            queue_status.info(f"Sua pergunta está na posição {position} da fila.{eta_text}")
+
+        with assistant.scheduler.session(session_id, on_wait=show_queue_position):
+            response_stream = assistant.stream_query(prompt, history_for_query)
+            with st.spinner("Pensando..."):
+                response_stream.prepare()
+            queue_status.empty()
+
+            if response_stream.result and response_stream.result.get("error") in ("json_extraction_failed", "server_busy"):
+                st.error(response_stream.result.get("final_response"))
+                return
+
+            st.write_stream(response_stream)
+        queue_status.empty()
+
+        processing_result = response_stream.result
+        if processing_result.get("error") == "server_busy":
+            return
+        final_response = processing_result.get("final_response")
+        # Same key the message gets when the history is drawn again, so the toggle keeps its state
+        counts = store.counts(session_id)
+        display_processing_details(lambda: processing_result, f"details_{sum(counts.values())}")
+        store.append(session_id, Turn.from_result(final_response, processing_result))
 
 def main():
     config_logger()
@@ -75,11 +127,12 @@ def main():
     
     setup_page_config()
     assistant = load_assistant()
-    initialize_chat_history()
-    display_chat_history()
+    store = load_session_store()
+    initialize_chat_history(store)
+    display_chat_history(store)
 
     if prompt := st.chat_input("Digite sua pergunta aqui..."):
-        handle_user_input(prompt, assistant)
+        handle_user_input(prompt, assistant, store)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,79 +1,239 @@
-import torch
+import time
+import asyncio
+import textwrap
+import threading
 
-from langchain.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
-from langchain_core.messages import HumanMessage
-from chromadb.config import Settings
+from langchain_core.prompts import PromptTemplate
 
-from legal_assistant.database import get_embedding_function
-from legal_assistant.utils import initialize_model
-from legal_assistant.sensitive_data_handler import SensitiveDataHandler, JsonExtractionError
-from legal_assistant.config import CHROMA_PATH, LLM_RESPONSE_GENERATION_MODEL
+from legal_assistant.database import (
+    get_embedding_function, get_collection_version, export_vector_index, check_database_exists, get_database, load_lexical_index
+)
+from legal_assistant.utils import initialize_model, detect_gpu, lazy_property
+from legal_assistant.sensitive_data_handler import SensitiveDataHandler, StreamingDeanonymizer, JsonExtractionError
+from legal_assistant.response_cache import ResponseCache, PLACEHOLDER_PATTERN
+from legal_assistant.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from legal_assistant.scheduler import RequestScheduler, SchedulerFullError
+from legal_assistant.prompt_builder import PromptBuilder, CONTEXT_SEPARATOR, estimate_tokens
+from legal_assistant.reranker import create_reranker, select_adaptive
+from legal_assistant.metrics import (
+    REGISTRY, Trace, current_trace, span, start_trace, OllamaStatsCallback, record_ollama_stats,
+    record_prefix_reuse
+)
+from legal_assistant.config import (
+    CHROMA_PATH, LLM_RESPONSE_GENERATION_MODEL, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_SIMILARITY_THRESHOLD, ANONYMIZATION_MAX_CONCURRENCY,
+    GENERATION_MAX_CONCURRENCY, SCHEDULER_MAX_QUEUE_SIZE, LEXICAL_INDEX_PATH, RETRIEVAL_MODE, RETRIEVAL_K,
+    RETRIEVAL_CANDIDATES, GENERATION_NUM_CTX, GENERATION_RESPONSE_TOKENS,
+    HISTORY_MAX_TOKENS, HISTORY_RECENT_MESSAGES, CHARS_PER_TOKEN, GENERATION_KEEP_ALIVE, RERANKER,
+    RERANKER_CROSS_ENCODER_MODEL, RERANKER_BATCH_SIZE, RERANK_CANDIDATES, RERANK_MIN_SCORE, RERANK_RELATIVE_CUTOFF,
+    RERANK_MIN_K, VECTOR_BACKEND, VECTOR_INDEX_PATH, VECTOR_INDEX_NPROBE
+)
 
 import logging
 from legal_assistant.logging_formatter import LOGGER_NAME
 
 logger = logging.getLogger(LOGGER_NAME)
 
+# Static instructions, sent as the system prompt. Every request starts with these same
+# tokens, so Ollama reuses their KV cache and only evaluates the variable part.
+RESPONSE_GENERATION_SYSTEM_PROMPT = textwrap.dedent("""
+    Você é um assistente especializado em fornecer respostas objetivas, claras e baseadas unicamente nas informações fornecidas.
+    Considere que as respostas serão fornecidas a cidadãos comuns, portanto utilize uma linguagem apropriada e de fácil entendimento.
+    Caso não tenha informações suficientes para responder, informe que não possui dados suficientes para fornecer uma resposta precisa.
+    Nunca invente ou adicione links, URLs, sites ou referências externas.
+    Apenas use as informações fornecidas no contexto.
+    Se não houver dados suficientes, informe que não possui dados suficientes para fornecer uma resposta precisa.
+""").strip()
+
+# Variable part, from the most stable across the turns of a conversation (history) to the most specific (question)
+RESPONSE_GENERATION_PROMPT = PromptTemplate.from_template(textwrap.dedent("""
+    Histórico da conversa:
+    {history}
+
+    ---
+    Responda à questão com base exclusivamente no contexto abaixo:
+    {context}
+
+    ---
+    Pergunta:
+    {question}
+""").strip())
+
+HISTORY_SUMMARY_PROMPT = PromptTemplate.from_template(textwrap.dedent("""
+    Resuma a conversa abaixo entre um usuário e um assistente jurídico em no máximo cinco frases.
+    Mantenha as dúvidas do usuário, as informações que ele forneceu e as orientações já dadas.
+    Responda apenas com o resumo.
+
+    Resumo anterior:
+    {summary}
+
+    Novas mensagens:
+    {messages}
+""").strip())
+
 class LegalAssistant:
+    """The heavy clients (Chroma, the models, the indexes) are built on first use,
+    so creating the assistant is instantaneous and the entry points can show the
+    prompt while they load in the background (see `preload` and `warm_up`).
+    """
+
     def __init__(self):
         self._check_gpu()
-        self.db = Chroma(
+        self.scheduler = RequestScheduler(
+            limits={"anonymization": ANONYMIZATION_MAX_CONCURRENCY, "generation": GENERATION_MAX_CONCURRENCY},
+            max_queue_size=SCHEDULER_MAX_QUEUE_SIZE
+        )
+        self.response_cache = self._initialize_response_cache()
+        self.prefix_tokens = estimate_tokens(RESPONSE_GENERATION_SYSTEM_PROMPT, CHARS_PER_TOKEN)
+        REGISTRY.register_collector("assistant", self.collect_metrics)
+
+    @lazy_property
+    def embedding_function(self):
+        return get_embedding_function()
+
+    @lazy_property
+    def db(self):
+        if VECTOR_BACKEND == "mmap":
+            from legal_assistant.vector_index import MappedVectorIndex
+
+            index = MappedVectorIndex.load(VECTOR_INDEX_PATH, VECTOR_INDEX_NPROBE)
+            if index is None:
+                # Databases built before the backend was selected are exported on the first use
+                export_vector_index()
+                index = MappedVectorIndex.load(VECTOR_INDEX_PATH, VECTOR_INDEX_NPROBE)
+            return index
+
+        from langchain_chroma import Chroma
+        from chromadb.config import Settings
+
+        return Chroma(
             persist_directory=str(CHROMA_PATH),
-            embedding_function=get_embedding_function(),
+            embedding_function=self.embedding_function,
             client_settings=Settings(anonymized_telemetry=False)
         )
-        self.model = initialize_model(
+
+    @lazy_property
+    def lexical_index(self):
+        if RETRIEVAL_MODE != "hybrid":
+            return None
+        lexical_index = LexicalIndex.load(LEXICAL_INDEX_PATH)
+        if lexical_index is None and check_database_exists():
+            # Databases built before the lexical index existed are indexed from their stored chunks on the first use
+            logger.warning(f"{LEXICAL_INDEX_PATH} not found. Building the lexical index from the stored chunks.")
+            lexical_index = load_lexical_index(get_database())
+            lexical_index.save()
+        return lexical_index
+
+    @lazy_property
+    def reranker(self):
+        # The lexical reranker takes the term rarity from the BM25 index when retrieval uses it
+        return create_reranker(RERANKER, RERANKER_CROSS_ENCODER_MODEL, RERANKER_BATCH_SIZE, self.lexical_index)
+
+    @lazy_property
+    def model(self):
+        return initialize_model(
             model_name=LLM_RESPONSE_GENERATION_MODEL,
             model_temperature=0.4,
-            model_ctx=4096,
-            model_num_gpu=1
+            model_ctx=GENERATION_NUM_CTX,
+            model_num_gpu=1,
+            model_keep_alive=GENERATION_KEEP_ALIVE
         )
-        self.sensitive_data_handler = self._initialize_anonymizer()
+
+    @lazy_property
+    def prompt_builder(self):
+        return PromptBuilder(
+            template=RESPONSE_GENERATION_SYSTEM_PROMPT + RESPONSE_GENERATION_PROMPT.template,
+            summarize_fn=self.summarize_history,
+            num_ctx=GENERATION_NUM_CTX,
+            response_tokens=GENERATION_RESPONSE_TOKENS,
+            history_max_tokens=HISTORY_MAX_TOKENS,
+            recent_messages=HISTORY_RECENT_MESSAGES,
+            chars_per_token=CHARS_PER_TOKEN
+        )
+
+    @lazy_property
+    def sensitive_data_handler(self):
+        return self._initialize_anonymizer()
+
+    def preload(self):
+        """Builds every lazy client, so the first question doesn't pay for their construction."""
+        started_at = time.perf_counter()
+        for name in ("embedding_function", "db", "lexical_index", "reranker", "model", "prompt_builder", "sensitive_data_handler"):
+            getattr(self, name)
+        logger.info(f"Clients loaded in {time.perf_counter() - started_at:.1f}s.")
 
     def _check_gpu(self):
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        if device.type == "cuda":
-            logger.info(f"GPU [{torch.cuda.get_device_name(0)}] detected and activated.")
+        gpu_name = detect_gpu()
+        if gpu_name:
+            logger.info(f"GPU [{gpu_name}] detected and activated.")
         else:
             logger.warning("GPU is not available. Therefore, your CPU will be used and responses may take longer than usual.")
 
     def _initialize_anonymizer(self):
-        return SensitiveDataHandler()
-
-    def get_response_generation_prompt(self):
-        return """
-            Você é um assistente especializado em fornecer respostas objetivas, claras e baseadas unicamente nas informações fornecidas. 
-            Considere que as respostas serão fornecidas a cidadãos comuns, portanto utilize uma linguagem apropriada e de fácil entendimento.
-            Caso não tenha informações suficientes para responder, informe que não possui dados suficientes para fornecer uma resposta precisa.
-            Nunca invente ou adicione links, URLs, sites ou referências externas.  
-            Apenas use as informações fornecidas no contexto.
-            Se não houver dados suficientes, informe que não possui dados suficientes para fornecer uma resposta precisa.
-             
-            Responda à questão com base exclusivamente no contexto abaixo:
-            {context}
-
-            ---
-            Histórico da conversa:
-            {history}
-
-            Pergunta: 
-            {question}
-        """
-
-    def format_history(self, messages: list) -> str:
-        if not messages:
-            return ""
-
-        history = []
-        for msg in messages:
-            role = "Usuário" if isinstance(msg, HumanMessage) else "Assistente"
-            history.append(f"{role}: {msg.content}")
-        
-        logger.info("Conversation history: %s", "\n".join(history))
-        return "\n".join(history)
+        return SensitiveDataHandler(scheduler=self.scheduler)
+
+    def _initialize_response_cache(self):
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        return ResponseCache(
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            similarity_threshold=RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+            version_fn=get_collection_version
+        )
+
+    def collect_metrics(self) -> dict:
+        gauges = {}
+        for model, snapshot in self.scheduler.snapshot().items():
+            for key, value in snapshot.items():
+                gauges.setdefault(f"legal_assistant_scheduler_{key}", {})[(("model", model),)] = value
+        if lazy_property.is_loaded(self, "embedding_function"):
+            for key, value in self.embedding_function.stats.items():
+                gauges[f"legal_assistant_embedding_cache_{key}"] = {(): value}
+        if self.response_cache:
+            for key, value in self.response_cache.stats.items():
+                gauges[f"legal_assistant_response_cache_{key}"] = {(): value}
+        return gauges
+
+    def warm_up(self):
+        """Loads both models and evaluates their static prompts, so the first question pays for neither."""
+        try:
+            self.preload()
+            self.sensitive_data_handler.warm_up()
+            stats = OllamaStatsCallback()
+            started_at = time.perf_counter()
+            self.model.model_copy(update={"num_predict": 1}).invoke(
+                RESPONSE_GENERATION_PROMPT.format(history="", context="", question=""),
+                system=RESPONSE_GENERATION_SYSTEM_PROMPT,
+                config={"callbacks": [stats]}
+            )
+            logger.info(
+                f"Generation model warmed up in {time.perf_counter() - started_at:.1f}s "
+                f"({stats.generation_info.get('prompt_eval_count', 0)} prompt tokens evaluated)."
+            )
+        except Exception as e:
+            logger.warning(f"Model warm-up failed: {e}")
+
+    def start_warm_up(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warm_up, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def summarize_history(self, previous_summary: str, messages_text: str) -> str:
+        prompt = HISTORY_SUMMARY_PROMPT.format(summary=previous_summary or "(nenhum)", messages=messages_text)
+        with span("history_summary"), self.scheduler.slot("generation"):
+            return self.model.invoke(prompt)
+
+    def format_history(self, messages: list) -> tuple[str, set[str]]:
+        with span("history", messages=len(messages)):
+            history_text, cited_ids = self.prompt_builder.history_section(messages)
+        logger.info("Conversation history: %s", history_text)
+        return history_text, cited_ids
 
     def log_used_sources(self, sources_with_scores):
+        # Formatting every chunk is expensive, so it is skipped when it would not be logged
+        if not logger.isEnabledFor(logging.INFO):
+            return
         sorted_sources = sorted(sources_with_scores, key=lambda x: x[1], reverse=True)
         log_lines = ["\n----------------------\nUtilized sources:\n"]
         for idx, (doc, score) in enumerate(sorted_sources, start=1):
@@ -87,51 +247,320 @@ class LegalAssistant:
         log_lines.append("\n----------------------\n")
         logger.info("\n" + "\n".join(log_lines))
 
-    def process_query(self, query_text: str, history: list = [], web_interface = False) -> str:
-        try:
-            anonymized_query, replacements = self.sensitive_data_handler.anonymize(query_text)
-            logger.info("Anonymized query: %s", anonymized_query)
-            
-            db_similar_results = self.db.similarity_search_with_score(anonymized_query, k=5)
-            context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in db_similar_results])
+    def search(self, query_text: str, query_embedding: list[float]) -> list:
+        if self.reranker is None:
+            return self.retrieve_candidates(query_text, query_embedding, RETRIEVAL_K)
+        return self.rerank(query_text, self.retrieve_candidates(query_text, query_embedding, RERANK_CANDIDATES))
+
+    def vector_search(self, query_embedding: list[float], k: int) -> list:
+        from legal_assistant.vector_index import search_by_vector
+
+        return search_by_vector(self.db, query_embedding, k)
+
+    def retrieve_candidates(self, query_text: str, query_embedding: list[float], k: int) -> list:
+        if self.lexical_index is None:
+            with span("vector_search", k=k):
+                return self.vector_search(query_embedding, k)
+
+        with span("vector_search", k=RETRIEVAL_CANDIDATES):
+            vector_results = self.vector_search(query_embedding, RETRIEVAL_CANDIDATES)
+        with span("lexical_search", k=RETRIEVAL_CANDIDATES):
+            self.lexical_index.reload_if_changed()
+            lexical_results = self.lexical_index.search(PLACEHOLDER_PATTERN.sub(" ", query_text), RETRIEVAL_CANDIDATES)
+
+        docs_by_id = {doc.metadata.get("id"): doc for doc, _score in vector_results}
+        fused_results = reciprocal_rank_fusion([
+            [doc.metadata.get("id") for doc, _score in vector_results],
+            [chunk_id for chunk_id, _score in lexical_results],
+        ])[:k]
+
+        missing_ids = [chunk_id for chunk_id, _score in fused_results if chunk_id not in docs_by_id]
+        if missing_ids:
+            for doc in self.db.get_by_ids(missing_ids):
+                docs_by_id[doc.metadata.get("id", doc.id)] = doc
+        return [(docs_by_id[chunk_id], score) for chunk_id, score in fused_results if chunk_id in docs_by_id]
+
+    def rerank(self, query_text: str, candidates: list) -> list:
+        """Rescores the candidates and keeps a variable number of them, by score cut-off."""
+        with span("rerank", reranker=self.reranker.name, candidates=len(candidates)) as rerank_span:
+            scores = self.reranker.score(
+                PLACEHOLDER_PATTERN.sub(" ", query_text),
+                [doc.metadata.get("id", "sem_id") for doc, _score in candidates],
+                [doc.page_content for doc, _score in candidates]
+            )
+            selected = select_adaptive(
+                [(doc, score) for (doc, _score), score in zip(candidates, scores)],
+                RERANK_MIN_SCORE, RERANK_RELATIVE_CUTOFF, RERANK_MIN_K, RETRIEVAL_K
+            )
+            rerank_span.attributes["selected"] = len(selected)
+        return selected
 
-            history_text = self.format_history(history)
+    async def aretrieve(self, query_text: str, embedding_function=None) -> tuple[list[float], list]:
+        embedding_function = embedding_function or self.embedding_function
+        with span("embedding"):
+            query_embedding = await embedding_function.aembed_query(query_text)
+        db_similar_results = await asyncio.to_thread(self.search, query_text, query_embedding)
+        return query_embedding, db_similar_results
 
-            prompt_template = ChatPromptTemplate.from_template(self.get_response_generation_prompt())
-            prompt = prompt_template.format(
+    async def speculative_retrieve(self, query_text: str) -> tuple[list[float], list]:
+        with span("speculative_retrieval"):
+            return await self.aretrieve(query_text, embedding_function=self.embedding_function.embeddings)
+
+    def prepare_query(self, query_text: str, history: list) -> dict:
+        anonymized_query, replacements = self.sensitive_data_handler.anonymize(query_text)
+        logger.info("Anonymized query: %s", anonymized_query)
+
+        with span("retrieval"):
+            with span("embedding"):
+                query_embedding = self.embedding_function.embed_query(anonymized_query)
+            db_similar_results = self.search(anonymized_query, query_embedding)
+        history_text, cited_ids = self.format_history(history)
+        return self.build_query_state(anonymized_query, replacements, query_embedding, db_similar_results, history_text, cited_ids)
+
+    def build_query_state(self, anonymized_query: str, replacements: dict, query_embedding: list[float], db_similar_results: list, history_text: str, cited_ids: set[str] = frozenset()) -> dict:
+        with span("context_selection", candidates=len(db_similar_results)) as selection_span:
+            db_similar_results = self.prompt_builder.select_context(anonymized_query, history_text, db_similar_results, cited_ids)
+            selection_span.attributes["selected"] = len(db_similar_results)
+        source_ids = [doc.metadata.get("id", "sem_id") for doc, _score in db_similar_results]
+        state = {
+            "anonymized_query": anonymized_query,
+            "replacements": replacements,
+            "query_embedding": query_embedding,
+            "db_similar_results": db_similar_results,
+            "source_ids": source_ids,
+            "history_text": history_text,
+            "cached_response": None,
+            "prompt": None,
+            "trace": current_trace.get() or Trace(),
+        }
+
+        with span("prompt_build") as prompt_span:
+            if self.response_cache:
+                state["cached_response"] = self.response_cache.get(anonymized_query, source_ids, history_text, query_embedding)
+            prompt_span.attributes["cached"] = state["cached_response"] is not None
+            if state["cached_response"] is not None:
+                logger.info("Response found in cache.")
+                return state
+
+            context_text = CONTEXT_SEPARATOR.join([doc.page_content for doc, _score in db_similar_results])
+            state["prompt"] = RESPONSE_GENERATION_PROMPT.format(
                 context=context_text,
                 history=history_text,
                 question=anonymized_query
             )
+            prompt_span.attributes["prompt_chars"] = len(state["prompt"])
+        return state
+
+    def record_generation_stats(self, generation_span, prompt: str, generation_info: dict):
+        record_ollama_stats(generation_span, LLM_RESPONSE_GENERATION_MODEL, generation_info)
+        record_prefix_reuse(
+            generation_span, LLM_RESPONSE_GENERATION_MODEL, generation_info, self.prefix_tokens, self.prompt_builder.tokens(prompt)
+        )
+
+    def generate(self, prompt: str) -> str:
+        stats = OllamaStatsCallback()
+        with span("generation") as generation_span:
+            with self.scheduler.slot("generation"):
+                response_text = self.model.invoke(prompt, system=RESPONSE_GENERATION_SYSTEM_PROMPT, config={"callbacks": [stats]})
+            self.record_generation_stats(generation_span, prompt, stats.generation_info)
+        return response_text
+
+    async def agenerate(self, prompt: str) -> str:
+        stats = OllamaStatsCallback()
+        with span("generation") as generation_span:
+            async with self.scheduler.aslot("generation"):
+                response_text = await self.model.ainvoke(prompt, system=RESPONSE_GENERATION_SYSTEM_PROMPT, config={"callbacks": [stats]})
+            self.record_generation_stats(generation_span, prompt, stats.generation_info)
+        return response_text
+
+    def finish_query(self, state: dict, response_text: str) -> dict:
+        cached = state["cached_response"] is not None
+        if self.response_cache and not cached:
+            self.response_cache.put(state["anonymized_query"], state["source_ids"], state["history_text"], response_text, state["query_embedding"])
+
+        self.log_used_sources(state["db_similar_results"])
+        logger.info("Anonymized response: %s", response_text)
 
-            response_text = self.model.invoke(prompt)
-            
-            self.log_used_sources(db_similar_results)
-            logger.info("Anonymized response: %s", response_text)
-            
+        replacements = state["replacements"]
+        trace = state["trace"]
+        with trace.activate(), span("deanonymization"):
             final_response = self.sensitive_data_handler.deanonymize(response_text, replacements)
+        return {
+            "final_response": final_response,
+            "anonymized_query": state["anonymized_query"],
+            "raw_response": response_text,
+            "replacements": replacements if replacements else "Nenhum dado sensível foi encontrado.",
+            "source_ids": state["source_ids"],
+            "cached": cached,
+            "timings": trace.timings(),
+            "trace": trace.as_list()
+        }
+
+    def json_extraction_error_result(self, error: JsonExtractionError) -> dict:
+        logger.error(f"Capturado erro de extração de JSON: {error}")
+        return {
+            "error": "json_extraction_failed",
+            "final_response": "Desculpe, não consegui processar sua pergunta corretamente. O formato dos dados parece ser complexo. Por favor, tente reformulá-la de maneira mais simples ou faça outra pergunta."
+        }
+
+    def server_busy_result(self, error: SchedulerFullError) -> dict:
+        logger.warning(f"Request rejected: {error}")
+        return {
+            "error": "server_busy",
+            "final_response": "O assistente está com muitas perguntas no momento. Por favor, aguarde alguns instantes e tente novamente."
+        }
+
+    def processing_error_result(self, error: Exception, state: dict) -> dict:
+        logger.error(f"Error processing query: {error}")
+        return {
+            "error": "processing_failed",
+            "final_response": "Desculpe, ocorreu um erro ao processar sua pergunta. Tente novamente.",
+            "anonymized_query": state.get("anonymized_query", "N/A"),
+            "raw_response": "N/A",
+            "replacements": "N/A"
+        }
+
+    def process_query(self, query_text: str, history: list = [], web_interface = False) -> dict:
+        state = {}
+        try:
+            with start_trace():
+                state = self.prepare_query(query_text, history)
+                response_text = state["cached_response"]
+                if response_text is None:
+                    response_text = self.generate(state["prompt"])
+
+                result = self.finish_query(state, response_text)
 
             if not web_interface:
-                print(final_response)
-
-            return {
-                "final_response": final_response,
-                "anonymized_query": anonymized_query,
-                "raw_response": response_text,
-                "replacements": replacements if replacements else "Nenhum dado sensível foi encontrado."
-            }
+                print(result["final_response"])
+
+            return result
+        except JsonExtractionError as e:
+            return self.json_extraction_error_result(e)
+        except SchedulerFullError as e:
+            return self.server_busy_result(e)
+        except Exception as e:
+            return self.processing_error_result(e, state)
+
+    async def aprocess_query(self, query_text: str, history: list = []) -> dict:
+        with start_trace():
+            return await self._aprocess_query(query_text, history)
+
+    async def _aprocess_query(self, query_text: str, history: list) -> dict:
+        state = {}
+        speculative_retrieval = None
+        try:
+            history_text, cited_ids = self.format_history(history)
+
+            # While the anonymization model runs, retrieval is started speculatively on the
+            # text anonymized by the rules alone. It is used only if the model finds nothing
+            # else; that embedding may still contain names, so it bypasses the persistent cache.
+            rule_data, needs_model = self.sensitive_data_handler.plan_extraction(query_text)
+            speculative_query = None
+            if needs_model:
+                speculative_query, _ = self.sensitive_data_handler.replace_sensitive_data(query_text, rule_data)
+                speculative_retrieval = asyncio.create_task(self.speculative_retrieve(speculative_query))
+                # Failures of a discarded speculation must not be reported as unretrieved exceptions
+                speculative_retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+            anonymized_query, replacements = await self.sensitive_data_handler.aanonymize(query_text, (rule_data, needs_model))
+            logger.info("Anonymized query: %s", anonymized_query)
+
+            speculative_hit = speculative_retrieval is not None and anonymized_query == speculative_query
+            with span("retrieval", speculative_hit=speculative_hit):
+                if speculative_hit:
+                    query_embedding, db_similar_results = await speculative_retrieval
+                else:
+                    query_embedding, db_similar_results = await self.aretrieve(anonymized_query)
+
+            state = self.build_query_state(anonymized_query, replacements, query_embedding, db_similar_results, history_text, cited_ids)
+
+            response_text = state["cached_response"]
+            if response_text is None:
+                response_text = await self.agenerate(state["prompt"])
+
+            result = self.finish_query(state, response_text)
+            result["speculative_retrieval_hit"] = speculative_hit
+            return result
         except JsonExtractionError as e:
-            logger.error(f"Capturado erro de extração de JSON: {e}")
-            return {
-                "error": "json_extraction_failed",
-                "final_response": "Desculpe, não consegui processar sua pergunta corretamente. O formato dos dados parece ser complexo. Por favor, tente reformulá-la de maneira mais simples ou faça outra pergunta."
-            }
+            return self.json_extraction_error_result(e)
+        except SchedulerFullError as e:
+            return self.server_busy_result(e)
+        except Exception as e:
+            return self.processing_error_result(e, state)
+        finally:
+            if speculative_retrieval is not None and not speculative_retrieval.done():
+                speculative_retrieval.cancel()
+
+    def stream_query(self, query_text: str, history: list = []) -> "QueryStream":
+        return QueryStream(self, query_text, history)
 
+class QueryStream:
+    """Iterates over the reidentified response while it is generated.
+
+    The result dict returned by process_query is available in `result` once
+    the stream is exhausted (or right after `prepare` if it failed).
+    """
+
+    def __init__(self, assistant: LegalAssistant, query_text: str, history: list):
+        self.assistant = assistant
+        self.query_text = query_text
+        self.history = history
+        self.state = None
+        self.result = None
+
+    def prepare(self):
+        if self.state is not None or self.result is not None:
+            return
+        try:
+            with start_trace():
+                self.state = self.assistant.prepare_query(self.query_text, self.history)
+        except JsonExtractionError as e:
+            self.result = self.assistant.json_extraction_error_result(e)
+        except SchedulerFullError as e:
+            self.result = self.assistant.server_busy_result(e)
+        except Exception as e:
+            self.result = self.assistant.processing_error_result(e, {})
+
+    def __iter__(self):
+        self.prepare()
+        if self.state is None:
+            yield self.result["final_response"]
+            return
+
+        state = self.state
+        if state["cached_response"] is not None:
+            self.result = self.assistant.finish_query(state, state["cached_response"])
+            yield self.result["final_response"]
+            return
+
+        handler = self.assistant.sensitive_data_handler
+        deanonymizer = StreamingDeanonymizer(handler, state["replacements"])
+        tokens = []
+        stats = OllamaStatsCallback()
+        # The generation span is recorded by hand, since context variables set here would leak to the caller across yields
+        started_at = time.perf_counter()
+        first_token_ms = None
+        try:
+            with self.assistant.scheduler.slot("generation"):
+                for token in self.assistant.model.stream(
+                    state["prompt"], system=RESPONSE_GENERATION_SYSTEM_PROMPT, config={"callbacks": [stats]}
+                ):
+                    if first_token_ms is None:
+                        first_token_ms = round(1000 * (time.perf_counter() - started_at), 2)
+                    tokens.append(token)
+                    text = deanonymizer.feed(token)
+                    if text:
+                        yield text
+            text = deanonymizer.flush()
+            if text:
+                yield text
+            generation_span = state["trace"].record("generation", started_at, first_token_ms=first_token_ms)
+            self.assistant.record_generation_stats(generation_span, state["prompt"], stats.generation_info)
+            self.result = self.assistant.finish_query(state, "".join(tokens))
+        except SchedulerFullError as e:
+            self.result = self.assistant.server_busy_result(e)
+            yield self.result["final_response"]
         except Exception as e:
-            logger.error(f"Error processing query: {e}")
-            return {
-                "final_response": "Desculpe, ocorreu um erro ao processar sua pergunta. Tente novamente.",
-                "anonymized_query": anonymized_query,
-                "raw_response": "N/A",
-                "replacements": "N/A"
-            }
\ No newline at end of file
+            self.result = self.assistant.processing_error_result(e, state)
+            yield self.result["final_response"]
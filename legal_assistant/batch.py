@@ -0,0 +1,272 @@
+"""Offline processing of many questions, started by `legal-assistant batch in.jsonl out.jsonl`.
+
+Each input line is {"query": str, "id": ..., "history": [...]} (the id defaults to
+the line number, the history has the format of the HTTP server). Each output line
+is {"id": ..., "query": ..., **result of process_query}, without the trace, so it
+carries the anonymized query, the replacements and the raw response.
+
+Up to `in_flight` records are processed at the same time: while some wait for the
+anonymization model, others are being retrieved or generated. The embeddings of
+the anonymized queries arriving together are requested in a single call, and
+records whose anonymized question (and history) is identical to another share its
+retrieval and generation, being reidentified with their own replacements.
+
+The output file is the checkpoint: lines are written as the records finish, in
+that order, and a new run over the same files skips the records already answered.
+Records that failed are processed again, so the last line of an id is the one
+that counts.
+"""
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+
+from legal_assistant.assistant import LegalAssistant
+from legal_assistant.utils import parse_history
+from legal_assistant.metrics import current_trace, span, start_trace
+from legal_assistant.sensitive_data_handler import JsonExtractionError
+from legal_assistant.scheduler import SchedulerFullError
+from legal_assistant.config import (
+    BATCH_IN_FLIGHT, BATCH_EMBEDDING_WAIT_SECONDS, BATCH_PROGRESS_EVERY, EMBEDDING_BATCH_SIZE, SCHEDULER_MAX_QUEUE_SIZE
+)
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Answered questions kept for the duplicates that come later in the file
+DEDUP_MAX_ENTRIES = 1024
+
+class EmbeddingBatcher:
+    """Collects the texts to embed for up to `max_wait` seconds (or `batch_size` texts) and embeds them in one call."""
+
+    def __init__(self, embedding_function, batch_size: int = EMBEDDING_BATCH_SIZE, max_wait: float = BATCH_EMBEDDING_WAIT_SECONDS):
+        self.embedding_function = embedding_function
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+        self.batches = []
+
+    async def embed(self, text: str) -> list[float]:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, []
+        if pending:
+            asyncio.ensure_future(self._embed(pending))
+
+    async def _embed(self, pending: list):
+        texts = list(dict.fromkeys(text for text, _future in pending))
+        self.batches.append(len(texts))
+        try:
+            vectors = dict(zip(texts, await self.embedding_function.aembed_documents(texts)))
+        except Exception as e:
+            for _text, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in pending:
+            if not future.done():
+                future.set_result(vectors[text])
+
+def read_records(input_path):
+    """Yields (id, record) for each line, or (id, error message) for the invalid ones."""
+    with open(input_path, encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get("query"), str) or not record["query"].strip():
+                yield line_number, "'query' must be a non-empty string."
+                continue
+            yield record.get("id", line_number), record
+
+def load_checkpoint(output_path) -> set:
+    """Returns the ids already answered in the output file, and drops a line left incomplete by an interruption."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_size = 0
+    with open(output_path, "rb") as output_file:
+        for line in output_file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            valid_size += len(line)
+            if "error" in result:
+                done.discard(_key(result.get("id")))
+            else:
+                done.add(_key(result.get("id")))
+    if valid_size < os.path.getsize(output_path):
+        logger.warning(f"Discarding an incomplete line at the end of {output_path}.")
+        with open(output_path, "r+b") as output_file:
+            output_file.truncate(valid_size)
+    return done
+
+def _key(record_id) -> str:
+    # Ids are compared through their JSON form, so 1 and "1" stay different
+    return json.dumps(record_id)
+
+def percentile(ordered: list[float], value: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, round(value / 100 * len(ordered)) - 1))] if ordered else 0.0
+
+class BatchRunner:
+    def __init__(self, assistant: LegalAssistant, output_file, in_flight: int = BATCH_IN_FLIGHT):
+        self.assistant = assistant
+        self.output_file = output_file
+        # More records in flight than the scheduler queues would be rejected as "server busy"
+        self.in_flight = max(1, min(in_flight, SCHEDULER_MAX_QUEUE_SIZE))
+        self.embedder = EmbeddingBatcher(assistant.embedding_function)
+        self.answers = OrderedDict()
+        self.latencies = []
+        self.counts = {"processed": 0, "errors": 0, "deduplicated": 0, "cached": 0}
+
+    async def answer(self, query_text: str, history: list) -> dict:
+        assistant = self.assistant
+        state = {}
+        try:
+            history_text, cited_ids = assistant.format_history(history)
+            anonymized_query, replacements = await assistant.sensitive_data_handler.aanonymize(query_text)
+            key = (anonymized_query, history_text)
+
+            shared = self.answers.get(key)
+            if shared is not None:
+                self.answers.move_to_end(key)
+                shared_state, response_text = await asyncio.shield(shared)
+                state = {**shared_state, "replacements": replacements, "cached_response": response_text, "trace": current_trace.get()}
+                result = assistant.finish_query(state, response_text)
+                result["deduplicated"] = True
+                return result
+
+            shared = asyncio.get_running_loop().create_future()
+            # Failures are delivered to the duplicates waiting for it, not reported as unretrieved
+            shared.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.answers[key] = shared
+            while len(self.answers) > DEDUP_MAX_ENTRIES:
+                self.answers.popitem(last=False)
+            try:
+                with span("retrieval"):
+                    with span("embedding"):
+                        query_embedding = await self.embedder.embed(anonymized_query)
+                    db_similar_results = await asyncio.to_thread(assistant.search, anonymized_query, query_embedding)
+                state = assistant.build_query_state(anonymized_query, replacements, query_embedding, db_similar_results, history_text, cited_ids)
+                response_text = state["cached_response"]
+                if response_text is None:
+                    response_text = await assistant.agenerate(state["prompt"])
+            except BaseException as e:
+                if self.answers.get(key) is shared:
+                    del self.answers[key]
+                if isinstance(e, Exception):
+                    shared.set_exception(e)
+                else:
+                    shared.cancel()
+                raise
+            shared.set_result(({name: value for name, value in state.items() if name != "trace"}, response_text))
+            return assistant.finish_query(state, response_text)
+        except JsonExtractionError as e:
+            return assistant.json_extraction_error_result(e)
+        except SchedulerFullError as e:
+            return assistant.server_busy_result(e)
+        except Exception as e:
+            return assistant.processing_error_result(e, state)
+
+    async def process(self, record_id, record):
+        started_at = time.perf_counter()
+        if isinstance(record, str):
+            result = {"error": "bad_record", "detail": record}
+        else:
+            with start_trace():
+                try:
+                    history = parse_history(record.get("history", []))
+                except ValueError as e:
+                    result = {"error": "bad_record", "detail": str(e)}
+                else:
+                    result = await self.answer(record["query"].strip(), history)
+            result.pop("trace", None)
+        self.write({"id": record_id, "query": None if isinstance(record, str) else record["query"], **result})
+
+        self.latencies.append(time.perf_counter() - started_at)
+        self.counts["processed"] += 1
+        self.counts["errors"] += "error" in result
+        self.counts["deduplicated"] += bool(result.get("deduplicated"))
+        self.counts["cached"] += bool(result.get("cached")) and not result.get("deduplicated")
+
+    def write(self, line: dict):
+        # Only the event loop writes, so each line is written whole
+        self.output_file.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        self.output_file.flush()
+        if self.counts["processed"] % BATCH_PROGRESS_EVERY == 0:
+            os.fsync(self.output_file.fileno())
+
+    async def run(self, records, skip: set) -> dict:
+        started_at = time.perf_counter()
+        slots = asyncio.Semaphore(self.in_flight)
+        tasks = set()
+        skipped = 0
+
+        async def process(record_id, record):
+            try:
+                await self.process(record_id, record)
+            finally:
+                slots.release()
+            if self.counts["processed"] % BATCH_PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - started_at
+                logger.info(f"{self.counts['processed']} records in {elapsed:.1f}s ({self.counts['processed'] / elapsed:.2f}/s).")
+
+        # Records are read only as the slots free up, so the input is never loaded whole
+        with self.assistant.scheduler.session("batch"):
+            for record_id, record in records:
+                if _key(record_id) in skip:
+                    skipped += 1
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(process(record_id, record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*list(tasks))
+        os.fsync(self.output_file.fileno())
+        return self.report(time.perf_counter() - started_at, skipped)
+
+    def report(self, elapsed: float, skipped: int) -> dict:
+        latencies = sorted(self.latencies)
+        batches = self.embedder.batches
+        return {
+            **self.counts,
+            "skipped": skipped,
+            "in_flight": self.in_flight,
+            "elapsed_seconds": round(elapsed, 3),
+            "records_per_second": round(self.counts["processed"] / elapsed, 3) if elapsed else 0.0,
+            "latency_p50_seconds": round(percentile(latencies, 50), 3),
+            "latency_p95_seconds": round(percentile(latencies, 95), 3),
+            "embedding_batches": len(batches),
+            "mean_embedding_batch": round(sum(batches) / len(batches), 2) if batches else 0.0,
+        }
+
+def run_batch(input_path, output_path, in_flight: int = BATCH_IN_FLIGHT, assistant: LegalAssistant | None = None) -> dict:
+    """Answers the questions of `input_path` into `output_path`, resuming a previous run, and returns the throughput report."""
+    done = load_checkpoint(output_path)
+    if done:
+        logger.info(f"Resuming: {len(done)} records already answered in {output_path}.")
+    assistant = assistant or LegalAssistant()
+    assistant.preload()
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        runner = BatchRunner(assistant, output_file, in_flight)
+        return asyncio.run(runner.run(read_records(input_path), done))
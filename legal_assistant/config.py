@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 PROJECT_DIR = Path(__file__).resolve().parent.parent
@@ -5,14 +6,194 @@ PROJECT_DIR = Path(__file__).resolve().parent.parent
 # Chroma DB path
 CHROMA_PATH = PROJECT_DIR / "chroma_db"
 
+# Manifest with the content hashes of the indexed files and chunks
+INDEX_MANIFEST_PATH = CHROMA_PATH / "index_manifest.json"
+
+# BM25 index built alongside the Chroma collection with the same chunk ids
+LEXICAL_INDEX_PATH = CHROMA_PATH / "lexical_index.json"
+
+# Retrieval mode:
+#   "vector" - similarity search on the embeddings only
+#   "hybrid" - vector and BM25 rankings combined by reciprocal rank fusion
+RETRIEVAL_MODE = "hybrid"
+
+# Maximum number of chunks used as context and number of candidates taken from each ranking in hybrid mode
+RETRIEVAL_K = 5
+RETRIEVAL_CANDIDATES = 20
+
+# Vector search backend:
+#   "chroma" - the Chroma collection itself
+#   "mmap"   - read-only export of the collection to memory-mapped NumPy matrices, rebuilt after every
+#              database update and shared through the page cache by all the processes serving queries
+VECTOR_BACKEND = "chroma"
+VECTOR_INDEX_PATH = CHROMA_PATH / "vector_index"
+
+# Storage type of the exported vectors: "int8" (a quarter of the float32 size) or "float16" (half of it)
+VECTOR_INDEX_DTYPE = "int8"
+
+# Number of clusters of the exported vectors (None for an exact search over all of them) and number of
+# clusters searched per query. Clustering keeps the latency flat as more codes are added
+VECTOR_INDEX_NLIST = None
+VECTOR_INDEX_NPROBE = 8
+
+# Second retrieval stage, which rescores the best candidates and keeps only the relevant ones:
+#   "lexical"       - coverage of the question terms, weighted by their rarity (no model needed)
+#   "cross-encoder" - small sentence-transformers cross-encoder on the CPU (optional dependency)
+#   None            - no reranking, the first RETRIEVAL_K chunks are used
+RERANKER = "lexical"
+RERANKER_CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+RERANKER_BATCH_SIZE = 16
+RERANK_CANDIDATES = 20
+
+# Reranked chunks are kept while their score is at least RERANK_MIN_SCORE and RERANK_RELATIVE_CUTOFF
+# times the best score (at least RERANK_MIN_K and at most RETRIEVAL_K chunks)
+RERANK_MIN_SCORE = 0.2
+RERANK_RELATIVE_CUTOFF = 0.5
+RERANK_MIN_K = 1
+
 # Default LLM model
 LLM_RESPONSE_GENERATION_MODEL = "gemma3:1b"
 
+# How long Ollama keeps each model loaded after its last request ("30m", "2h", -1 for always, 0 to unload at once)
+GENERATION_KEEP_ALIVE = "30m"
+ANONYMIZATION_KEEP_ALIVE = "30m"
+
+# Load the models and evaluate the static prompt prefixes in the background when the assistant starts
+WARM_UP_ON_STARTUP = True
+
+# Context window of the generation model and the part of it reserved for the answer (in tokens)
+GENERATION_NUM_CTX = 4096
+GENERATION_RESPONSE_TOKENS = 768
+
+# Maximum size of the conversation history in the prompt and number of recent messages kept verbatim;
+# older messages are replaced by a running summary
+HISTORY_MAX_TOKENS = 1024
+HISTORY_RECENT_MESSAGES = 4
+
+# Average number of characters per token, used to estimate the prompt size (conservative for Portuguese)
+CHARS_PER_TOKEN = 3.0
+
 # Alternative LLM model for anonymization
 LLM_ANONYMIZATION_MODEL = "mistral:7b"
 
+# Anonymization cascade: this small model extracts the sensitive data first, and the extraction is
+# checked against the question (values present in the text, known categories, no possible name or long
+# number left); only when the check fails is LLM_ANONYMIZATION_MODEL called. The generation model is used
+# by default, since it is loaded anyway. None sends every extraction to LLM_ANONYMIZATION_MODEL.
+# When it is the generation model, its extractions take the "generation" slots (GENERATION_MAX_CONCURRENCY
+# covers both), and the anonymization and answer prompts alternate in Ollama's context, so the answer
+# prompt prefix is evaluated again after each extraction (see legal_assistant_prompt_cached_tokens_total).
+# A separate small model (e.g. "gemma3:270m") keeps the answer prefix cached at the cost of its memory
+LLM_ANONYMIZATION_SMALL_MODEL = LLM_RESPONSE_GENERATION_MODEL
+
+# Attempts of the small model before escalating (the large one makes up to 3)
+ANONYMIZATION_SMALL_MODEL_RETRIES = 1
+
+# With the cascade, the large model only answers the escalated questions, so it is unloaded sooner
+ANONYMIZATION_ESCALATION_KEEP_ALIVE = "5m"
+
+# Anonymization mode:
+#   "llm"    - only the anonymization model detects sensitive data
+#   "hybrid" - deterministic rules run first and the model is only called when
+#              capitalized words that may be names, numbers of five or more digits
+#              (other than law and article numbers) or words that introduce a name
+#              or an address ("me chamo", "rua", "moro") remain in the text
+#   "rules"  - only the deterministic rules are used (the model is never called)
+ANONYMIZATION_MODE = "hybrid"
+
+# Constrain the anonymization model's output to the extraction JSON schema (requires Ollama 0.5 or newer)
+ANONYMIZATION_STRUCTURED_OUTPUT = True
+
 # LLM model for embedding
 LLM_EMBEDDING_MODEL = "nomic-embed-text"
 
+# Persistent cache of embeddings keyed by model and text hash
+EMBEDDING_CACHE_PATH = PROJECT_DIR / "embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# Number of query embeddings kept in memory
+EMBEDDING_QUERY_CACHE_SIZE = 1024
+
+# Number of chunks sent to the embedding model per request
+EMBEDDING_BATCH_SIZE = 64
+
+# Maximum number of embedding requests in flight while populating the database
+EMBEDDING_CONCURRENCY = 4
+
 # Documents path
 DOCUMENTS_PATH = PROJECT_DIR / "legal_assistant" / "documents"
+
+# How the documents are split into chunks:
+#   "legal"     - one chunk per article of the legislation (long ones split at their paragraphs, short
+#                 consecutive ones grouped), with the law, article and headings as metadata
+#   "recursive" - fixed-size chunks of 800 characters with 150 of overlap
+# Changing it re-indexes all the documents on the next database update
+CHUNKER = "legal"
+CHUNK_MAX_CHARS = 1200
+CHUNK_MIN_CHARS = 300
+
+# Number of processes used to parse the PDF documents
+PDF_LOADER_WORKERS = os.cpu_count() or 1
+
+# Large PDFs are split into page ranges of this size and parsed in parallel
+PDF_PAGES_PER_TASK = 100
+
+# Cache of generated responses keyed by the anonymized query and retrieved chunks
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_TTL_SECONDS = 60 * 60
+
+# Minimum cosine similarity for a different query to reuse a cached response (None disables it)
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = 0.97
+
+# Maximum number of simultaneous calls to each model shared by all sessions
+ANONYMIZATION_MAX_CONCURRENCY = 1
+GENERATION_MAX_CONCURRENCY = 2
+
+# Maximum number of requests waiting for each model before new ones are rejected
+SCHEDULER_MAX_QUEUE_SIZE = 32
+
+# Connection pool of each Ollama client (generation, anonymization and embeddings): connections are
+# kept open between requests instead of being opened for every call
+OLLAMA_MAX_CONNECTIONS = 32
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = 16
+OLLAMA_KEEPALIVE_EXPIRY_SECONDS = 120
+OLLAMA_TIMEOUT_SECONDS = 300
+
+# HTTP server started by `legal-assistant serve`. Each worker process runs its own assistant and
+# they all read the same database; SERVER_WORKERS = 0 starts one worker per CPU
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_WORKERS = 1
+SERVER_MAX_BODY_BYTES = 64 * 1024
+
+# Seconds the requests in progress have to finish after a shutdown signal
+SERVER_SHUTDOWN_TIMEOUT_SECONDS = 30
+
+# Workers that crash are replaced after a delay that doubles with each restart (up to the window); when
+# SERVER_MAX_RESTARTS happen within SERVER_RESTART_WINDOW_SECONDS the server stops with an error, since
+# the workers are probably failing to start
+SERVER_RESTART_BACKOFF_SECONDS = 1
+SERVER_MAX_RESTARTS = 5
+SERVER_RESTART_WINDOW_SECONDS = 60
+
+# `legal-assistant batch`: records processed at the same time (the anonymization, retrieval and generation
+# of different records overlap), how long a query embedding waits to be sent with others, and how often
+# the progress is logged and the output synced to disk
+BATCH_IN_FLIGHT = 8
+BATCH_EMBEDDING_WAIT_SECONDS = 0.05
+BATCH_PROGRESS_EVERY = 25
+
+# Conversations of the web interface. At most SESSION_MAX_SESSIONS are kept (the least recently used is
+# dropped beyond it) and sessions idle for SESSION_IDLE_SECONDS are dropped. Each keeps its last
+# SESSION_MAX_TURNS_IN_MEMORY messages in memory; older ones are written to SESSION_SPILL_PATH, encrypted
+# with a key that only exists in memory
+SESSION_MAX_SESSIONS = 200
+SESSION_MAX_TURNS_IN_MEMORY = 20
+SESSION_IDLE_SECONDS = 2 * 60 * 60
+SESSION_SPILL_PATH = PROJECT_DIR / "session_spill"
+
+# Local endpoint exposing the pipeline metrics of the web interface in the Prometheus text format (None
+# disables it). The HTTP server exposes them on its own port (GET /metrics of each worker)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
\ No newline at end of file
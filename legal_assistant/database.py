@@ -1,16 +1,25 @@
 import os
 import shutil
 import re
+import json
+import time
+import hashlib
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import batched
+from typing import TYPE_CHECKING
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.schema.document import Document
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_chroma import Chroma
+from legal_assistant.config import (
+    CHROMA_PATH, DOCUMENTS_PATH, LLM_EMBEDDING_MODEL, INDEX_MANIFEST_PATH,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY, PDF_LOADER_WORKERS, PDF_PAGES_PER_TASK,
+    EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_QUERY_CACHE_SIZE, LEXICAL_INDEX_PATH,
+    VECTOR_BACKEND, VECTOR_INDEX_PATH, VECTOR_INDEX_DTYPE, VECTOR_INDEX_NLIST, CHUNKER, CHUNK_MAX_CHARS, CHUNK_MIN_CHARS
+)
+from legal_assistant.lexical_index import LexicalIndex
 
-from chromadb.config import Settings
-
-from legal_assistant.config import CHROMA_PATH, DOCUMENTS_PATH, LLM_EMBEDDING_MODEL
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 import logging
 from legal_assistant.logging_formatter import LOGGER_NAME
@@ -19,12 +28,16 @@ logger = logging.getLogger(LOGGER_NAME)
 
 def update_database():
     logger.info("Updating database")
-    if check_database_exists():
-        clear_database()
-    populate_database()
+    # Without a manifest (an old database, or a first build interrupted before writing it), the stored
+    # chunks are kept: those still produced by the documents are skipped and the others are removed
+    sync_database(load_manifest())
 
 def check_database_exists():
-    return True if os.path.exists(CHROMA_PATH) else False
+    # A build that was interrupted is not a usable database: populate_database resumes it
+    if not os.path.exists(CHROMA_PATH):
+        return False
+    manifest = load_manifest()
+    return manifest is None or manifest.get("complete", True)
 
 def clear_database():
     logger.info("Cleaning existant database")
@@ -36,23 +49,190 @@ def populate_database():
         return
 
     logger.info("Loading and processing documents")
-    loaded_docs = load_documents()
-    norm_docs = normalize_documents(loaded_docs)
-    chunks = split_documents(norm_docs)
-    add_to_chroma(chunks)
-
-def load_documents():
-    all_docs = []
-    for filename in os.listdir(DOCUMENTS_PATH):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(DOCUMENTS_PATH, filename)
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
-            all_docs.extend(docs)
-    logger.info(f"Loaded documents: {len(all_docs)}")
-    return all_docs
-
-def split_documents(documents: list[Document]):
+    sync_database(load_manifest())
+
+def sync_database(manifest: dict | None):
+    """Brings the collection up to date with the documents, one file at a time.
+
+    The manifest is saved after each file and marked complete at the end, so an
+    interrupted run resumes from the last finished file, and the chunks already
+    stored for the file it stopped in are not embedded again.
+    """
+    # Without a manifest, the stored chunks no document produces anymore are swept at the end; the sweep is
+    # recorded in the manifest so that a run interrupted before it still does it when resumed
+    manifest = manifest or {"files": {}, "reconcile": True}
+    current_files = {filename: file_hash(os.path.join(DOCUMENTS_PATH, filename)) for filename in list_document_files()}
+    indexed_files = manifest["files"]
+
+    removed_files = [filename for filename in indexed_files if filename not in current_files]
+    # Databases built before the manifest recorded the chunker were split by the recursive one
+    rechunk = manifest.get("chunker", "recursive" if indexed_files else CHUNKER) != CHUNKER
+    changed_files = [filename for filename, digest in current_files.items()
+                     if rechunk or indexed_files.get(filename, {}).get("hash") != digest]
+    logger.info(f"Documents removed: {len(removed_files)}, added or changed: {len(changed_files)}")
+
+    manifest["complete"] = False
+    if not indexed_files:
+        # Every file is split by the current chunker in this run, so a resumed one keeps the files it finished
+        manifest["chunker"] = CHUNKER
+    save_manifest(manifest)
+
+    db = get_database()
+    lexical_index = load_lexical_index(db)
+    for filename in removed_files:
+        delete_chunks(db, lexical_index, indexed_files.pop(filename)["chunks"])
+
+    for filename in changed_files:
+        chunk_ids = []
+
+        def track_chunk_ids(chunks):
+            for chunk in chunks:
+                chunk_ids.append(chunk.metadata["id"])
+                lexical_index.add(chunk.metadata["id"], chunk.page_content)
+                yield chunk
+
+        chunks = calculate_chunk_ids(split_documents(load_documents([filename])))
+        add_to_chroma(track_chunk_ids(chunks), db)
+
+        previous_ids = indexed_files.get(filename, {}).get("chunks", [])
+        delete_chunks(db, lexical_index, set(previous_ids) - set(chunk_ids))
+        indexed_files[filename] = {"hash": current_files[filename], "chunks": chunk_ids}
+        lexical_index.save()
+        save_manifest(manifest)
+
+    if manifest.get("reconcile"):
+        known_ids = {chunk_id for entry in indexed_files.values() for chunk_id in entry["chunks"]}
+        delete_chunks(db, lexical_index, [chunk_id for chunk_id in stored_chunk_ids(db) if chunk_id not in known_ids])
+
+    lexical_index.save()
+    manifest["chunker"] = CHUNKER
+    if VECTOR_BACKEND == "mmap":
+        export_vector_index(db)
+    manifest.pop("reconcile", None)
+    manifest["complete"] = True
+    save_manifest(manifest)
+
+def stored_chunk_ids(db, page_size: int = 1000) -> list[str]:
+    chunk_ids, offset = [], 0
+    while True:
+        stored = db.get(include=[], limit=page_size, offset=offset)
+        chunk_ids.extend(stored["ids"])
+        if len(stored["ids"]) < page_size:
+            return chunk_ids
+        offset += page_size
+
+def export_vector_index(db=None):
+    from legal_assistant.vector_index import MappedVectorIndex
+
+    MappedVectorIndex.export(db or get_database(), VECTOR_INDEX_PATH, VECTOR_INDEX_DTYPE, VECTOR_INDEX_NLIST)
+
+def get_collection_version():
+    # The manifest is rewritten on every update, so its mtime identifies the collection contents
+    try:
+        return os.stat(INDEX_MANIFEST_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def delete_chunks(db, lexical_index: LexicalIndex, chunk_ids):
+    chunk_ids = list(chunk_ids)
+    if chunk_ids:
+        logger.info(f"Stale chunks to be removed: {len(chunk_ids)}")
+        db.delete(ids=chunk_ids)
+        lexical_index.remove(chunk_ids)
+
+def load_lexical_index(db) -> LexicalIndex:
+    lexical_index = LexicalIndex.load(LEXICAL_INDEX_PATH)
+    if lexical_index is not None:
+        return lexical_index
+
+    # Collections built before the lexical index existed are indexed from their stored documents
+    lexical_index = LexicalIndex(LEXICAL_INDEX_PATH)
+    offset, page_size = 0, 1000
+    while True:
+        stored = db.get(include=["documents"], limit=page_size, offset=offset)
+        for chunk_id, text in zip(stored["ids"], stored["documents"]):
+            lexical_index.add(chunk_id, text)
+        if len(stored["ids"]) < page_size:
+            break
+        offset += page_size
+    logger.info(f"Lexical index built from {len(lexical_index.doc_lengths)} stored chunks")
+    return lexical_index
+
+def load_manifest():
+    if not os.path.exists(INDEX_MANIFEST_PATH):
+        return None
+    with open(INDEX_MANIFEST_PATH, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(manifest: dict):
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    tmp_path = f"{INDEX_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, INDEX_MANIFEST_PATH)
+
+def file_hash(file_path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as document_file:
+        for block in iter(lambda: document_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def list_document_files():
+    return sorted(filename for filename in os.listdir(DOCUMENTS_PATH) if filename.lower().endswith(".pdf"))
+
+def load_documents(filenames: list[str] | None = None):
+    # Files are parsed in page ranges by a pool of processes. executor.map keeps
+    # the submission order, so pages are yielded in the same order as before.
+    from pypdf import PdfReader
+
+    tasks = []
+    for filename in filenames if filenames is not None else list_document_files():
+        page_count = len(PdfReader(os.path.join(DOCUMENTS_PATH, filename)).pages)
+        logger.info(f"Loading document {filename}: {page_count} pages")
+        for first_page in range(0, page_count, PDF_PAGES_PER_TASK):
+            tasks.append((filename, first_page, min(first_page + PDF_PAGES_PER_TASK, page_count)))
+
+    with ProcessPoolExecutor(max_workers=min(PDF_LOADER_WORKERS, len(tasks)) or 1) as executor:
+        for docs in executor.map(load_page_range, tasks):
+            yield from docs
+
+def load_page_range(task: tuple[str, int, int]) -> list["Document"]:
+    from pypdf import PdfReader
+    from langchain_core.documents import Document
+
+    filename, first_page, last_page = task
+    file_path = os.path.join(DOCUMENTS_PATH, filename)
+    reader = PdfReader(file_path)
+    page_labels = reader.page_labels
+    docs = []
+    for page_number in range(first_page, last_page):
+        text = reader.pages[page_number].extract_text(extraction_mode="plain")
+        # The line breaks are kept, since the legal chunker finds the articles by them
+        docs.append(Document(
+            page_content=text,
+            metadata={
+                "source": file_path,
+                "file": filename,
+                "page": page_number,
+                "page_label": page_labels[page_number],
+                "total_pages": len(reader.pages),
+            },
+        ))
+    return docs
+
+def split_documents(documents, chunker: str | None = None):
+    if (chunker or CHUNKER) == "legal":
+        from legal_assistant.legal_chunker import LegalChunker
+
+        yield from LegalChunker(CHUNK_MAX_CHARS, CHUNK_MIN_CHARS).split_documents(documents)
+        return
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=800,
         chunk_overlap=150,
@@ -69,63 +249,98 @@ def split_documents(documents: list[Document]):
             "",
         ],
     )
-    return text_splitter.split_documents(documents)
+    for doc in normalize_documents(documents):
+        yield from text_splitter.split_documents([doc])
 
-def normalize_documents(documents: list[Document]):
+def normalize_documents(documents):
     for doc in documents:
-        text = doc.page_content
-        
-        # Remove unnecessary breaklines and spaces
-        text = re.sub(r"\n+", " ", text)
-        text = re.sub(r" +", " ", text)
-        text = text.strip()
-        
-        doc.page_content = text
-    return documents
-
-def add_to_chroma(chunks: list[Document]):
+        doc.page_content = normalize_text(doc.page_content)
+        yield doc
+
+def normalize_text(text: str) -> str:
+    # Remove unnecessary breaklines and spaces
+    text = re.sub(r"\n+", " ", text)
+    text = re.sub(r" +", " ", text)
+    return text.strip()
+
+def get_database():
+    from langchain_chroma import Chroma
+    from chromadb.config import Settings
+
     settings = Settings(anonymized_telemetry=False)
-    db = Chroma(persist_directory=str(CHROMA_PATH), embedding_function=get_embedding_function(), client_settings=settings)
-    
-    chunks_with_ids = calculate_chunk_ids(chunks)
-
-    existing_items = db.get(include=[])
-    existing_ids = set(existing_items["ids"])
-    
-    logger.info(f"Chunks already in DB: {len(existing_ids)}")
-
-    new_chunks = []
-    for chunk in chunks_with_ids:
-        if chunk.metadata["id"] not in existing_ids:
-            new_chunks.append(chunk)
-
-    if len(new_chunks):
-        logger.info(f"New chunks to be added: {len(new_chunks)}")
-        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-        db.add_documents(new_chunks, ids=new_chunk_ids)
+    return Chroma(persist_directory=str(CHROMA_PATH), embedding_function=get_embedding_function(), client_settings=settings)
+
+def add_to_chroma(chunks, db=None):
+    db = db or get_database()
+    embedding_function = get_embedding_function()
+    progress = {"added": 0, "skipped": 0, "started_at": time.perf_counter()}
+
+    # Batches are embedded concurrently but at most EMBEDDING_CONCURRENCY of
+    # them are held in memory, and each one is written as soon as it is ready.
+    # Chunks already stored are skipped, so an interrupted run resumes where it stopped.
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+        pending = deque()
+        for batch in batched(chunks, EMBEDDING_BATCH_SIZE):
+            batch_ids = [chunk.metadata["id"] for chunk in batch]
+            existing_ids = set(db.get(ids=batch_ids, include=[])["ids"])
+            new_chunks = [chunk for chunk in batch if chunk.metadata["id"] not in existing_ids]
+            progress["skipped"] += len(batch) - len(new_chunks)
+            if not new_chunks:
+                continue
+
+            texts = [chunk.page_content for chunk in new_chunks]
+            pending.append((new_chunks, executor.submit(embedding_function.embed_documents, texts)))
+            if len(pending) >= EMBEDDING_CONCURRENCY:
+                upsert_chunks(db, *pending.popleft(), progress)
+
+        while pending:
+            upsert_chunks(db, *pending.popleft(), progress)
+
+    embedding_function.log_stats()
+    if progress["added"]:
+        logger.info(f"New chunks added: {progress['added']} (already in DB: {progress['skipped']})")
     else:
         logger.info("There are no new chunks to be added to the database.")
 
-def calculate_chunk_ids(chunks):
-    last_page_id = None
-    current_chunk_index = 0
+def upsert_chunks(db, chunks: list["Document"], embeddings_future, progress: dict):
+    embeddings = embeddings_future.result()
+    # langchain_chroma only accepts raw texts, so the precomputed vectors go straight to the collection
+    db._collection.upsert(
+        ids=[chunk.metadata["id"] for chunk in chunks],
+        embeddings=embeddings,
+        documents=[chunk.page_content for chunk in chunks],
+        metadatas=[chunk.metadata for chunk in chunks],
+    )
+    progress["added"] += len(chunks)
+    elapsed = time.perf_counter() - progress["started_at"]
+    logger.info(f"Embedded chunks: {progress['added']} ({progress['added'] / elapsed:.1f} chunks/s)")
 
+def calculate_chunk_ids(chunks):
+    # Ids are derived from the file name and the chunk text, so an edited page
+    # does not shift the ids of the chunks that follow it. Repeated text within
+    # the same file is indexed only once.
+    seen_ids = set()
     for chunk in chunks:
-        source = chunk.metadata.get("source")
-        page = chunk.metadata.get("page")
-        current_page_id = f"{source}:{page}"
-
-        if current_page_id == last_page_id:
-            current_chunk_index += 1
-        else:
-            current_chunk_index = 0
-
-        chunk_id = f"{current_page_id}:{current_chunk_index}"
-        last_page_id = current_page_id
+        filename = chunk.metadata.get("file") or os.path.basename(chunk.metadata.get("source", ""))
+        chunk_id = f"{filename}:{content_hash(chunk.page_content)[:32]}"
+        if chunk_id in seen_ids:
+            continue
+        seen_ids.add(chunk_id)
 
+        chunk.metadata["file"] = filename
         chunk.metadata["id"] = chunk_id
+        yield chunk
 
-    return chunks
-
+@lru_cache(maxsize=1)
 def get_embedding_function():
-    return OllamaEmbeddings(model=LLM_EMBEDDING_MODEL)
+    from langchain_ollama import OllamaEmbeddings
+    from legal_assistant.embedding_cache import CachedEmbeddings
+    from legal_assistant.utils import ollama_client_kwargs
+
+    return CachedEmbeddings(
+        OllamaEmbeddings(model=LLM_EMBEDDING_MODEL, client_kwargs=ollama_client_kwargs()),
+        model_name=LLM_EMBEDDING_MODEL,
+        cache_path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        query_cache_size=EMBEDDING_QUERY_CACHE_SIZE,
+    )
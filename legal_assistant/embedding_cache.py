@@ -0,0 +1,144 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model with a SQLite cache keyed by model and text hash.
+
+    Query embeddings are also kept in an in-memory LRU, since the same questions
+    are embedded repeatedly while the application is running.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path, max_entries: int, query_cache_size: int):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.query_cache_size = query_cache_size
+        self.query_cache = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._entries = 0
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._entries = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._connection
+
+    def cache_key(self, text: str) -> str:
+        normalized_text = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\0{normalized_text}".encode("utf-8")).hexdigest()
+
+    def _read(self, keys: list[str]) -> dict:
+        found = {}
+        with self._lock:
+            connection = self._get_connection()
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                connection.commit()
+        return found
+
+    def _write(self, vectors_by_key: dict):
+        with self._lock:
+            connection = self._get_connection()
+            now = time.time()
+            cursor = connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in vectors_by_key.items()],
+            )
+            self._entries += max(cursor.rowcount, 0)
+            if self._entries > self.max_entries:
+                # Evict 10% beyond the limit at once so eviction does not run on every write
+                excess = self._entries - int(self.max_entries * 0.9)
+                connection.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self._entries -= excess
+                self.stats["evictions"] += excess
+            connection.commit()
+
+    def _lookup(self, texts: list[str]):
+        keys = [self.cache_key(text) for text in texts]
+        cached = self._read(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        # Concurrent embedding batches look up from several threads
+        with self._lock:
+            self.stats["disk_hits"] += len(keys) - sum(1 for key in keys if key in missing)
+            self.stats["misses"] += len(missing)
+        return keys, cached, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self._write(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            computed = dict(zip(missing, await self.embeddings.aembed_documents(list(missing.values()))))
+            self._write(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def _get_query_from_memory(self, key: str):
+        with self._lock:
+            vector = self.query_cache.get(key)
+            if vector is not None:
+                self.query_cache.move_to_end(key)
+                self.stats["memory_hits"] += 1
+            return vector
+
+    def _put_query_in_memory(self, key: str, vector: list[float]):
+        with self._lock:
+            self.query_cache[key] = vector
+            self.query_cache.move_to_end(key)
+            while len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.cache_key(text)
+        vector = self._get_query_from_memory(key)
+        if vector is None:
+            vector = self.embed_documents([text])[0]
+            self._put_query_in_memory(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self.cache_key(text)
+        vector = self._get_query_from_memory(key)
+        if vector is None:
+            vector = (await self.aembed_documents([text]))[0]
+            self._put_query_in_memory(key, vector)
+        return vector
+
+    def log_stats(self):
+        logger.info(f"Embedding cache stats: {self.stats}")
@@ -0,0 +1,243 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+# "Art. 1º", "Art. 1o", "Art. 2.º", "Art. 29.", "Art. 1.604.", "Art. 31-A." and "Art. 3º-B."
+ARTICLE_PATTERN = re.compile(r"^\s*Art\.\s*(\d+(?:\.\d{3})*)(?:\.?\s*[º°]|o)?(\s*-\s*[A-Z]{1,2})?\.?(?=\s|$)")
+# Paragraphs, items and sub-items of an article, where a long article may be split
+PARAGRAPH_PATTERN = re.compile(r"^\s*(?:§\s*\d+|Parágrafo único|[IVXLCDM]+\s*[-–—]\s|[a-z]\)\s)", re.IGNORECASE)
+HEADING_PATTERN = re.compile(
+    r"^\s*(parte|livro|t[ií]tulo|cap[ií]tulo|se[çc][ãa]o|subse[çc][ãa]o)\s+([ivxlcdm]+|[úu]nic[oa]|geral|especial)\b",
+    re.IGNORECASE
+)
+HEADING_LEVELS = {"parte": 0, "livro": 1, "titulo": 2, "capitulo": 3, "secao": 4, "subsecao": 5}
+# Table of contents entries ("Seção IV ........ 51") and lines holding only a page number
+TOC_PATTERN = re.compile(r"\.{5,}\s*\d*\s*$")
+PAGE_NUMBER_PATTERN = re.compile(r"^\s*[\dIVXLC]+\s*$")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.;:])\s+")
+# Lines at the top of this many pages in a row (or every other page) are running headers
+FURNITURE_MIN_PAGES = 3
+# Number at the start or the end of a line, where the page number of a running header is
+EDGE_NUMBER_PATTERN = re.compile(r"^\s*(\d+)|(\d+)\s*$")
+
+def _heading_level(keyword: str) -> int:
+    return HEADING_LEVELS[keyword.lower().translate(str.maketrans("íçã", "ica"))]
+
+def _join_lines(lines: list[str]) -> str:
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        # Words hyphenated at the end of a line ("es-" + "tranhos")
+        if text.endswith("-") and len(text) > 1 and text[-2].isalpha() and line[0].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return re.sub(r"\s+", " ", text)
+
+def law_name(filename: str) -> str:
+    return os.path.splitext(filename)[0].replace("_", " ")
+
+class _FileChunker:
+    """Chunking state of one file, fed page by page."""
+
+    def __init__(self, metadata: dict, max_chars: int, min_chars: int):
+        self.base_metadata = {key: metadata[key] for key in ("source", "file", "total_pages") if key in metadata}
+        self.base_metadata["law"] = law_name(metadata.get("file") or os.path.basename(metadata.get("source", "")))
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.headings = {}
+        self.after_heading = False
+        self.heading_named = False
+        self.page_index = -1
+        self.page_tops = {}
+        self.furniture = set()
+        self.unit = None
+        self.pending = None
+
+    def _structure(self) -> str:
+        return " > ".join(self.headings[level] for level in sorted(self.headings))
+
+    def _start_unit(self, article: str | None, page_metadata: dict):
+        self.unit = {
+            "article": article,
+            "parts": [[]],
+            "page": page_metadata,
+            "structure": self._structure(),
+        }
+
+    def _is_page_furniture(self, line: str, position: int) -> bool:
+        # Running headers are repeated at the top of consecutive pages, often glued to the page number.
+        # A heading that happens to start several pages of the file ("DA ESCRITURAÇÃO") is not one, and
+        # neither are numbered lines whose number does not follow the pages ("Artigo 17", "Artigo 21")
+        key = re.sub(r"\d+", "", line).strip().lower()
+        if position >= 3 or not key or len(key) >= 120:
+            return False
+        if key in self.furniture:
+            return True
+        page_number = EDGE_NUMBER_PATTERN.search(line)
+        page_offset = int(page_number.group(1) or page_number.group(2)) - self.page_index if page_number else None
+        last_page, last_offset, streak = self.page_tops.get(key, (None, None, 0))
+        if last_page == self.page_index:
+            return False
+        following = last_page is not None and self.page_index - last_page <= 2 and page_offset == last_offset
+        streak = streak + 1 if following else 1
+        self.page_tops[key] = (self.page_index, page_offset, streak)
+        if streak >= FURNITURE_MIN_PAGES:
+            self.furniture.add(key)
+            return True
+        return False
+
+    def add_page(self, page: Document):
+        page_metadata = {key: page.metadata[key] for key in ("page", "page_label") if key in page.metadata}
+        self.page_index += 1
+        position = 0
+        for line in page.page_content.splitlines():
+            if not line.strip():
+                continue
+            position += 1
+            if TOC_PATTERN.search(line) or PAGE_NUMBER_PATTERN.match(line):
+                continue
+
+            article_match = ARTICLE_PATTERN.match(line)
+            heading_match = None if article_match or len(line) > 150 else HEADING_PATTERN.match(line)
+            if not (article_match or heading_match or PARAGRAPH_PATTERN.match(line)) and self._is_page_furniture(line, position):
+                continue
+            if article_match:
+                yield from self._flush_unit()
+                self._start_unit(article_match.group(1) + re.sub(r"\s+", "", article_match.group(2) or ""), page_metadata)
+                self.after_heading = False
+            elif heading_match:
+                yield from self._flush_unit()
+                level = _heading_level(heading_match.group(1))
+                self.headings = {key: value for key, value in self.headings.items() if key < level}
+                self.headings[level] = _join_lines([line])
+                self.after_heading = True
+                self.heading_named = " - " in line or " – " in line
+                continue
+            elif self.after_heading and len(line.strip()) < 150 and not PARAGRAPH_PATTERN.match(line):
+                # Name of the heading, on the line(s) below it ("CAPÍTULO I" / "NATUREZA E FINS");
+                # names in capitals may continue on the following lines
+                separator = " " if self.heading_named else " - "
+                self.headings[max(self.headings)] += separator + _join_lines([line])
+                self.heading_named = True
+                self.after_heading = line.isupper()
+                continue
+            else:
+                self.after_heading = False
+                if self.unit is None:
+                    self._start_unit(None, page_metadata)
+                elif PARAGRAPH_PATTERN.match(line) and self.unit["parts"][-1]:
+                    self.unit["parts"].append([])
+            self.unit["parts"][-1].append(line)
+
+    def _split_long(self, text: str) -> list[str]:
+        """Splits a paragraph longer than max_chars at sentence ends, or at spaces when a sentence is too long."""
+        pieces, current = [], ""
+        for sentence in SENTENCE_END_PATTERN.split(text):
+            while len(sentence) > self.max_chars:
+                cut = sentence.rfind(" ", 0, self.max_chars)
+                cut = cut if cut > 0 else self.max_chars
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+            if current and len(current) + 1 + len(sentence) > self.max_chars:
+                pieces.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _flush_unit(self):
+        unit, self.unit = self.unit, None
+        if unit is None:
+            return
+        paragraphs = []
+        for part in unit["parts"]:
+            text = _join_lines(part)
+            if text:
+                paragraphs.extend(self._split_long(text) if len(text) > self.max_chars else [text])
+        if not paragraphs:
+            return
+
+        # Paragraphs are packed into as few chunks as possible; the continuations
+        # of a long article are prefixed with its number, so they still name it
+        prefix = f"Art. {unit['article']} (continuação): " if unit["article"] else ""
+        chunks, current = [], ""
+        for paragraph in paragraphs:
+            if current and len(current) + 1 + len(paragraph) > self.max_chars:
+                chunks.append(current)
+                current = prefix + paragraph
+            else:
+                current = f"{current} {paragraph}" if current else paragraph
+        chunks.append(current)
+
+        if len(chunks) > 1:
+            yield from self._flush_pending()
+            for text in chunks:
+                yield self._document(text, unit, unit["article"])
+            return
+
+        # Short articles are grouped with the following ones of the same section, up to min_chars.
+        # Text outside the articles (preambles, annexes) is never mixed with them
+        text = chunks[0]
+        pending = self.pending
+        if (pending and len(pending["text"]) < self.min_chars and pending["structure"] == unit["structure"]
+                and bool(pending["article"]) == bool(unit["article"])
+                and len(pending["text"]) + 1 + len(text) <= self.max_chars):
+            pending["text"] += " " + text
+            pending["last_article"] = unit["article"]
+            return
+        yield from self._flush_pending()
+        self.pending = {**unit, "text": text, "last_article": unit["article"]}
+
+    def _flush_pending(self):
+        pending, self.pending = self.pending, None
+        if pending:
+            yield self._document(pending["text"], pending, pending["last_article"])
+
+    def _document(self, text: str, unit: dict, last_article: str | None) -> Document:
+        metadata = {**self.base_metadata, **unit["page"]}
+        if unit["structure"]:
+            metadata["structure"] = unit["structure"]
+        if unit["article"]:
+            metadata["article"] = unit["article"]
+        if last_article and last_article != unit["article"]:
+            metadata["last_article"] = last_article
+        return Document(page_content=text, metadata=metadata)
+
+    def finish(self):
+        yield from self._flush_unit()
+        yield from self._flush_pending()
+
+class LegalChunker:
+    """Splits Brazilian legislation into chunks aligned to its articles, in a single pass.
+
+    It reads the raw page text, with its line breaks, and recognizes the
+    structure of the codes (Parte, Livro, Título, Capítulo, Seção, Subseção, Art.,
+    §, incisos). Each article is one chunk; long articles are split at their
+    paragraphs and items, short consecutive ones of the same section are grouped.
+    Chunks carry the law, the article number(s) and the headings as metadata,
+    and have no overlap, since they never cut a provision in the middle.
+    Pages are consumed as they are loaded and articles may continue across pages.
+    """
+
+    def __init__(self, max_chars: int = 1200, min_chars: int = 300):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+
+    def split_documents(self, pages):
+        file_chunker = None
+        for page in pages:
+            if file_chunker is None or page.metadata.get("source") != file_chunker.base_metadata.get("source"):
+                if file_chunker is not None:
+                    yield from file_chunker.finish()
+                file_chunker = _FileChunker(page.metadata, self.max_chars, self.min_chars)
+            yield from file_chunker.add_page(page)
+        if file_chunker is not None:
+            yield from file_chunker.finish()
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import math
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# "Art. 1.604", "Lei 6.015" and "§ 2º" must match "art 1604", "lei 6015" and "§ 2"
+TOKEN_PATTERN = re.compile(r"§|\d+(?:\.\d+)*[ºª°]?|\w+")
+
+STOPWORDS = frozenset("""
+    a o as os um uma uns umas e ou de do da dos das no na nos nas em ao aos à às por pelo pela pelos
+    pelas para com sem que se sua seu suas seus sobre como mais ser ter é são foi não ele ela eles
+    elas este esta esse essa isso isto qual quais quando onde meu minha eu
+""".split())
+
+def _strip_accents(text: str) -> str:
+    return "".join(char for char in unicodedata.normalize("NFD", text) if not unicodedata.combining(char))
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token[0].isdigit():
+            token = token.replace(".", "").rstrip("ºª°")
+        else:
+            token = _strip_accents(token)
+        if token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+class LexicalIndex:
+    """BM25 inverted index over the chunks, kept in sync with the Chroma ids.
+
+    Besides the term frequencies, the index stores for each term the BM25 weight
+    of its best scoring chunks (impact-ordered postings). Queries only add up
+    those precomputed weights, which keeps them well under a millisecond; very
+    common terms lose their long tail of low weights, which barely affects the ranking.
+    """
+
+    def __init__(self, path, k1: float = 1.5, b: float = 0.75, max_postings_per_term: int = 256):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings_per_term = max_postings_per_term
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.impacts = {}
+        self.dirty = False
+        self.mtime = None
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        index = cls(path)
+        index._read()
+        return index
+
+    def _read(self):
+        with open(self.path, encoding="utf-8") as index_file:
+            data = json.load(index_file)
+        self.postings = data["postings"]
+        self.doc_lengths = data["doc_lengths"]
+        self.impacts = data["impacts"]
+        self.total_length = sum(self.doc_lengths.values())
+        self.dirty = False
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+    def reload_if_changed(self):
+        # Searches run on several threads: only one of them reloads a changed index
+        with self._reload_lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime != self.mtime:
+                logger.info("Lexical index changed on disk. Reloading it.")
+                self._read()
+
+    def save(self):
+        if self.dirty:
+            self._compute_impacts()
+        # Server workers may build the index at the same time, so each one writes its own file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as index_file:
+            json.dump(
+                {"postings": self.postings, "doc_lengths": self.doc_lengths, "impacts": self.impacts},
+                index_file, ensure_ascii=False
+            )
+        os.replace(tmp_path, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self.doc_lengths:
+            return
+        tokens = tokenize(text)
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        self.dirty = True
+        for term, frequency in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_ids):
+        doc_ids = {doc_id for doc_id in doc_ids if doc_id in self.doc_lengths}
+        if not doc_ids:
+            return
+        self.dirty = True
+        for doc_id in doc_ids:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in list(self.postings):
+            term_postings = self.postings[term]
+            for doc_id in doc_ids.intersection(term_postings):
+                del term_postings[doc_id]
+            if not term_postings:
+                del self.postings[term]
+
+    def _compute_impacts(self):
+        doc_count = len(self.doc_lengths)
+        avg_length = self.total_length / doc_count if doc_count else 0.0
+        self.impacts = {}
+        for term, term_postings in self.postings.items():
+            idf = math.log(1 + (doc_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            weights = []
+            for doc_id, frequency in term_postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                weights.append((doc_id, round(idf * frequency * (self.k1 + 1) / (frequency + norm), 4)))
+            self.impacts[term] = heapq.nlargest(self.max_postings_per_term, weights, key=lambda item: item[1])
+        self.dirty = False
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        if self.dirty:
+            self._compute_impacts()
+        # A reload replaces the impacts as a whole, so a search reads only one version of them
+        impacts = self.impacts
+        scores = {}
+        for term in set(tokenize(query)):
+            for doc_id, weight in impacts.get(term, ()):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,269 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self, extra_labels: tuple = ()) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{_format_labels(extra_labels + labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self, extra_labels: tuple = ()) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in self.series.items():
+                labels = extra_labels + labels
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def register_collector(self, name: str, collector):
+        """Registers a callable returning {metric_name: {labels_tuple: value}} gauges read at scrape time.
+
+        Registering again under the same name replaces the previous collector.
+        """
+        self.collectors[name] = collector
+
+    def render(self, extra_labels: tuple = ()) -> str:
+        """The metrics in the Prometheus text format, with `extra_labels` added to every series."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render(extra_labels))
+        gauges = {}
+        for collector in list(self.collectors.values()):
+            for name, values in collector().items():
+                gauges.setdefault(name, {}).update(values)
+        for name, values in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values.items():
+                lines.append(f"{name}{_format_labels(extra_labels + labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("legal_assistant_stage_seconds", "Duration of each pipeline stage.")
+OLLAMA_TOKENS = REGISTRY.counter("legal_assistant_ollama_tokens_total", "Tokens evaluated by Ollama per model and kind.")
+OLLAMA_EVAL_SECONDS = REGISTRY.histogram("legal_assistant_ollama_eval_seconds", "Ollama evaluation time per model and phase.")
+PROMPT_CACHED_TOKENS = REGISTRY.counter("legal_assistant_prompt_cached_tokens_total", "Estimated prompt tokens reused from the Ollama KV cache.")
+PREFILL_SAVED_SECONDS = REGISTRY.counter("legal_assistant_prefill_saved_seconds_total", "Estimated prefill time saved by the KV cache reuse.")
+
+class Span:
+    __slots__ = ("name", "parent", "started_at", "duration", "attributes")
+
+    def __init__(self, name: str, parent: str | None, attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.started_at = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+
+    def as_dict(self) -> dict:
+        return {"name": self.name, "parent": self.parent, "duration_ms": round(1000 * (self.duration or 0.0), 2), **self.attributes}
+
+class Trace:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def activate(self):
+        token = current_trace.set(self)
+        try:
+            yield self
+        finally:
+            current_trace.reset(token)
+
+    def record(self, name: str, started_at: float, **attributes) -> Span:
+        """Adds an already finished span, for stages that cannot be wrapped in `span` (e.g. across a generator's yields)."""
+        finished_span = Span(name, None, attributes)
+        finished_span.started_at = started_at
+        finished_span.duration = time.perf_counter() - started_at
+        self.add(finished_span)
+        STAGE_SECONDS.observe(finished_span.duration, stage=name)
+        return finished_span
+
+    def timings(self) -> dict:
+        timings = {}
+        for span in self.spans:
+            if span.parent is None and span.duration is not None:
+                timings[span.name] = timings.get(span.name, 0.0) + span.duration
+        timings["total"] = time.perf_counter() - self.started_at
+        return timings
+
+    def as_list(self) -> list[dict]:
+        return [span.as_dict() for span in self.spans]
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+def start_trace():
+    return Trace().activate()
+
+@contextmanager
+def span(name: str, **attributes):
+    parent = current_span.get()
+    new_span = Span(name, parent.name if parent else None, attributes)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(new_span)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    finally:
+        current_span.reset(token)
+        new_span.duration = time.perf_counter() - new_span.started_at
+        STAGE_SECONDS.observe(new_span.duration, stage=name)
+
+class OllamaStatsCallback(BaseCallbackHandler):
+    """Keeps the generation_info of the last Ollama call (token counts and eval durations).
+
+    It works for invoke, ainvoke and stream alike, since langchain passes the
+    aggregated generation, including the final chunk's info, to on_llm_end.
+    """
+
+    def __init__(self):
+        self.generation_info = {}
+
+    def on_llm_end(self, response, **kwargs):
+        if response.generations and response.generations[0]:
+            self.generation_info = response.generations[0][0].generation_info or {}
+
+def record_ollama_stats(target_span: Span, model_name: str, generation_info: dict | None):
+    if not generation_info:
+        return
+    prompt_tokens = generation_info.get("prompt_eval_count") or 0
+    completion_tokens = generation_info.get("eval_count") or 0
+    target_span.attributes.update({
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "prompt_eval_ms": round((generation_info.get("prompt_eval_duration") or 0) / 1e6, 2),
+        "eval_ms": round((generation_info.get("eval_duration") or 0) / 1e6, 2),
+        "load_ms": round((generation_info.get("load_duration") or 0) / 1e6, 2),
+    })
+    OLLAMA_TOKENS.inc(prompt_tokens, model=model_name, kind="prompt")
+    OLLAMA_TOKENS.inc(completion_tokens, model=model_name, kind="completion")
+    if generation_info.get("prompt_eval_duration"):
+        OLLAMA_EVAL_SECONDS.observe(generation_info["prompt_eval_duration"] / 1e9, model=model_name, phase="prompt")
+    if generation_info.get("eval_duration"):
+        OLLAMA_EVAL_SECONDS.observe(generation_info["eval_duration"] / 1e9, model=model_name, phase="completion")
+
+def record_prefix_reuse(target_span: Span, model_name: str, generation_info: dict | None, prefix_tokens: int, variable_tokens: int):
+    """Estimates how much of the static prompt prefix Ollama took from its KV cache.
+
+    Ollama only counts the prompt tokens it actually evaluated, so the difference
+    to the expected prompt size (capped at the prefix) was reused, and the time
+    saved is that many tokens at the prefill rate measured in this request.
+    """
+    evaluated = (generation_info or {}).get("prompt_eval_count")
+    duration = (generation_info or {}).get("prompt_eval_duration")
+    if not evaluated or not duration:
+        return
+    cached_tokens = min(prefix_tokens, max(prefix_tokens + variable_tokens - evaluated, 0))
+    saved_seconds = cached_tokens * duration / 1e9 / evaluated
+    target_span.attributes["cached_prompt_tokens"] = cached_tokens
+    target_span.attributes["prefill_saved_ms"] = round(1000 * saved_seconds, 2)
+    PROMPT_CACHED_TOKENS.inc(cached_tokens, model=model_name)
+    PREFILL_SAVED_SECONDS.inc(saved_seconds, model=model_name)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(host: str, port: int):
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is not None:
+            return _metrics_server
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = REGISTRY.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+            return None
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics available at http://{host}:{port}/metrics")
+        return _metrics_server
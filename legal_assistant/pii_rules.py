@@ -0,0 +1,150 @@
+import re
+
+# Deterministic detection of the sensitive data that follows a fixed format
+# (documents, court cases, bank accounts, contacts and dates). Each rule yields items in the same
+# {"categoria", "valor"} shape returned by the anonymization model.
+
+MONTHS = "janeiro|fevereiro|março|marco|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro"
+
+def _digits(value: str) -> str:
+    return re.sub(r"\D", "", value)
+
+def _mod11_digit(digits: str, weights: list[int]) -> int:
+    remainder = sum(int(d) * w for d, w in zip(digits, weights)) % 11
+    return 0 if remainder < 2 else 11 - remainder
+
+def is_valid_cpf(value: str) -> bool:
+    digits = _digits(value)
+    if len(digits) != 11 or digits == digits[0] * 11:
+        return False
+    first = _mod11_digit(digits[:9], list(range(10, 1, -1)))
+    second = _mod11_digit(digits[:10], list(range(11, 1, -1)))
+    return digits[9:] == f"{first}{second}"
+
+def is_valid_cnpj(value: str) -> bool:
+    digits = _digits(value)
+    if len(digits) != 14 or digits == digits[0] * 14:
+        return False
+    first = _mod11_digit(digits[:12], [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    second = _mod11_digit(digits[:13], [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    return digits[12:] == f"{first}{second}"
+
+def is_valid_nis(value: str) -> bool:
+    digits = _digits(value)
+    if len(digits) != 11:
+        return False
+    return int(digits[10]) == _mod11_digit(digits[:10], [3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+# "Lei nº 8.935, de 18 de novembro de 1994": the date identifies the law, not a person
+LEGAL_ACT_DATE_CONTEXT = re.compile(
+    r"\b(?:lei|decreto|decreto-lei|provimento|resolu[çc][ãa]o|portaria|emenda|medida provis[óo]ria)"
+    r"\s*(?:complementar\s*)?(?:n[º°o.]*\s*)?\d[\d.]*(?:/\d{2,4})?\s*,?\s*(?:de\s*)?$",
+    re.IGNORECASE
+)
+
+def _is_valid_numeric_date(value: str) -> bool:
+    day, month, _year = re.split(r"[/.-]", value)
+    return 1 <= int(day) <= 31 and 1 <= int(month) <= 12
+
+# (categoria, pattern, validator). Rules are applied in order and a span that
+# was already claimed by a previous rule is never reported again, so the
+# keyword-anchored rules come before the bare numeric ones.
+RULES = [
+    ("email", re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b"), None),
+    # Case number in the CNJ format: NNNNNNN-DD.AAAA.J.TR.OOOO
+    ("processo", re.compile(r"(?<![\d.])\d{7}-?\d{2}\.?\d{4}\.?\d\.?\d{2}\.?\d{4}(?![\d.-])"), None),
+    ("processo", re.compile(r"\bprocesso\b[\s:nº°.-]*(\d[\d./-]{4,23}\d)\b", re.IGNORECASE), None),
+    ("agencia", re.compile(r"\bag(?:[êe]ncia|\.)\s*(?:n[º°o.]*\s*)?:?\s*(\d{3,5}(?:-[\dXx])?)(?![\w-])", re.IGNORECASE), None),
+    ("conta_bancaria", re.compile(
+        r"\b(?:conta|c/c)(?:\s+(?:corrente|poupan[çc]a|banc[áa]ria|salário|salario))?\s*(?:n[º°o.]*\s*)?:?\s*(\d[\d.]{2,14}-?[\dXx])(?![\w-])",
+        re.IGNORECASE
+    ), None),
+    ("cnpj", re.compile(r"(?<![\d.])\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}(?![\d-])"), is_valid_cnpj),
+    ("nis", re.compile(r"\b(?:NIS|PIS|PASEP|NIT)\b[\s:nº°.-]*(\d{3}\.?\d{5}\.?\d{2}-?\d)\b", re.IGNORECASE), None),
+    ("cnh", re.compile(r"\bCNH\b[\s:nº°.-]*(\d{9,11})\b", re.IGNORECASE), None),
+    ("rg", re.compile(r"\bRG\b[\s:nº°.-]*(\d[\d.]{4,12}-?[\dXx])(?![\w-])", re.IGNORECASE), None),
+    ("rg", re.compile(r"(?<![\d.])\d{1,2}\.\d{3}\.\d{3}-[\dXx](?!\d|[.-]\d)"), None),
+    ("cpf", re.compile(r"(?<![\d.])\d{3}\.\d{3}\.\d{3}-\d{2}(?![\d-])"), None),
+    ("cpf", re.compile(r"(?<![\d.])\d{11}(?!\d)"), is_valid_cpf),
+    ("nis", re.compile(r"(?<![\d.])\d{11}(?!\d)"), is_valid_nis),
+    ("cep", re.compile(r"\bCEP\b[\s:nº°.-]*(\d{2}\.?\d{3}-?\d{3})\b", re.IGNORECASE), None),
+    ("cep", re.compile(r"(?<![\d.-])\d{5}-\d{3}(?![\d-])"), None),
+    ("telefone", re.compile(r"(?:\+55\s?)?\(\d{2}\)\s?9?\d{4}-?\d{4}(?!\d)"), None),
+    ("telefone", re.compile(r"(?<![\d.-])(?:\+55\s?)?(?:\d{2}\s)?9?\d{4}-\d{4}(?![\d-])"), None),
+    ("data", re.compile(rf"\b\d{{1,2}}[º°]?\s+de\s+(?:{MONTHS})\s+de\s+\d{{4}}\b", re.IGNORECASE), None),
+    ("data", re.compile(r"(?<![\d/.-])\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})(?!\d|[/.-]\d)"), _is_valid_numeric_date),
+    ("idade", re.compile(r"\b(?:tenho|tem|tinha|completou|completei|completa|com)\s+(\d{1,3}\s+anos)\b", re.IGNORECASE), None),
+]
+
+def extract_with_rules(text: str) -> dict:
+    claimed = []
+    dados = []
+    for categoria, pattern, validator in RULES:
+        for match in pattern.finditer(text):
+            group = 1 if match.re.groups else 0
+            start, end = match.span(group)
+            value = match.group(group)
+            if any(start < c_end and c_start < end for c_start, c_end in claimed):
+                continue
+            if validator and not validator(value):
+                continue
+            if categoria == "data" and LEGAL_ACT_DATE_CONTEXT.search(text[max(0, start - 60):start]):
+                continue
+            claimed.append((start, end))
+            dados.append({"categoria": categoria, "valor": value})
+    return {"dados": dados}
+
+def mask_values(text: str, sensitive_data: dict) -> str:
+    for item in sensitive_data.get("dados", []):
+        text = text.replace(item["valor"], " ")
+    return text
+
+# Capitalized words that are common at the start of a sentence or in legal
+# questions and therefore do not suggest a personal name.
+COMMON_WORDS = frozenset("""
+    a o as os um uma uns umas e é ou se eu ele ela eles elas nós você vocês meu minha meus minhas
+    seu sua seus suas nosso nossa nossos nossas dele dela deles delas esse essa este esta isso isto
+    aquele aquela aquilo qual quais quanto quantos quanta quantas quando onde como porque por que
+    quem o que para pra com sem sobre entre de do da dos das no na nos nas em ao aos à às pelo pela
+    conforme segundo caso sendo olá ola oi bom boa dia tarde noite prezados prezado prezada caro cara obrigado obrigada
+    gostaria preciso quero queria posso pode podemos devo deve devemos existe existem há tem tenho
+    temos sou estou estamos fui foi foram vou vai vamos sabe saber necessário necessária possível
+    também então mas porém contudo além após antes depois ainda já não sim sr sra dr dra
+    lei leis código codigo civil processo penal constituição federal estadual municipal art artigo
+    artigos parágrafo paragrafo inciso capítulo capitulo título titulo seção secao provimento
+    resolução resolucao decreto norma normas nacional registro registros público públicos publico
+    publicos cartório cartorio cartórios tabelionato tabelião oficial ofício oficio serventia
+    certidão certidao certidões nascimento casamento óbito obito divórcio divorcio união estável
+    estavel escritura procuração procuracao imóvel imovel imóveis averbação averbacao retificação
+    retificacao reconhecimento paternidade maternidade adoção adocao nome sobrenome documento
+    documentos identidade carteira justiça justica tribunal juiz juíza ministério ministerio
+    defensoria estado união conselho corregedoria extrajudicial judicial brasil
+""".split())
+
+ACRONYMS = frozenset("""
+    CPF CNPJ RG CNH NIS PIS PASEP NIT CEP CNJ STF STJ TJSC INSS SUS OAB CRC DNV CTPS
+    ONG LGPD CC CPC ECA CF UF RCPN
+""".split())
+
+# Lowercase names and addresses have no capital letter to give them away, so the
+# words that usually introduce them also call for the model
+_PERSONAL_CONTEXT = re.compile(
+    r"\b(?:me chamo|meu nome|nome d[oae]s?|chamad[oa]s?|chama-se|se chama|rua|avenida|av\.|travessa|alameda|"
+    r"rodovia|estrada|praça|praca|bairro|apartamento|apto|moro|resido|residente|domiciliad[oa])\b",
+    re.IGNORECASE
+)
+
+def has_personal_context(text: str) -> bool:
+    return _PERSONAL_CONTEXT.search(text) is not None
+
+_NAME_CANDIDATE = re.compile(r"\b(?:[A-ZÀ-Ý][a-zà-ÿ]+|[A-ZÀ-Ý]{3,})\b")
+
+def has_name_candidates(text: str) -> bool:
+    for match in _NAME_CANDIDATE.finditer(text):
+        word = match.group(0)
+        if word.isupper():
+            if word not in ACRONYMS:
+                return True
+        elif word.lower() not in COMMON_WORDS:
+            return True
+    return False
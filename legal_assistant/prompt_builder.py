@@ -0,0 +1,163 @@
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+    return math.ceil(len(text) / chars_per_token)
+
+def _prefix_digests(lines: list[str]) -> list[str]:
+    digest = hashlib.sha256()
+    digests = [digest.hexdigest()]
+    for line in lines:
+        digest.update(line.encode("utf-8") + b"\0")
+        digests.append(digest.copy().hexdigest())
+    return digests
+
+class HistorySummarizer:
+    """Running summaries of the older turns of the conversations, computed in the background.
+
+    Summaries are keyed by the exact sequence of turns they cover. A query uses
+    the summary of the longest covered prefix of its older turns and schedules
+    the update for the remaining ones, which is ready by the next question.
+    """
+
+    def __init__(self, summarize_fn, max_entries: int = 256):
+        self.summarize_fn = summarize_fn
+        self.max_entries = max_entries
+        self.summaries = OrderedDict()
+        self.pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    def lookup(self, lines: list[str]) -> tuple[str, int]:
+        """Returns the summary covering the longest prefix of lines and the number of lines it covers."""
+        digests = _prefix_digests(lines)
+        with self._lock:
+            for covered in range(len(lines), 0, -1):
+                summary = self.summaries.get(digests[covered])
+                if summary is not None:
+                    self.summaries.move_to_end(digests[covered])
+                    return summary, covered
+        return "", 0
+
+    def schedule(self, lines: list[str]):
+        digest = _prefix_digests(lines)[-1]
+        with self._lock:
+            if digest in self.summaries or digest in self.pending:
+                return
+            self.pending.add(digest)
+        previous_summary, covered = self.lookup(lines)
+        self._executor.submit(self._summarize, digest, previous_summary, lines[covered:])
+
+    def _summarize(self, digest: str, previous_summary: str, new_lines: list[str]):
+        try:
+            summary = self.summarize_fn(previous_summary, "\n".join(new_lines)).strip()
+        except Exception as e:
+            logger.warning(f"Failed to summarize the conversation history: {e}")
+            return
+        finally:
+            with self._lock:
+                self.pending.discard(digest)
+        with self._lock:
+            self.summaries[digest] = summary
+            while len(self.summaries) > self.max_entries:
+                self.summaries.popitem(last=False)
+
+class PromptBuilder:
+    """Fits the history and the retrieved chunks into the model's context window.
+
+    The window is split between the template, the question, the history (at most
+    `history_max_tokens`) and the chunks, leaving `response_tokens` free for the
+    answer. Recent messages are kept verbatim; older ones are replaced by a
+    running summary. Chunks already cited by the answers still shown verbatim are
+    moved to the end of the ranking, so they are the first dropped when space runs out.
+    Token counts are estimated from the text length.
+    """
+
+    def __init__(self, template: str, summarize_fn, num_ctx: int, response_tokens: int, history_max_tokens: int,
+                 recent_messages: int, chars_per_token: float, max_older_message_chars: int = 300):
+        self.template = template
+        self.summarizer = HistorySummarizer(summarize_fn)
+        self.num_ctx = num_ctx
+        self.response_tokens = response_tokens
+        self.history_max_tokens = history_max_tokens
+        self.recent_messages = recent_messages
+        self.chars_per_token = chars_per_token
+        self.max_older_message_chars = max_older_message_chars
+
+    def tokens(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    def history_section(self, messages: list) -> tuple[str, set[str]]:
+        """Returns the history text for the prompt and the ids of the chunks cited in the verbatim turns."""
+        if not messages:
+            return "", set()
+
+        lines = []
+        for msg in messages:
+            role = "Usuário" if isinstance(msg, HumanMessage) else "Assistente"
+            lines.append(f"{role}: {msg.content}")
+
+        split = max(len(messages) - self.recent_messages, 0)
+        cited_ids = set()
+        for msg in messages[split:]:
+            details = (getattr(msg, "metadata", None) or {}).get("processing_details") or {}
+            cited_ids.update(details.get("source_ids") or [])
+
+        parts = []
+        older = lines[:split]
+        if older:
+            summary, covered = self.summarizer.lookup(older)
+            self.summarizer.schedule(older)
+            if summary:
+                parts.append(f"Resumo da conversa anterior: {summary}")
+            # Turns not summarized yet are kept, shortened, until their summary is ready
+            for line in older[covered:]:
+                parts.append(line if len(line) <= self.max_older_message_chars else line[:self.max_older_message_chars] + "...")
+        parts.extend(lines[split:])
+
+        kept = []
+        used = 0
+        for part in reversed(parts):
+            cost = self.tokens(part) + 1
+            if used + cost > self.history_max_tokens:
+                break
+            kept.append(part)
+            used += cost
+        return "\n".join(reversed(kept)), cited_ids
+
+    def select_context(self, question: str, history_text: str, results: list, cited_ids: set[str]) -> list:
+        """Returns the retrieved (document, score) pairs that fit in the remaining budget, in their original order."""
+        budget = (
+            self.num_ctx - self.response_tokens
+            - self.tokens(self.template) - self.tokens(question) - self.tokens(history_text)
+        )
+        separator_tokens = self.tokens(CONTEXT_SEPARATOR)
+        ranked = sorted(range(len(results)), key=lambda index: results[index][0].metadata.get("id") in cited_ids)
+
+        selected = []
+        used = 0
+        for index in ranked:
+            cost = self.tokens(results[index][0].page_content) + separator_tokens
+            if used + cost <= budget:
+                selected.append(index)
+                used += cost
+
+        if not selected and ranked and budget > 0:
+            # Not even one chunk fits: the best one is truncated rather than answering without context
+            doc, score = results[ranked[0]]
+            truncated = Document(page_content=doc.page_content[:int(budget * self.chars_per_token)], metadata=doc.metadata)
+            return [(truncated, score)]
+        return [results[index] for index in sorted(selected)]
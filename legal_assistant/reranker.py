@@ -0,0 +1,168 @@
+import math
+import threading
+from collections import Counter, OrderedDict
+
+from legal_assistant.lexical_index import tokenize
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+class LexicalReranker:
+    """Scores each candidate by how well it covers the query terms, in [0, 1].
+
+    Terms are weighted by their rarity, so a chunk matching the specific terms
+    of the question ("averbação", "1604") beats one that only repeats the common
+    ones. The rarity comes from the document frequencies of the BM25 index, so
+    the score of a chunk does not depend on the other candidates; without the
+    index it is measured among the candidates themselves. It needs no model and
+    takes a fraction of a millisecond for a few dozen candidates.
+    """
+
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, lexical_index=None):
+        self.k1 = k1
+        self.lexical_index = lexical_index
+
+    @property
+    def candidate_dependent(self) -> bool:
+        return self.lexical_index is None
+
+    @property
+    def version(self):
+        # The term rarities change when the index is rebuilt and reloaded
+        return self.lexical_index.mtime if self.lexical_index is not None else None
+
+    def _weights(self, query_terms: set[str], term_counts: list[Counter]) -> dict[str, float]:
+        if self.lexical_index is not None:
+            doc_count = len(self.lexical_index.doc_lengths)
+            return {term: math.log(1 + (doc_count - len(self.lexical_index.postings.get(term, ())) + 0.5)
+                                   / (len(self.lexical_index.postings.get(term, ())) + 0.5))
+                    for term in query_terms}
+        return {term: math.log(1 + (len(term_counts) + 1) / (sum(1 for counts in term_counts if term in counts) + 0.5))
+                for term in query_terms}
+
+    def score(self, query: str, texts: list[str]) -> list[float]:
+        query_terms = set(tokenize(query))
+        if not query_terms or not texts:
+            return [0.0] * len(texts)
+
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        weights = self._weights(query_terms, term_counts)
+        max_score = sum(weights.values())
+        if max_score <= 0:
+            return [0.0] * len(texts)
+
+        scores = []
+        for counts in term_counts:
+            # A single occurrence counts fully; repetitions only add up to the saturation of BM25
+            score = sum(weight * counts[term] * (self.k1 + 1) / (counts[term] + self.k1)
+                        for term, weight in weights.items() if term in counts)
+            scores.append(min(score / max_score, 1.0))
+        return scores
+
+class CrossEncoderReranker:
+    """Small cross-encoder from sentence-transformers, run on the CPU in batches.
+
+    sentence-transformers is an optional dependency: `poetry install --extras cross-encoder`.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str, batch_size: int = 16):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def score(self, query: str, texts: list[str]) -> list[float]:
+        if not texts:
+            return []
+        logits = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size, show_progress_bar=False)
+        return [1.0 / (1.0 + math.exp(-float(logit))) for logit in logits]
+
+class CachedReranker:
+    """Keeps the scores of (query, chunk id) pairs, so repeated questions skip the model.
+
+    Rerankers whose scores depend on the whole candidate set (`candidate_dependent`)
+    are cached per (query, candidate ids) instead, so every score of a list comes
+    from the same call. The chunk ids follow their text, but the scores may also
+    depend on the corpus: the cache is cleared when the reranker's `version` changes.
+    """
+
+    def __init__(self, reranker, max_entries: int = 4096):
+        self.reranker = reranker
+        self.name = reranker.name
+        self.max_entries = max_entries
+        self.scores = OrderedDict()
+        self.version = getattr(reranker, "version", None)
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        version = getattr(self.reranker, "version", None)
+        with self._lock:
+            if version != self.version:
+                self.scores.clear()
+                self.version = version
+
+    def score(self, query: str, chunk_ids: list[str], texts: list[str]) -> list[float]:
+        self._check_version()
+        if getattr(self.reranker, "candidate_dependent", False):
+            return self._score_candidate_set(query, chunk_ids, texts)
+        keys = [(query, chunk_id) for chunk_id in chunk_ids]
+        with self._lock:
+            cached = {key: self.scores[key] for key in keys if key in self.scores}
+            for key in cached:
+                self.scores.move_to_end(key)
+
+        missing = [index for index, key in enumerate(keys) if key not in cached]
+        if missing:
+            new_scores = self.reranker.score(query, [texts[index] for index in missing])
+            with self._lock:
+                for index, score in zip(missing, new_scores):
+                    cached[keys[index]] = score
+                    self.scores[keys[index]] = score
+                while len(self.scores) > self.max_entries:
+                    self.scores.popitem(last=False)
+        return [cached[key] for key in keys]
+
+    def _score_candidate_set(self, query: str, chunk_ids: list[str], texts: list[str]) -> list[float]:
+        key = (query, tuple(chunk_ids))
+        with self._lock:
+            scores = self.scores.get(key)
+            if scores is not None:
+                self.scores.move_to_end(key)
+                return list(scores)
+        scores = self.reranker.score(query, texts)
+        with self._lock:
+            self.scores[key] = tuple(scores)
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+        return scores
+
+def create_reranker(kind: str | None, cross_encoder_model: str, batch_size: int, lexical_index=None):
+    if kind is None:
+        return None
+    if kind == "cross-encoder":
+        try:
+            return CachedReranker(CrossEncoderReranker(cross_encoder_model, batch_size))
+        except ImportError:
+            logger.warning("sentence-transformers is not installed. Using the lexical reranker instead.")
+    return CachedReranker(LexicalReranker(lexical_index=lexical_index))
+
+def select_adaptive(scored: list[tuple], min_score: float, relative_cutoff: float, min_k: int, max_k: int) -> list[tuple]:
+    """Keeps the best (document, score) pairs whose score passes both the absolute and the relative cut-off.
+
+    When no candidate scores above zero the reranker has no signal, and the first
+    `max_k` candidates are kept in their first-stage order.
+    """
+    ranked = sorted(scored, key=lambda item: item[1], reverse=True)
+    if not ranked:
+        return []
+    if ranked[0][1] <= 0:
+        return scored[:max_k]
+    threshold = max(min_score, ranked[0][1] * relative_cutoff)
+    selected = [item for item in ranked[:max_k] if item[1] >= threshold]
+    return selected if len(selected) >= min_k else ranked[:min_k]
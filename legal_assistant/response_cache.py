@@ -0,0 +1,113 @@
+import re
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+PLACEHOLDER_PATTERN = re.compile(r"\[[A-Z0-9_]+\]")
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class ResponseCache:
+    """In-memory cache of generated (still anonymized) responses.
+
+    Entries are keyed by the anonymized query, the ids of the retrieved chunks
+    and a digest of the conversation history, so no sensitive data is stored.
+    Callers must deanonymize cached responses with the current replacements.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float | None = None, version_fn=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "invalidations": 0}
+        self._version = version_fn() if version_fn else None
+        self._lock = threading.Lock()
+
+    def _key(self, anonymized_query: str, chunk_ids: list[str], history_text: str) -> str:
+        normalized_query = " ".join(anonymized_query.lower().split())
+        return _digest("\0".join([normalized_query, ",".join(sorted(chunk_ids)), _digest(history_text or "")]))
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            logger.info("Vector database changed. Clearing the response cache.")
+            self.entries.clear()
+            self._version = version
+            self.stats["invalidations"] += 1
+
+    def _is_expired(self, entry: dict) -> bool:
+        return time.monotonic() - entry["created_at"] > self.ttl_seconds
+
+    def get(self, anonymized_query: str, chunk_ids: list[str], history_text: str, query_embedding: list[float] | None = None) -> str | None:
+        key = self._key(anonymized_query, chunk_ids, history_text)
+        with self._lock:
+            self._check_version()
+            entry = self.entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry["response"]
+
+            if self.similarity_threshold is not None and query_embedding is not None:
+                entry_key = self._find_similar(anonymized_query, chunk_ids, history_text, query_embedding)
+                if entry_key is not None:
+                    self.entries.move_to_end(entry_key)
+                    self.stats["similar_hits"] += 1
+                    return self.entries[entry_key]["response"]
+
+            self.stats["misses"] += 1
+            return None
+
+    def _find_similar(self, anonymized_query: str, chunk_ids: list[str], history_text: str, query_embedding: list[float]) -> str | None:
+        # A similar query may only reuse an answer built from the same chunks and
+        # the same placeholders, otherwise reidentification would be wrong.
+        chunk_key = ",".join(sorted(chunk_ids))
+        history_digest = _digest(history_text or "")
+        placeholders = set(PLACEHOLDER_PATTERN.findall(anonymized_query))
+
+        best_key, best_score = None, self.similarity_threshold
+        for key, entry in self.entries.items():
+            if entry["chunk_key"] != chunk_key or entry["history_digest"] != history_digest:
+                continue
+            if entry["placeholders"] != placeholders or entry["query_embedding"] is None or self._is_expired(entry):
+                continue
+            score = _cosine_similarity(query_embedding, entry["query_embedding"])
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def put(self, anonymized_query: str, chunk_ids: list[str], history_text: str, response: str, query_embedding: list[float] | None = None):
+        key = self._key(anonymized_query, chunk_ids, history_text)
+        with self._lock:
+            self._check_version()
+            self.entries[key] = {
+                "response": response,
+                "created_at": time.monotonic(),
+                "query_embedding": query_embedding,
+                "chunk_key": ",".join(sorted(chunk_ids)),
+                "history_digest": _digest(history_text or ""),
+                "placeholders": set(PLACEHOLDER_PATTERN.findall(anonymized_query)),
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,221 @@
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+DEFAULT_SESSION_ID = "default"
+
+# Identifies the session and the queue position callback of the request being
+# processed, so the model calls deep in the pipeline do not need extra parameters.
+current_session_id = contextvars.ContextVar("current_session_id", default=DEFAULT_SESSION_ID)
+current_wait_callback = contextvars.ContextVar("current_wait_callback", default=None)
+
+class SchedulerFullError(Exception):
+    """Exceção lançada quando a fila de requisições de um modelo está cheia."""
+    pass
+
+class _Ticket:
+    __slots__ = ("session_id", "granted", "enqueued_at", "future")
+
+    def __init__(self, session_id: str, future: asyncio.Future | None = None):
+        self.session_id = session_id
+        self.granted = False
+        self.enqueued_at = time.perf_counter()
+        # Set for the requests waiting in an event loop, which are woken through it instead of the condition
+        self.future = future
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class ModelScheduler:
+    """Limits the concurrent calls to one model and queues the remaining ones.
+
+    Waiting requests are granted round-robin across sessions, so a session with
+    many queued requests cannot starve the others. Threads wait on a condition
+    (`acquire`) and coroutines on a future of their event loop (`aacquire`), so
+    async requests never hold a thread while they are queued.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue_size: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.active = 0
+        self.queued = 0
+        self.waiting = OrderedDict()
+        self.avg_service_time = None
+        self.stats = {
+            "requests": 0, "rejected": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "service_seconds_total": 0.0, "service_seconds_max": 0.0,
+        }
+        self._condition = threading.Condition()
+
+    def _grant_next(self):
+        while self.active < self.max_concurrency and self.waiting:
+            session_id, tickets = next(iter(self.waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self.waiting.move_to_end(session_id)
+            else:
+                del self.waiting[session_id]
+            ticket.granted = True
+            self.active += 1
+            self.queued -= 1
+            if ticket.future is not None:
+                ticket.future.get_loop().call_soon_threadsafe(_resolve, ticket.future)
+        self._condition.notify_all()
+
+    def _position(self, ticket: _Ticket) -> int:
+        # Order in which the round-robin would grant the queued tickets
+        position = 0
+        queues = [list(tickets) for tickets in self.waiting.values()]
+        for round_index in range(max((len(q) for q in queues), default=0)):
+            for tickets in queues:
+                if round_index < len(tickets):
+                    if tickets[round_index] is ticket:
+                        return position
+                    position += 1
+        return position
+
+    def _eta(self, position: int) -> float | None:
+        if self.avg_service_time is None:
+            return None
+        return math.ceil((position + 1) / self.max_concurrency) * self.avg_service_time
+
+    def _enqueue(self, session_id: str, future: asyncio.Future | None = None) -> _Ticket | None:
+        """Takes a free slot (returning None) or queues a ticket. Must be called holding the condition."""
+        self.stats["requests"] += 1
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            return None
+        if self.queued >= self.max_queue_size:
+            self.stats["rejected"] += 1
+            raise SchedulerFullError(f"The {self.name} queue is full ({self.max_queue_size} requests).")
+        ticket = _Ticket(session_id, future)
+        self.waiting.setdefault(session_id, deque()).append(ticket)
+        self.queued += 1
+        return ticket
+
+    def _record_wait(self, ticket: _Ticket) -> float:
+        wait_time = time.perf_counter() - ticket.enqueued_at
+        with self._condition:
+            self.stats["wait_seconds_total"] += wait_time
+            self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], wait_time)
+        return wait_time
+
+    def acquire(self, session_id: str, on_wait=None) -> float:
+        with self._condition:
+            ticket = self._enqueue(session_id)
+        if ticket is None:
+            return 0.0
+
+        while True:
+            with self._condition:
+                if not ticket.granted:
+                    self._condition.wait(timeout=0.5)
+                if ticket.granted:
+                    break
+                position = self._position(ticket)
+                eta = self._eta(position)
+            if on_wait:
+                on_wait(self.name, position + 1, eta)
+        return self._record_wait(ticket)
+
+    async def aacquire(self, session_id: str, on_wait=None) -> float:
+        with self._condition:
+            ticket = self._enqueue(session_id, asyncio.get_running_loop().create_future())
+        if ticket is None:
+            return 0.0
+
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.future), timeout=0.5)
+                break
+            except TimeoutError:
+                with self._condition:
+                    if ticket.granted:
+                        continue
+                    position = self._position(ticket)
+                    eta = self._eta(position)
+                if on_wait:
+                    on_wait(self.name, position + 1, eta)
+            except asyncio.CancelledError:
+                self._abandon(ticket)
+                raise
+        return self._record_wait(ticket)
+
+    def _abandon(self, ticket: _Ticket):
+        """Removes a cancelled request from the queue, or gives its slot back if it was granted meanwhile."""
+        with self._condition:
+            if ticket.granted:
+                self.active -= 1
+                self._grant_next()
+                return
+            tickets = self.waiting.get(ticket.session_id)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self.waiting[ticket.session_id]
+                self.queued -= 1
+
+    def release(self, service_time: float):
+        with self._condition:
+            self.active -= 1
+            self.stats["service_seconds_total"] += service_time
+            self.stats["service_seconds_max"] = max(self.stats["service_seconds_max"], service_time)
+            if self.avg_service_time is None:
+                self.avg_service_time = service_time
+            else:
+                self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+            self._grant_next()
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {"active": self.active, "queued": self.queued, **self.stats}
+
+class RequestScheduler:
+    def __init__(self, limits: dict[str, int], max_queue_size: int):
+        self.models = {name: ModelScheduler(name, limit, max_queue_size) for name, limit in limits.items()}
+
+    @contextmanager
+    def session(self, session_id: str, on_wait=None):
+        session_token = current_session_id.set(session_id)
+        callback_token = current_wait_callback.set(on_wait)
+        try:
+            yield
+        finally:
+            current_session_id.reset(session_token)
+            current_wait_callback.reset(callback_token)
+
+    @contextmanager
+    def slot(self, model: str):
+        scheduler = self.models[model]
+        scheduler.acquire(current_session_id.get(), current_wait_callback.get())
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            scheduler.release(time.perf_counter() - started_at)
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        scheduler = self.models[model]
+        await scheduler.aacquire(current_session_id.get(), current_wait_callback.get())
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            scheduler.release(time.perf_counter() - started_at)
+
+    def snapshot(self) -> dict:
+        return {name: scheduler.snapshot() for name, scheduler in self.models.items()}
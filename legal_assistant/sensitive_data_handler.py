@@ -1,9 +1,19 @@
 import re
 import json
-from langchain_core.messages import SystemMessage, HumanMessage
+import time
+import textwrap
+from contextlib import nullcontext
 
-from legal_assistant.config import LLM_ANONYMIZATION_MODEL
+from legal_assistant.config import (
+    LLM_ANONYMIZATION_MODEL, LLM_ANONYMIZATION_SMALL_MODEL, LLM_RESPONSE_GENERATION_MODEL, ANONYMIZATION_MODE,
+    ANONYMIZATION_STRUCTURED_OUTPUT, GENERATION_KEEP_ALIVE, ANONYMIZATION_KEEP_ALIVE, ANONYMIZATION_ESCALATION_KEEP_ALIVE,
+    ANONYMIZATION_SMALL_MODEL_RETRIES, CHARS_PER_TOKEN
+)
 from legal_assistant.utils import initialize_model
+from legal_assistant.pii_rules import extract_with_rules, mask_values, has_name_candidates, has_personal_context
+from legal_assistant.aho_corasick import AhoCorasick, fold
+from legal_assistant.metrics import REGISTRY, current_span, span, OllamaStatsCallback, record_ollama_stats, record_prefix_reuse
+from legal_assistant.prompt_builder import estimate_tokens
 
 import logging
 from legal_assistant.logging_formatter import LOGGER_NAME
@@ -14,13 +24,28 @@ class JsonExtractionError(Exception):
     """Exceção customizada para falhas na extração de JSON."""
     pass
 
-class SensitiveDataHandler:
-    def __init__(self):
-        self.model = initialize_model(model_name=LLM_ANONYMIZATION_MODEL, model_temperature=0.1, model_ctx=4096)
-        logger.info("Anonymization model initialized.")
+# JSON schema passed to Ollama, which constrains the decoding so the output always follows it
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dados": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "categoria": {"type": "string"},
+                    "valor": {"type": "string"},
+                },
+                "required": ["categoria", "valor"],
+            },
+        },
+    },
+    "required": ["dados"],
+}
 
-    def _get_prompt(self) -> str:
-        return """
+# Static instructions and examples, sent as the system prompt. They are byte-identical on
+# every request, so Ollama reuses their KV cache and only evaluates the user's text.
+ANONYMIZATION_SYSTEM_PROMPT = textwrap.dedent("""
             [INST]
             # Instruções
             Seu objetivo é analisar o texto fornecido pelo usuário e identificar qualquer informação sensível que ele possa ter compartilhado.
@@ -93,76 +118,463 @@ class SensitiveDataHandler:
                         {"categoria": "nome_parente", "valor": "Mariana Pereira"},
                         {"categoria": "rg", "valor": "12.345.678-9"},
                         {"categoria": "cidade", "valor": "Belo Horizonte"},
-                        {"categoria": "nis", "valor": "98765432100"
+                        {"categoria": "nis", "valor": "98765432100"}
                     ]
                     }"
-        """
+        """).strip()
+
+EXTRACTION_PATHS = REGISTRY.counter(
+    "legal_assistant_extraction_path_total",
+    "Outcome of the model extractions: parsed on the first attempt, salvaged, parsed after retries or failed."
+)
+CASCADE_OUTCOMES = REGISTRY.counter(
+    "legal_assistant_anonymization_tier_total",
+    "Extractions of each tier of the anonymization cascade, by outcome: accepted or the reason it was escalated."
+)
+CASCADE_SECONDS = REGISTRY.histogram(
+    "legal_assistant_anonymization_tier_seconds", "Duration of the extractions of each tier of the anonymization cascade."
+)
+
+# Categories the extraction may report: those of the examples, of the rules and a few obvious variations.
+# An unknown one means the small model misread the task
+KNOWN_CATEGORIES = frozenset("""
+    nome nome_parente nome_filho nome_filha nome_conjuge nome_mae nome_pai data data_nascimento data_obito
+    data_casamento hospital cidade estado bairro localizacao endereco cep cpf cnpj rg cnh nis pis telefone
+    email idade profissao conta_bancaria agencia banco processo matricula passaporte titulo_eleitor
+""".split())
+
+# Numbers of five or more digits (documents, phones, accounts) left in the text after the extraction,
+# unless they follow a reference to a law or article ("Lei nº 6.015/73", "Art. 1.604")
+RESIDUAL_NUMBER_PATTERN = re.compile(r"\d(?:[\d./-]?\d){4,}")
+LEGAL_REFERENCE_PATTERN = re.compile(
+    r"\b(?:lei|leis|decreto|decreto-lei|provimento|resolu[çc][ãa]o|emenda|medida provis[óo]ria|art|arts|artigo|artigos|s[úu]mula)"
+    r"\.?\s*(?:complementar\s*)?(?:n[º°o.]*\s*)?$",
+    re.IGNORECASE
+)
+
+DATA_ARRAY_PATTERN = re.compile(r'"dados"\s*:\s*\[')
+
+PLACEHOLDER_PATTERN = re.compile(r"\[[A-Z0-9_]+\]")
+INDEXED_PLACEHOLDER_PATTERN = re.compile(r"\[([A-Z0-9_]+)_\d+\]")
+# Label the model sometimes includes in a document number ("CPF 111.444.777-35", "RG: 12.345.678-9")
+DOCUMENT_PREFIX_PATTERN = re.compile(r"\b(?:CPF|RG|CNH)\b[\s:nº°.-]*(?=\d)", re.IGNORECASE)
+
+_decoder = json.JSONDecoder(strict=False)
+
+def _valid_items(items) -> list[dict]:
+    valid = []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and isinstance(item.get("categoria"), str) and item.get("valor") not in (None, ""):
+            value = "".join(char for char in str(item["valor"]) if char.isprintable())
+            valid.append({"categoria": item["categoria"], "valor": value})
+    return valid
+
+def placeholder_category(categoria: str) -> str:
+    return re.sub(r"[^A-Z0-9]+", "_", fold(str(categoria)).upper()).strip("_") or "DADO"
+
+def _with_aliases(replacements: dict) -> dict:
+    # The model sometimes drops the index ("[NOME]" for "[NOME_1]"), which is unambiguous when the category has a single value
+    by_category = {}
+    for placeholder in replacements:
+        match = INDEXED_PLACEHOLDER_PATTERN.fullmatch(placeholder)
+        if match:
+            by_category.setdefault(f"[{match.group(1)}]", []).append(placeholder)
+    lookup = dict(replacements)
+    for alias, placeholders in by_category.items():
+        if len(placeholders) == 1 and alias not in lookup:
+            lookup[alias] = replacements[placeholders[0]]
+    return lookup
+
+def _mask_found_values(text: str, values) -> str:
+    """Blanks out the occurrences of the values, ignoring case and accents, keeping the rest of the text as is."""
+    folded = fold(text)
+    characters = list(text)
+    for value in values:
+        folded_value = fold(str(value).strip())
+        if not folded_value:
+            continue
+        start = folded.find(folded_value)
+        while start != -1:
+            characters[start:start + len(folded_value)] = " " * len(folded_value)
+            start = folded.find(folded_value, start + 1)
+    return "".join(characters)
+
+def has_residual_numbers(text: str) -> bool:
+    for match in RESIDUAL_NUMBER_PATTERN.finditer(text):
+        if not LEGAL_REFERENCE_PATTERN.search(text[max(0, match.start() - 40):match.start()]):
+            return True
+    return False
+
+def validate_extraction(text: str, rule_data: dict, model_data: dict) -> str | None:
+    """Checks an extraction against the text. Returns None if it is plausible, or the reason it is not.
+
+    Every value must be in the text, every category must be known, and once the values
+    found (by the rules and the model) are removed, no capitalized word that may be a
+    name and no long number may remain.
+    """
+    folded_text = fold(text)
+    for item in model_data.get("dados", []):
+        if fold(str(item["valor"]).strip()) not in folded_text:
+            return "value_not_in_text"
+        if fold(str(item["categoria"])).strip().replace(" ", "_") not in KNOWN_CATEGORIES:
+            return "unknown_category"
+
+    residual = _mask_found_values(text, [item["valor"] for item in rule_data.get("dados", []) + model_data.get("dados", [])])
+    if has_name_candidates(residual):
+        return "residual_name"
+    if has_residual_numbers(residual):
+        return "residual_number"
+    return None
+
+def parse_extraction_output(text: str) -> tuple[dict | None, bool]:
+    """Parses the model output, salvaging the complete items of a truncated or malformed array.
 
-    def _extract_json_string(self, text: str) -> str | None:
-        if not isinstance(text, str):
-            return None
+    Returns the data and whether the whole output was valid JSON, or (None, False)
+    when nothing could be recovered.
+    """
+    if not isinstance(text, str):
+        return None, False
+    start = text.find("{")
+    if start != -1:
         try:
-            start_index = text.index('{')
-            end_index = text.rindex('}') + 1
-            json_str = text[start_index:end_index]
-            cleaned_str = "".join(char for char in json_str if char.isprintable() or char in ('\n', '\t', '\r'))
-            return cleaned_str
-        except ValueError:
-            logger.warning("It was not possible to find a valid JSON in the model's response.")
-            return None
+            data, _ = _decoder.raw_decode(text, start)
+            if isinstance(data, dict) and isinstance(data.get("dados"), list):
+                return {"dados": _valid_items(data["dados"])}, True
+        except json.JSONDecodeError:
+            pass
+
+    match = DATA_ARRAY_PATTERN.search(text)
+    if not match:
+        return None, False
+    items = []
+    position = match.end()
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            break
+        try:
+            item, position = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            # An object missing its closing brace, e.g. cut off right after the last value
+            end = text.find("]", position)
+            fragment = text[position:end if end != -1 else len(text)].rstrip().rstrip(",")
+            try:
+                item, _ = _decoder.raw_decode(fragment + "}")
+            except json.JSONDecodeError:
+                break
+            items.append(item)
+            break
+        items.append(item)
+    return {"dados": _valid_items(items)}, False
+
+class SensitiveDataHandler:
+    """Finds and replaces the sensitive data of the questions.
+
+    The model extraction is a cascade: a small model (by default the generation model,
+    which is loaded anyway) answers first, and its extraction is checked against the
+    text by validate_extraction. Only when the check fails is the large model
+    (LLM_ANONYMIZATION_MODEL) called, with a short keep-alive, so for most questions it
+    is never loaded. Without a small model, the large one handles every extraction.
+    """
+
+    def __init__(self, scheduler=None):
+        self.small_model = None
+        if LLM_ANONYMIZATION_SMALL_MODEL and LLM_ANONYMIZATION_SMALL_MODEL != LLM_ANONYMIZATION_MODEL:
+            self.small_model = initialize_model(
+                model_name=LLM_ANONYMIZATION_SMALL_MODEL, model_temperature=0.1, model_ctx=4096,
+                model_keep_alive=GENERATION_KEEP_ALIVE if LLM_ANONYMIZATION_SMALL_MODEL == LLM_RESPONSE_GENERATION_MODEL else ANONYMIZATION_KEEP_ALIVE
+            )
+        self.model = initialize_model(
+            model_name=LLM_ANONYMIZATION_MODEL, model_temperature=0.1, model_ctx=4096,
+            model_keep_alive=ANONYMIZATION_ESCALATION_KEEP_ALIVE if self.small_model else ANONYMIZATION_KEEP_ALIVE
+        )
+        self.prefix_tokens = estimate_tokens(ANONYMIZATION_SYSTEM_PROMPT, CHARS_PER_TOKEN)
+        self.scheduler = scheduler
+        logger.info("Anonymization model initialized.")
+
+    def _tier_model(self, tier: str):
+        return self.small_model if tier == "small" else self.model
+
+    def _tier_model_name(self, tier: str) -> str:
+        return LLM_ANONYMIZATION_SMALL_MODEL if tier == "small" else LLM_ANONYMIZATION_MODEL
+
+    def _slot_name(self, tier: str) -> str:
+        # Calls to the generation model share its slots, so it never serves more than GENERATION_MAX_CONCURRENCY at once
+        return "generation" if self._tier_model_name(tier) == LLM_RESPONSE_GENERATION_MODEL else "anonymization"
+
+    def _model_slot(self, tier: str):
+        return self.scheduler.slot(self._slot_name(tier)) if self.scheduler else nullcontext()
+
+    def _amodel_slot(self, tier: str):
+        return self.scheduler.aslot(self._slot_name(tier)) if self.scheduler else nullcontext()
+
+    def plan_extraction(self, text: str) -> tuple[dict, bool]:
+        """Returns the data found by the rules and whether the model must still be called."""
+        if ANONYMIZATION_MODE == "llm":
+            return {"dados": []}, True
+
+        with span("anonymization_rules") as rules_span:
+            rule_data = extract_with_rules(text)
+            rules_span.attributes["items"] = len(rule_data["dados"])
+        logger.info("Sensitive data found by rules: %s", rule_data)
+        if ANONYMIZATION_MODE == "rules":
+            return rule_data, False
+        residual = mask_values(text, rule_data)
+        if not (has_name_candidates(residual) or has_residual_numbers(residual) or has_personal_context(residual)):
+            logger.info("No name candidates, long numbers or addresses left after the rules. Skipping the anonymization model.")
+            return rule_data, False
+        return rule_data, True
 
     def extract(self, text: str) -> dict:
-        messages = [
-            SystemMessage(content=self._get_prompt()),
-            HumanMessage(content=text),
-        ]
-        
-        max_retries = 3
+        rule_data, needs_model = self.plan_extraction(text)
+        if not needs_model:
+            return rule_data
+        return self._merge_sensitive_data(rule_data, self.extract_with_cascade(text, rule_data))
+
+    async def aextract(self, text: str, plan: tuple[dict, bool] | None = None) -> dict:
+        rule_data, needs_model = plan or self.plan_extraction(text)
+        if not needs_model:
+            return rule_data
+        return self._merge_sensitive_data(rule_data, await self.aextract_with_cascade(text, rule_data))
+
+    def _merge_sensitive_data(self, rule_data: dict, model_data: dict) -> dict:
+        merged = list(rule_data.get("dados", []))
+        known_values = {str(item["valor"]).strip().lower() for item in merged}
+        for item in model_data.get("dados", []):
+            value = str(item.get("valor", "")).strip().lower()
+            if value and value not in known_values:
+                merged.append(item)
+                known_values.add(value)
+        return {"dados": merged}
+
+    def warm_up(self):
+        """Loads the first model of the cascade and evaluates the system prompt, which stays in Ollama's KV cache.
+
+        The large model is only warmed up when it is the only one: in the cascade it is
+        loaded on the first escalation.
+        """
+        if ANONYMIZATION_MODE == "rules":
+            return
+        stats = OllamaStatsCallback()
+        started_at = time.perf_counter()
+        (self.small_model or self.model).model_copy(update={"num_predict": 1}).invoke(
+            ".", system=ANONYMIZATION_SYSTEM_PROMPT, config={"callbacks": [stats]}
+        )
+        logger.info(
+            f"Anonymization model warmed up in {time.perf_counter() - started_at:.1f}s "
+            f"({stats.generation_info.get('prompt_eval_count', 0)} prompt tokens evaluated)."
+        )
+
+    def _invoke_kwargs(self) -> dict:
+        kwargs = {"system": ANONYMIZATION_SYSTEM_PROMPT}
+        if ANONYMIZATION_STRUCTURED_OUTPUT:
+            kwargs["format"] = EXTRACTION_SCHEMA
+        return kwargs
+
+    def _record_model_stats(self, attempt_span, model_name: str, text: str, generation_info: dict):
+        record_ollama_stats(attempt_span, model_name, generation_info)
+        record_prefix_reuse(attempt_span, model_name, generation_info, self.prefix_tokens, estimate_tokens(text, CHARS_PER_TOKEN))
+
+    def _parse_response(self, response_text: str, attempt: int, attempt_span, model_name: str) -> dict:
+        parsed_json, complete = parse_extraction_output(response_text)
+        if parsed_json is None:
+            attempt_span.attributes["path"] = "invalid"
+            raise ValueError("JSON string not found in the response.")
+
+        if not complete:
+            path = "salvaged"
+            logger.warning(f"Malformed JSON in the model's response. {len(parsed_json['dados'])} items salvaged.")
+        else:
+            path = "first_attempt" if attempt == 0 else "retried"
+        attempt_span.attributes["path"] = path
+        EXTRACTION_PATHS.inc(path=path, model=model_name)
+        logger.info("JSON successfully extracted: %s", parsed_json)
+        return parsed_json
+
+    def _log_failed_attempt(self, attempt: int, max_retries: int, error: Exception):
+        logger.warning(f"Attempt failed {attempt + 1}: {error}.")
+        if attempt < max_retries - 1:
+            logger.info("Trying again...")
+        else:
+            logger.error("All attempts to extract a valid JSON have failed.")
+
+    def extract_with_model(self, text: str, tier: str = "large", max_retries: int = 3) -> dict:
+        model, model_name = self._tier_model(tier), self._tier_model_name(tier)
         for attempt in range(max_retries):
             try:
-                logger.info(f"Attempt to extract sensitive data [Attempt {attempt + 1}/{max_retries}]")
-                response_text = self.model.invoke(messages)
-                json_string = self._extract_json_string(response_text)
-                
-                if json_string:
-                    parsed_json = json.loads(json_string)
-                    logger.info(f"JSON successfully extracted: {parsed_json}")
-                    return parsed_json
-                else:
-                    raise ValueError("JSON string not found in the response.")
-
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Attempt failed {attempt + 1}: {e}.")
-                if attempt < max_retries - 1:
-                    logger.info("Trying again...")
-                else:
-                    logger.error("All attempts to extract a valid JSON have failed.")
-        
+                logger.info(f"Attempt to extract sensitive data with {model_name} [Attempt {attempt + 1}/{max_retries}]")
+                stats = OllamaStatsCallback()
+                with span("anonymization_attempt", attempt=attempt + 1, model=model_name) as attempt_span:
+                    with self._model_slot(tier):
+                        response_text = model.invoke(text, config={"callbacks": [stats]}, **self._invoke_kwargs())
+                    self._record_model_stats(attempt_span, model_name, text, stats.generation_info)
+                    return self._parse_response(response_text, attempt, attempt_span, model_name)
+            except ValueError as e:
+                self._log_failed_attempt(attempt, max_retries, e)
+
+        EXTRACTION_PATHS.inc(path="failed", model=model_name)
         raise JsonExtractionError("Unable to extract a valid JSON after multiple attempts.")
 
-    def anonymize(self, text: str) -> str:
-        sensitive_data = self.extract(text)
+    async def aextract_with_model(self, text: str, tier: str = "large", max_retries: int = 3) -> dict:
+        model, model_name = self._tier_model(tier), self._tier_model_name(tier)
+        for attempt in range(max_retries):
+            try:
+                logger.info(f"Attempt to extract sensitive data with {model_name} [Attempt {attempt + 1}/{max_retries}]")
+                stats = OllamaStatsCallback()
+                with span("anonymization_attempt", attempt=attempt + 1, model=model_name) as attempt_span:
+                    async with self._amodel_slot(tier):
+                        response_text = await model.ainvoke(text, config={"callbacks": [stats]}, **self._invoke_kwargs())
+                    self._record_model_stats(attempt_span, model_name, text, stats.generation_info)
+                    return self._parse_response(response_text, attempt, attempt_span, model_name)
+            except ValueError as e:
+                self._log_failed_attempt(attempt, max_retries, e)
+
+        EXTRACTION_PATHS.inc(path="failed", model=model_name)
+        raise JsonExtractionError("Unable to extract a valid JSON after multiple attempts.")
+
+    def _finish_tier(self, tier: str, started_at: float, outcome: str):
+        CASCADE_OUTCOMES.inc(tier=tier, outcome=outcome)
+        CASCADE_SECONDS.observe(time.perf_counter() - started_at, tier=tier)
+        tier_span = current_span.get()
+        if tier_span is not None:
+            tier_span.attributes["outcome"] = outcome
+        if tier == "small" and outcome != "accepted":
+            logger.info(f"Extraction of the {tier} anonymization model rejected ({outcome}). Escalating to {LLM_ANONYMIZATION_MODEL}.")
+
+    def _small_extraction_outcome(self, text: str, rule_data: dict, model_data: dict | None) -> str:
+        if model_data is None:
+            return "invalid_json"
+        return validate_extraction(text, rule_data, model_data) or "accepted"
+
+    def extract_with_cascade(self, text: str, rule_data: dict) -> dict:
+        if self.small_model is not None:
+            with span("anonymization_tier", tier="small"):
+                started_at = time.perf_counter()
+                try:
+                    model_data = self.extract_with_model(text, "small", ANONYMIZATION_SMALL_MODEL_RETRIES)
+                except JsonExtractionError:
+                    model_data = None
+                outcome = self._small_extraction_outcome(text, rule_data, model_data)
+                self._finish_tier("small", started_at, outcome)
+            if outcome == "accepted":
+                return model_data
+
+        with span("anonymization_tier", tier="large"):
+            started_at = time.perf_counter()
+            try:
+                model_data = self.extract_with_model(text, "large")
+            except JsonExtractionError:
+                self._finish_tier("large", started_at, "failed")
+                raise
+            self._finish_tier("large", started_at, "accepted")
+        return model_data
+
+    async def aextract_with_cascade(self, text: str, rule_data: dict) -> dict:
+        if self.small_model is not None:
+            with span("anonymization_tier", tier="small"):
+                started_at = time.perf_counter()
+                try:
+                    model_data = await self.aextract_with_model(text, "small", ANONYMIZATION_SMALL_MODEL_RETRIES)
+                except JsonExtractionError:
+                    model_data = None
+                outcome = self._small_extraction_outcome(text, rule_data, model_data)
+                self._finish_tier("small", started_at, outcome)
+            if outcome == "accepted":
+                return model_data
+
+        with span("anonymization_tier", tier="large"):
+            started_at = time.perf_counter()
+            try:
+                model_data = await self.aextract_with_model(text, "large")
+            except JsonExtractionError:
+                self._finish_tier("large", started_at, "failed")
+                raise
+            self._finish_tier("large", started_at, "accepted")
+        return model_data
+
+    def anonymize(self, text: str) -> tuple[str, dict]:
+        with span("anonymization"):
+            return self.replace_sensitive_data(text, self.extract(text))
+
+    async def aanonymize(self, text: str, plan: tuple[dict, bool] | None = None) -> tuple[str, dict]:
+        with span("anonymization"):
+            return self.replace_sensitive_data(text, await self.aextract(text, plan))
+
+    def replace_sensitive_data(self, text: str, sensitive_data: dict) -> tuple[str, dict]:
+        """Replaces every occurrence of the sensitive values in a single pass.
+
+        Matching is case and accent insensitive, prefers the longest value
+        ("Pedro de Almeida" over "Pedro") and respects word boundaries. Each
+        distinct value gets an indexed placeholder ([NOME_1], [NOME_2]), numbered
+        in the order it first appears in the text. A document label matched along
+        with its number stays in the text, so the placeholder maps back to the
+        number alone.
+        """
+        patterns = {}
+        for item in sensitive_data.get("dados", []):
+            raw_value = str(item.get("valor", "")).strip()
+            if not raw_value:
+                continue
+            entity = (placeholder_category(item.get("categoria", "")), fold(raw_value))
+            for variant in (raw_value, DOCUMENT_PREFIX_PATTERN.sub("", raw_value)):
+                patterns.setdefault(variant, entity)
+        if not patterns:
+            return text, {}
+
         replacements = {}
-        try:
-            for item in sensitive_data.get("dados", []):
-                raw_value = str(item.get("valor", "")).strip()
-                if not raw_value:
-                    continue
-
-                placeholder = f"[{item['categoria'].upper()}]"
-                replacements[placeholder] = raw_value
-                
-                raw_value_clean = re.sub(r"\b(?:CPF|RG|CNH)\s+", "", raw_value, flags=re.IGNORECASE)
-                text = re.sub(re.escape(raw_value), placeholder, text, flags=re.IGNORECASE)
-                if raw_value_clean != raw_value:
-                    text = re.sub(re.escape(raw_value_clean), placeholder, text, flags=re.IGNORECASE)
-
-            return text, replacements
-        except Exception as e:
-            logger.error(f"Failed to anonymize text: {e}")
-            return text, replacements
+        placeholders = {}
+        counters = {}
+        pieces = []
+        position = 0
+        for start, end, entity in AhoCorasick(patterns).find_longest(text):
+            label = DOCUMENT_PREFIX_PATTERN.match(text, start, end)
+            if label:
+                start = label.end()
+            placeholder = placeholders.get(entity)
+            if placeholder is None:
+                category = entity[0]
+                counters[category] = counters.get(category, 0) + 1
+                placeholder = f"[{category}_{counters[category]}]"
+                placeholders[entity] = placeholder
+                replacements[placeholder] = text[start:end]
+            pieces.append(text[position:start])
+            pieces.append(placeholder)
+            position = end
+        pieces.append(text[position:])
+        return "".join(pieces), replacements
 
     def deanonymize(self, text: str, replacements: dict) -> str:
-        for placeholder, original in replacements.items():
-            text = text.replace(placeholder, original)
-        return text
+        if not replacements:
+            return text
+        lookup = _with_aliases(replacements)
+        return PLACEHOLDER_PATTERN.sub(lambda match: lookup.get(match.group(0), match.group(0)), text)
+
+class StreamingDeanonymizer:
+    """Reidentifies placeholders in a response that arrives token by token.
+
+    Text that may be the beginning of a placeholder is held back until the
+    placeholder is complete, since a single placeholder is often split
+    across several tokens.
+    """
+
+    def __init__(self, handler: SensitiveDataHandler, replacements: dict):
+        self.handler = handler
+        self.replacements = replacements
+        self.buffer = ""
+
+    def _is_placeholder_prefix(self, text: str) -> bool:
+        return any(placeholder.startswith(text) for placeholder in self.replacements)
+
+    def feed(self, token: str) -> str:
+        self.buffer += token
+        start = self.buffer.rfind("[")
+        if start != -1 and self._is_placeholder_prefix(self.buffer[start:]) and self.buffer[start:] not in self.replacements:
+            ready, self.buffer = self.buffer[:start], self.buffer[start:]
+        else:
+            ready, self.buffer = self.buffer, ""
+        return self.handler.deanonymize(ready, self.replacements)
+
+    def flush(self) -> str:
+        ready, self.buffer = self.buffer, ""
+        return self.handler.deanonymize(ready, self.replacements)
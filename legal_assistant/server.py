@@ -0,0 +1,260 @@
+"""HTTP/JSON interface of the assistant, started by `legal-assistant serve`.
+
+Endpoints:
+    POST /query         {"query": str, "history": [...], "session_id": str} -> result of process_query
+    POST /query/stream  same body; newline-delimited JSON: {"text": ...} pieces, then {"result": {...}}
+    GET  /health        200 while the worker accepts requests, 503 while it shuts down
+    GET  /metrics       Prometheus metrics of the worker, labeled with its pid
+
+History items are {"role": "user" | "assistant", "content": str}, and the
+assistant ones may carry the "source_ids" of their answer.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import asyncio
+import threading
+import contextvars
+
+import tornado.web
+import tornado.iostream
+import tornado.netutil
+import tornado.httpserver
+
+from legal_assistant.assistant import LegalAssistant
+from legal_assistant.utils import parse_history
+from legal_assistant.metrics import REGISTRY
+from legal_assistant.config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_BODY_BYTES, SERVER_SHUTDOWN_TIMEOUT_SECONDS, WARM_UP_ON_STARTUP,
+    SERVER_RESTART_BACKOFF_SECONDS, SERVER_MAX_RESTARTS, SERVER_RESTART_WINDOW_SECONDS
+)
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Errors of the assistant reported with a status other than 200
+ERROR_STATUS = {"server_busy": 503, "json_extraction_failed": 422, "processing_failed": 500}
+
+class RequestError(ValueError):
+    pass
+
+class ServerState:
+    """What the handlers of one worker share: the assistant and the count of requests in progress."""
+
+    def __init__(self, assistant: LegalAssistant):
+        self.assistant = assistant
+        self.in_flight = 0
+        self.draining = False
+        self.started_at = time.time()
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, state: ServerState):
+        self.state = state
+
+    def write_json(self, data: dict, status: int = 200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(data, ensure_ascii=False, default=str))
+
+class QueryHandler(BaseHandler):
+    def prepare(self):
+        if self.state.draining:
+            self.write_json({"error": "shutting_down"}, 503)
+            return
+        try:
+            body = json.loads(self.request.body or b"{}")
+            if not isinstance(body, dict) or not isinstance(body.get("query"), str) or not body["query"].strip():
+                raise RequestError("'query' must be a non-empty string.")
+            self.query_text = body["query"].strip()
+            self.history = parse_history(body.get("history", []))
+            self.session_id = str(body.get("session_id") or uuid.uuid4().hex)
+        except (ValueError, RequestError) as e:
+            self.write_json({"error": "bad_request", "detail": str(e)}, 400)
+
+    async def post(self):
+        self.state.in_flight += 1
+        try:
+            await self.respond()
+        finally:
+            self.state.in_flight -= 1
+
+    async def respond(self):
+        assistant = self.state.assistant
+        with assistant.scheduler.session(self.session_id):
+            result = await assistant.aprocess_query(self.query_text, self.history)
+        self.write_json(result, ERROR_STATUS.get(result.get("error"), 200))
+
+class StreamQueryHandler(QueryHandler):
+    async def respond(self):
+        assistant = self.state.assistant
+        self.set_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        with assistant.scheduler.session(self.session_id):
+            stream = assistant.stream_query(self.query_text, self.history)
+            pieces = asyncio.Queue()
+            stop = threading.Event()
+            loop = asyncio.get_running_loop()
+
+            def produce():
+                # The stream calls the blocking Ollama client and holds its model slot until it ends,
+                # so it runs on a thread of its own rather than on the shared executor, where the
+                # requests waiting for the slot could take every thread
+                iterator = iter(stream)
+                try:
+                    for text in iterator:
+                        loop.call_soon_threadsafe(pieces.put_nowait, text)
+                        if stop.is_set():
+                            break
+                finally:
+                    iterator.close()
+                    loop.call_soon_threadsafe(pieces.put_nowait, None)
+
+            producer = threading.Thread(
+                target=contextvars.copy_context().run, args=(produce,), name="stream-query", daemon=True
+            )
+            producer.start()
+            while (text := await pieces.get()) is not None:
+                self.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+                try:
+                    await self.flush()
+                except tornado.iostream.StreamClosedError:
+                    logger.info("Client disconnected during the streaming of a response.")
+                    # The generator is closed by its own thread, which frees the model slot
+                    stop.set()
+                    return
+        self.finish(json.dumps({"result": stream.result}, ensure_ascii=False, default=str) + "\n")
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        assistant = self.state.assistant
+        self.write_json({
+            "status": "draining" if self.state.draining else "ok",
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.state.started_at, 1),
+            "in_flight": self.state.in_flight,
+            "scheduler": assistant.scheduler.snapshot(),
+        }, 503 if self.state.draining else 200)
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        # The workers share the listening socket, so each scrape reaches any one of them: the pid label keeps
+        # their series apart, otherwise the counters of different workers would be read as resets
+        self.finish(REGISTRY.render((("pid", os.getpid()),)))
+
+def make_app(state: ServerState) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/query", QueryHandler, {"state": state}),
+        (r"/query/stream", StreamQueryHandler, {"state": state}),
+        (r"/health", HealthHandler, {"state": state}),
+        (r"/metrics", MetricsHandler, {"state": state}),
+    ])
+
+async def serve_worker(sockets):
+    """Runs one worker on already bound sockets until SIGTERM or SIGINT."""
+    # The assistant is created after the fork, so no worker inherits threads or connections of another
+    assistant = LegalAssistant()
+    if WARM_UP_ON_STARTUP:
+        assistant.start_warm_up()
+    state = ServerState(assistant)
+    server = tornado.httpserver.HTTPServer(make_app(state), max_body_size=SERVER_MAX_BODY_BYTES, xheaders=True)
+    server.add_sockets(sockets)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stop.set)
+    logger.info(f"Worker {os.getpid()} serving on {', '.join(str(sock.getsockname()) for sock in sockets)}")
+    await stop.wait()
+
+    # New connections are refused and /health reports the shutdown, while the requests in progress finish
+    logger.info(f"Worker {os.getpid()} shutting down ({state.in_flight} requests in progress).")
+    state.draining = True
+    server.stop()
+    deadline = time.monotonic() + SERVER_SHUTDOWN_TIMEOUT_SECONDS
+    while state.in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    await server.close_all_connections()
+
+def fork_workers(count: int) -> bool:
+    """Forks `count` workers. Returns True in the workers and, in the parent, False once all of them exited.
+
+    The parent forwards SIGTERM and SIGINT to the workers and replaces the ones that crash, waiting
+    longer after each restart. Too many restarts in a short time stop all workers and exit with an error.
+    """
+    workers = {}
+    restarts = []
+    stopping = False
+    failed = False
+
+    def start_worker() -> bool:
+        pid = os.fork()
+        if pid == 0:
+            return True
+        workers[pid] = True
+        return False
+
+    def forward(signal_number, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(count):
+        if start_worker():
+            return True
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.pop(pid, None)
+        if stopping or os.waitstatus_to_exitcode(status) == 0:
+            continue
+
+        now = time.monotonic()
+        restarts = [restarted_at for restarted_at in restarts if now - restarted_at < SERVER_RESTART_WINDOW_SECONDS]
+        if len(restarts) >= SERVER_MAX_RESTARTS:
+            logger.error(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)} after {len(restarts)} "
+                         f"restarts in {SERVER_RESTART_WINDOW_SECONDS}s. Stopping the server.")
+            failed = True
+            forward(signal.SIGTERM, None)
+            continue
+        delay = min(SERVER_RESTART_BACKOFF_SECONDS * 2 ** len(restarts), SERVER_RESTART_WINDOW_SECONDS)
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}. Starting another one in {delay}s.")
+        # The wait is cut short by a shutdown signal
+        deadline = now + delay
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not stopping:
+            restarts.append(time.monotonic())
+            if start_worker():
+                # The replacement must not keep the parent's handlers
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                return True
+    if failed:
+        sys.exit(1)
+    return False
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS):
+    # The sockets are bound before forking, so the kernel spreads the connections among the workers
+    sockets = tornado.netutil.bind_sockets(port, address=host)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and not fork_workers(workers):
+        logger.info("All workers exited.")
+        return
+    asyncio.run(serve_worker(sockets))
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import zlib
+import base64
+import shutil
+import threading
+from collections import OrderedDict
+
+from legal_assistant.config import (
+    SESSION_MAX_SESSIONS, SESSION_MAX_TURNS_IN_MEMORY, SESSION_IDLE_SECONDS, SESSION_SPILL_PATH
+)
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Result fields shown in the processing details; the rest of the result is not kept
+DETAIL_FIELDS = ("anonymized_query", "replacements", "raw_response", "source_ids", "cached", "timings", "trace")
+
+# Idle sessions are looked for at most this often
+EVICTION_INTERVAL_SECONDS = 60
+
+class Turn:
+    """One message of a conversation. The processing details are kept as compressed JSON and
+    only decoded when they are shown."""
+
+    __slots__ = ("role", "content", "source_ids", "packed_details")
+
+    def __init__(self, role: str, content: str, source_ids: tuple = (), packed_details: bytes | None = None):
+        self.role = role
+        self.content = content
+        self.source_ids = source_ids
+        self.packed_details = packed_details
+
+    @classmethod
+    def from_result(cls, content: str, result: dict) -> "Turn":
+        details = {key: result[key] for key in DETAIL_FIELDS if key in result}
+        packed = zlib.compress(json.dumps(details, ensure_ascii=False, default=str).encode("utf-8"))
+        return cls("assistant", content, tuple(result.get("source_ids") or ()), packed)
+
+    @property
+    def details(self) -> dict | None:
+        return json.loads(zlib.decompress(self.packed_details)) if self.packed_details else None
+
+    def to_message(self):
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        if self.role == "user":
+            return HumanMessage(content=self.content)
+        return AIMessage(content=self.content, metadata={"processing_details": {"source_ids": list(self.source_ids)}})
+
+    def dump(self) -> bytes:
+        packed = base64.b64encode(self.packed_details).decode("ascii") if self.packed_details else None
+        return json.dumps([self.role, self.content, list(self.source_ids), packed], ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def load(cls, data: bytes) -> "Turn":
+        role, content, source_ids, packed = json.loads(data)
+        return cls(role, content, tuple(source_ids), base64.b64decode(packed) if packed else None)
+
+    def size(self) -> int:
+        return (sys.getsizeof(self) + sys.getsizeof(self.role) + sys.getsizeof(self.content) + sys.getsizeof(self.source_ids)
+                + sum(sys.getsizeof(source_id) for source_id in self.source_ids) + sys.getsizeof(self.packed_details))
+
+class Session:
+    __slots__ = ("turns", "spilled", "last_seen")
+
+    def __init__(self):
+        self.turns = []
+        self.spilled = 0
+        self.last_seen = time.monotonic()
+
+def _create_cipher():
+    """Cipher of the spilled turns, with a key that only exists in this process."""
+    from cryptography.fernet import Fernet
+
+    return Fernet(Fernet.generate_key())
+
+class SessionStore:
+    """Conversations of the web sessions, shared by the Streamlit sessions of the process.
+
+    Each session keeps its last `max_turns_in_memory` messages in memory, with the
+    processing details compressed. Older messages contain personal data, so they are
+    written to `spill_path` encrypted with a key held only in memory (they can't be
+    read by another process, and the directory is cleared on start).
+
+    At most `max_sessions` are kept, the least recently used one being dropped
+    beyond it, and sessions idle for `idle_seconds` are dropped.
+    """
+
+    def __init__(self, spill_path=SESSION_SPILL_PATH, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_turns_in_memory: int = SESSION_MAX_TURNS_IN_MEMORY, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.spill_path = spill_path
+        self.max_sessions = max_sessions
+        self.max_turns_in_memory = max_turns_in_memory
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()
+        self.cipher = _create_cipher()
+        # Files left by a previous process can't be decrypted anymore
+        shutil.rmtree(self.spill_path, ignore_errors=True)
+        self._last_eviction = time.monotonic()
+        self._lock = threading.RLock()
+
+    def _spill_file(self, session_id: str):
+        return os.path.join(self.spill_path, f"{session_id}.bin")
+
+    def _session(self, session_id: str) -> Session:
+        now = time.monotonic()
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = Session()
+        self.sessions.move_to_end(session_id)
+        session.last_seen = now
+
+        if now - self._last_eviction > EVICTION_INTERVAL_SECONDS:
+            self._last_eviction = now
+            for idle_id in [key for key, idle in self.sessions.items() if now - idle.last_seen > self.idle_seconds]:
+                self._drop(idle_id)
+        while len(self.sessions) > self.max_sessions:
+            self._drop(next(iter(self.sessions)))
+        return session
+
+    def _drop(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        try:
+            os.remove(self._spill_file(session_id))
+        except FileNotFoundError:
+            pass
+
+    def touch(self, session_id: str):
+        with self._lock:
+            self._session(session_id)
+
+    def append(self, session_id: str, turn: Turn):
+        with self._lock:
+            session = self._session(session_id)
+            session.turns.append(turn)
+            overflow = len(session.turns) - self.max_turns_in_memory
+            if overflow > 0:
+                self._spill(session_id, session, session.turns[:overflow])
+                del session.turns[:overflow]
+
+    def _spill(self, session_id: str, session: Session, turns: list[Turn]):
+        os.makedirs(self.spill_path, exist_ok=True)
+        with open(self._spill_file(session_id), "ab") as spill_file:
+            for turn in turns:
+                spill_file.write(self.cipher.encrypt(turn.dump()) + b"\n")
+        session.spilled += len(turns)
+
+    def recent_turns(self, session_id: str) -> list[Turn]:
+        with self._lock:
+            return list(self._session(session_id).turns)
+
+    def spilled_turns(self, session_id: str) -> list[Turn]:
+        with self._lock:
+            if not self._session(session_id).spilled:
+                return []
+            with open(self._spill_file(session_id), "rb") as spill_file:
+                return [Turn.load(self.cipher.decrypt(line.rstrip(b"\n"))) for line in spill_file if line.strip()]
+
+    def turns(self, session_id: str) -> list[Turn]:
+        with self._lock:
+            return self.spilled_turns(session_id) + self.recent_turns(session_id)
+
+    def messages(self, session_id: str) -> list:
+        """The conversation as LangChain messages, for the history of the next question."""
+        return [turn.to_message() for turn in self.turns(session_id)]
+
+    def counts(self, session_id: str) -> dict:
+        with self._lock:
+            session = self._session(session_id)
+            return {"in_memory": len(session.turns), "spilled": session.spilled}
+
+    def memory_usage(self, session_id: str) -> int:
+        """Approximate bytes held in memory by the session."""
+        with self._lock:
+            session = self._session(session_id)
+            return sys.getsizeof(session) + sys.getsizeof(session.turns) + sum(turn.size() for turn in session.turns)
@@ -1,4 +1,105 @@
-from langchain_ollama import OllamaLLM
+import glob
+import shutil
+import platform
+import threading
+import subprocess
 
-def initialize_model(model_name: str, model_temperature: float = 0.7, model_ctx: int = 4096, model_num_gpu: int = 1, model_keep_alive: bool = True):
-    return OllamaLLM(model=model_name, temperature=model_temperature, num_ctx=model_ctx, num_gpu=model_num_gpu, keep_alive=model_keep_alive)
\ No newline at end of file
+from legal_assistant.config import (
+    OLLAMA_MAX_CONNECTIONS, OLLAMA_MAX_KEEPALIVE_CONNECTIONS, OLLAMA_KEEPALIVE_EXPIRY_SECONDS, OLLAMA_TIMEOUT_SECONDS
+)
+
+def ollama_client_kwargs() -> dict:
+    """Arguments of the httpx clients created by langchain_ollama, which keep a pool of open connections."""
+    import httpx
+
+    return {
+        "timeout": OLLAMA_TIMEOUT_SECONDS,
+        "limits": httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    }
+
+def initialize_model(model_name: str, model_temperature: float = 0.7, model_ctx: int = 4096, model_num_gpu: int = 1, model_keep_alive: int | str = "30m"):
+    # Imported here so the entry points don't pay for the Ollama client until a model is needed
+    from langchain_ollama import OllamaLLM
+
+    return OllamaLLM(
+        model=model_name, temperature=model_temperature, num_ctx=model_ctx, num_gpu=model_num_gpu, keep_alive=model_keep_alive,
+        client_kwargs=ollama_client_kwargs()
+    )
+
+def parse_history(items) -> list:
+    """Builds the history messages from [{"role": "user" | "assistant", "content": str, "source_ids": [...]}]."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    if not isinstance(items, list):
+        raise ValueError("'history' must be a list.")
+    history = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("content"), str):
+            raise ValueError("Each history item must have a 'role' and a 'content'.")
+        if item.get("role") == "user":
+            history.append(HumanMessage(content=item["content"]))
+        elif item.get("role") == "assistant":
+            details = {"source_ids": item.get("source_ids") or []}
+            history.append(AIMessage(content=item["content"], metadata={"processing_details": details}))
+        else:
+            raise ValueError("History roles must be 'user' or 'assistant'.")
+    return history
+
+def detect_gpu() -> str | None:
+    """Returns the name of the GPU Ollama can use, or None, without importing torch."""
+    for info_path in glob.glob("/proc/driver/nvidia/gpus/*/information"):
+        try:
+            with open(info_path, encoding="utf-8") as info_file:
+                for line in info_file:
+                    if line.startswith("Model:"):
+                        return line.split(":", 1)[1].strip()
+        except OSError:
+            continue
+
+    if shutil.which("nvidia-smi"):
+        try:
+            output = subprocess.run(
+                ["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
+                capture_output=True, text=True, timeout=5, check=True
+            ).stdout.strip()
+            if output:
+                return output.splitlines()[0].strip()
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+    if platform.system() == "Darwin" and platform.machine() == "arm64":
+        return "Apple Silicon (Metal)"
+    return None
+
+class lazy_property:
+    """Like functools.cached_property, but the value is built only once even when
+    several threads read it at the same time (e.g. the warm-up and the first question).
+
+    The value is stored in the instance __dict__, which takes precedence over this
+    non-data descriptor, so later reads don't go through the lock.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self._lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.func(instance)
+        return instance.__dict__[self.name]
+
+    @staticmethod
+    def is_loaded(instance, name: str) -> bool:
+        return name in instance.__dict__
@@ -0,0 +1,222 @@
+import os
+import json
+import math
+import mmap
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+
+import logging
+from legal_assistant.logging_formatter import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Rows scored at a time by the exact search, which bounds the float32 copy of the quantized vectors
+SEARCH_BLOCK_ROWS = 32_768
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def relevance_from_distance(distances):
+    """Relevance of squared L2 distances between unit vectors (higher is better), as langchain derives it for Chroma."""
+    return 1.0 - distances / math.sqrt(2)
+
+def _relevance(similarities: np.ndarray) -> np.ndarray:
+    # The squared L2 distance between unit vectors is 2 - 2 * cosine similarity
+    return relevance_from_distance(2.0 - 2.0 * similarities)
+
+def _train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the (unit) vectors."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        filled = np.bincount(assignment, minlength=nlist) > 0
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+class _MappedData:
+    """The arrays of one export. It is replaced as a whole on reload, so a search never mixes two exports."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            self.meta = json.load(meta_file)
+        with open(os.path.join(path, "table.json"), encoding="utf-8") as table_file:
+            table = json.load(table_file)
+        self.ids = table["ids"]
+        self.metadatas = table["metadatas"]
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if self.meta["dtype"] == "int8" else None
+        self.text_offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "texts.bin"), "rb") as texts_file:
+            self.texts = mmap.mmap(texts_file.fileno(), 0, access=mmap.ACCESS_READ) if self.text_offsets[-1] else b""
+        if self.meta["nlist"]:
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        else:
+            self.centroids = self.list_offsets = None
+
+    def similarities(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        scores = self.vectors[start:end].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def document(self, row: int) -> Document:
+        text = self.texts[int(self.text_offsets[row]):int(self.text_offsets[row + 1])].decode("utf-8")
+        return Document(page_content=text, metadata=dict(self.metadatas[row] or {}), id=self.ids[row])
+
+class MappedVectorIndex:
+    """Read-only export of the Chroma collection, searched with NumPy.
+
+    The vectors are stored normalized, as int8 (with one scale per row) or
+    float16, in .npy files opened with mmap, so every process serving queries
+    shares the same copy through the page cache. Search is exact, or restricted
+    to the `nprobe` closest clusters when the export was partitioned (IVF).
+    It exposes the two Chroma methods used by the assistant.
+    """
+
+    def __init__(self, path, nprobe: int = 8):
+        self.path = str(path)
+        self.nprobe = nprobe
+        self.data = None
+        self.mtime = None
+
+    @classmethod
+    def load(cls, path, nprobe: int = 8):
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        index = cls(path, nprobe)
+        index._read()
+        return index
+
+    def _read(self):
+        self.mtime = os.stat(os.path.join(self.path, "meta.json")).st_mtime_ns
+        self.data = _MappedData(self.path)
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(os.path.join(self.path, "meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            logger.info("Vector index changed on disk. Reloading it.")
+            self._read()
+
+    @staticmethod
+    def export(db, path, dtype: str = "int8", nlist: int | None = None, page_size: int = 1000):
+        """Writes the vectors, texts and metadata of the collection to `path`, replacing the previous export."""
+        ids, vectors, texts, metadatas = [], [], [], []
+        offset = 0
+        while True:
+            stored = db.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            ids.extend(stored["ids"])
+            vectors.extend(stored["embeddings"])
+            texts.extend(stored["documents"])
+            metadatas.extend(stored["metadatas"])
+            if len(stored["ids"]) < page_size:
+                break
+            offset += page_size
+
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1) if ids else np.zeros((0, 0), np.float32))
+        nlist = min(nlist or 0, len(ids))
+        list_offsets = None
+        if nlist:
+            centroids = _train_centroids(vectors, nlist)
+            assignment = np.concatenate([
+                np.argmax(vectors[start:start + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+                for start in range(0, len(vectors), SEARCH_BLOCK_ROWS)
+            ])
+            # Rows are grouped by cluster, so each cluster is one contiguous range of the matrix
+            order = np.argsort(assignment, kind="stable")
+            vectors = vectors[order]
+            ids, texts, metadatas = [ids[row] for row in order], [texts[row] for row in order], [metadatas[row] for row in order]
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        if dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0), 1e-12) / 127.0
+            np.save(os.path.join(tmp_path, "vectors.npy"), np.round(vectors / scales[:, None]).astype(np.int8))
+            np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+        elif dtype == "float16":
+            np.save(os.path.join(tmp_path, "vectors.npy"), vectors.astype(np.float16))
+        else:
+            raise ValueError(f"Unsupported vector index dtype: {dtype}")
+        if nlist:
+            np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+            np.save(os.path.join(tmp_path, "list_offsets.npy"), list_offsets)
+
+        encoded_texts = [text.encode("utf-8") for text in texts]
+        with open(os.path.join(tmp_path, "texts.bin"), "wb") as texts_file:
+            for encoded_text in encoded_texts:
+                texts_file.write(encoded_text)
+        text_offsets = np.concatenate([[0], np.cumsum([len(encoded_text) for encoded_text in encoded_texts], dtype=np.int64)])
+        np.save(os.path.join(tmp_path, "text_offsets.npy"), text_offsets.astype(np.int64))
+        with open(os.path.join(tmp_path, "table.json"), "w", encoding="utf-8") as table_file:
+            json.dump({"ids": ids, "metadatas": metadatas}, table_file, ensure_ascii=False)
+        # Written last: its mtime tells the running processes that a new export is complete
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({"dtype": dtype, "dim": int(vectors.shape[1]), "count": len(ids), "nlist": nlist}, meta_file)
+
+        # Processes still searching the previous export keep their mappings of the removed files
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Vector index exported: {len(ids)} vectors ({dtype}, {nlist or 'exact'} clusters)")
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: list[float], k: int = 4) -> list[tuple[Document, float]]:
+        self.reload_if_changed()
+        data = self.data
+        if not data.ids:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+
+        if data.centroids is None:
+            ranges = [(start, min(start + SEARCH_BLOCK_ROWS, len(data.ids))) for start in range(0, len(data.ids), SEARCH_BLOCK_ROWS)]
+        else:
+            closest_lists = np.argsort(data.centroids @ query)[::-1][:self.nprobe]
+            ranges = [(int(data.list_offsets[cluster]), int(data.list_offsets[cluster + 1])) for cluster in closest_lists]
+
+        rows, scores = [], []
+        for start, end in ranges:
+            if end > start:
+                rows.append(np.arange(start, end))
+                scores.append(data.similarities(query, start, end))
+        if not rows:
+            return []
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+
+        k = min(k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        relevances = _relevance(scores[best])
+        return [(data.document(int(rows[position])), float(relevance)) for position, relevance in zip(best, relevances)]
+
+    def get_by_ids(self, ids: list[str]) -> list[Document]:
+        self.reload_if_changed()
+        data = self.data
+        return [data.document(data.rows[chunk_id]) for chunk_id in ids if chunk_id in data.rows]
+
+def search_by_vector(store, embedding: list[float], k: int) -> list[tuple[Document, float]]:
+    """The k chunks closest to the embedding in either backend, best first, with their relevance (higher is better).
+
+    Chroma's similarity_search_by_vector_with_relevance_scores returns the raw
+    distance (lower is better) despite its name, so it is converted here to the
+    scale MappedVectorIndex already returns.
+    """
+    if isinstance(store, MappedVectorIndex):
+        return store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+    results = store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+    return [(doc, float(relevance_from_distance(distance))) for doc, distance in results]
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+pytest.importorskip("pypdf")
+
+from pypdf import PdfReader
+from langchain_core.documents import Document
+
+from legal_assistant.config import DOCUMENTS_PATH
+from legal_assistant.legal_chunker import LegalChunker
+
+def load_pages(filename: str, first_page: int, last_page: int):
+    # Same extraction as database.load_page_range
+    reader = PdfReader(os.path.join(DOCUMENTS_PATH, filename))
+    for page_number in range(first_page, last_page):
+        yield Document(
+            page_content=reader.pages[page_number].extract_text(extraction_mode="plain"),
+            metadata={"source": filename, "file": filename, "page": page_number},
+        )
+
+def test_heading_at_the_top_of_several_pages_is_kept():
+    # "DA ESCRITURAÇÃO" names chapters starting at the top of pages 2, 24 and 37 of the law
+    chunks = list(LegalChunker().split_documents(load_pages("Lei_de_registros_publicos_6015.pdf", 0, 40)))
+
+    structures = {chunk.metadata.get("structure") for chunk in chunks if chunk.metadata["page"] == 36}
+    assert "TÍTULO V - DO REGISTRO DE IMÓVEIS > CAPÍTULO II - DA ESCRITURAÇÃO" in structures
+
+def test_running_headers_are_dropped():
+    # Every page from the 5th on starts with "Código Nacional de Normas – Foro Extrajudicial"
+    chunks = list(LegalChunker().split_documents(load_pages("Codigo_nacional_de_normas_CNJ.pdf", 0, 40)))
+
+    later_chunks = [chunk for chunk in chunks if chunk.metadata["page"] >= 10]
+    assert later_chunks
+    assert not any("Foro Extrajudicial" in chunk.page_content for chunk in later_chunks)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_chroma")
+
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from chromadb.config import Settings
+
+from legal_assistant.vector_index import MappedVectorIndex, search_by_vector
+
+DIMENSIONS = 16
+
+def unit_vectors(count: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, DIMENSIONS))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class NoEmbeddings(Embeddings):
+    # The tests search by vector, so nothing is ever embedded
+    def embed_documents(self, texts):
+        raise AssertionError("unexpected embedding call")
+
+    def embed_query(self, text):
+        raise AssertionError("unexpected embedding call")
+
+@pytest.fixture
+def backends(tmp_path):
+    db = Chroma(persist_directory=str(tmp_path / "chroma"), embedding_function=NoEmbeddings(),
+                client_settings=Settings(anonymized_telemetry=False))
+    vectors = unit_vectors(50, seed=1)
+    ids = [f"doc.pdf:{row}" for row in range(len(vectors))]
+    db._collection.upsert(
+        ids=ids, embeddings=vectors.tolist(), documents=[f"chunk {row}" for row in range(len(vectors))],
+        metadatas=[{"id": chunk_id} for chunk_id in ids]
+    )
+    MappedVectorIndex.export(db, tmp_path / "vector_index", dtype="float16")
+    return db, MappedVectorIndex.load(tmp_path / "vector_index", nprobe=1)
+
+def test_backends_rank_the_same_chunks_with_the_same_scores(backends):
+    db, index = backends
+    for query in unit_vectors(5, seed=2):
+        chroma_results = search_by_vector(db, query.tolist(), k=50)
+        mapped_results = search_by_vector(index, query.tolist(), k=50)
+
+        chroma_scores = [score for _doc, score in chroma_results]
+        assert chroma_scores == sorted(chroma_scores, reverse=True)
+        # The float16 export may swap chunks whose scores differ by less than its precision
+        score_by_id = {doc.metadata["id"]: score for doc, score in chroma_results}
+        mapped_ids = [doc.metadata["id"] for doc, _score in mapped_results]
+        assert sorted(mapped_ids) == sorted(score_by_id)
+        assert [score for _doc, score in mapped_results] == pytest.approx([score_by_id[chunk_id] for chunk_id in mapped_ids], abs=1e-3)
+        in_mapped_order = [score_by_id[chunk_id] for chunk_id in mapped_ids]
+        assert all(earlier >= later - 1e-3 for earlier, later in zip(in_mapped_order, in_mapped_order[1:]))
+
+def test_closest_chunk_has_the_highest_relevance(backends):
+    db, index = backends
+    target = unit_vectors(50, seed=1)[7]
+    for store in (db, index):
+        (best, score), *_rest = search_by_vector(store, target.tolist(), k=3)
+        assert best.metadata["id"] == "doc.pdf:7"
+        assert score == pytest.approx(1.0, abs=1e-2)